@@ -1,89 +1,169 @@
 import pandas as pd
 import os
 import time
-import concurrent.futures
-from tqdm import tqdm
-from read_iqvia import read_iqvia_header
+import functools
+from read_iqvia import read_iqvia_header, read_ndc_codes, ndc_filter
+from scan_claims import ClaimsScanner
+from classify_diag import classify_diags
+from part_scheduler import part_tasks, run_part_tasks, utilization_report
+from instrument import report_metrics
+from part_manifest import PartManifest, config_key, resumable_task
+from sinks import CsvSink
+from onboarding import INCREMENTAL, OnboardingState, available_years, partition_digest
+from pat_codes import PatDict
+from condition_lookup import update_year, rebuild_lookup
 
 # Load obesity and T2D codes
 obesity_codes = set(pd.read_csv('/home/stofer@chapman.edu/merck_proposal/glp_pats/obesity_codes.csv')['code'].astype(str))
 t2d_codes = set(pd.read_csv('/home/stofer@chapman.edu/merck_proposal/glp_pats/t2d_codes.csv')['code'].astype(str))
 
-def classify_row(diags):
-    patient_codes = set(filter(pd.notna, diags))  # drop NaNs
-    has_obesity = not patient_codes.isdisjoint(obesity_codes)
-    has_t2d = not patient_codes.isdisjoint(t2d_codes)
-
-    if has_obesity and has_t2d:
-        return "Both"
-    elif has_obesity:
-        return "Obesity"
-    elif has_t2d:
-        return "T2D"
-    else:
-        return None  # filter out later
-
-def read_iqvia_claims(year):
-    use_cols = [0, 19, *range(22, 34)]  # pat_id, to_dt, diag1–12
-    claims_folder = '/sharefolder/IQVIA'
-    year_folder = os.path.join(claims_folder, f'claims_{year}')
-    csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
-    csv_files = [file for file in os.listdir(csv_in_parts_folder) if file.endswith('.csv')]
+DIAG_COLS = [f"diag{i}" for i in range(1, 13)]
+CLAIM_COLS = ["pat_id", "to_dt"] + DIAG_COLS
+USE_COLS = [0, 19, *range(22, 34)]  # pat_id, to_dt, diag1–12
 
-    filtered_data_list = []
+# Also pull the GLP1-RA NDC claims (iqvia_ndc_{year}.csv) in the same scan of the claims parts
+EXTRACT_NDC = True
+NDC_OUTPUT_FOLDER = '/sharefolder/wanglab/merck_proposal'
+# Only parse claim lines that contain an obesity/T2D/NDC code (exact filters still applied)
+PREFILTER = True
 
-    for csv_file in tqdm(csv_files, desc=f"Year {year}"):
-        file_path = os.path.join(csv_in_parts_folder, csv_file)
-        data_part = pd.read_csv(file_path, sep='|', header=None, dtype=str, usecols=use_cols)
-        data_part.columns = ["pat_id", "to_dt", "diag1", "diag2", "diag3", "diag4", 
-                             "diag5", "diag6", "diag7", "diag8", "diag9", "diag10", "diag11", "diag12"]
+def diagnosis_filter(year):
+    def consume(data_part):
+        data_part = data_part.copy()
+        data_part.columns = CLAIM_COLS
 
         data_part['to_dt'] = pd.to_datetime(data_part['to_dt'], errors='coerce')
 
         # NEW: restrict to the current year only
-        data_part = data_part[data_part['to_dt'].dt.year == int(year)]
+        data_part = data_part[data_part['to_dt'].dt.year == int(year)].copy()
 
-        # classify each row
-        diag_cols = [f"diag{i}" for i in range(1, 13)]
-        data_part['condition'] = data_part[diag_cols].apply(lambda row: classify_row(row.values), axis=1)
+        # classify all rows at once (same labels as classify_row)
+        data_part['condition'] = classify_diags(data_part[DIAG_COLS], obesity_codes, t2d_codes)
 
         # keep only patients with a relevant condition
-        data_part = data_part.dropna(subset=['condition'])
-
-        if not data_part.empty:
-            filtered_data_list.append(data_part)
-
-    return pd.concat(filtered_data_list, ignore_index=True) if filtered_data_list else pd.DataFrame()
-
-def process_year(year):
-    start_time = time.time()
-    iqvia_data = read_iqvia_claims(year)
-
-    if iqvia_data.empty:
-        print(f"No valid patients found for year {year}", flush=True)
-        return
-
+        return data_part.dropna(subset=['condition'])
+    return consume
+
+def make_scanner(year, header_data, ndc_codes=None):
+    header = header_data[year]
+    prefilter_codes = None
+    if PREFILTER:
+        prefilter_codes = obesity_codes | t2d_codes | set(ndc_codes or [])
+    scanner = ClaimsScanner(year, header_data, prefilter_codes=prefilter_codes)
+    scanner.register('diagnosis', diagnosis_filter(year), columns=[header[i] for i in USE_COLS])
+    if ndc_codes is not None:
+        scanner.register('ndc', ndc_filter(ndc_codes))
+    return scanner
+
+def scan_part(year, file_path, header_data, ndc_codes=None):
+    """Scheduler task: run every consumer on one claims part."""
+    return make_scanner(year, header_data, ndc_codes).scan_part_task(file_path)
+
+def save_year(year, part_results, header_data, pat_dict, ndc_codes=None):
+    """
+    Write one year's outputs from its per-part scan results, one part at a time
+
+    part_results may be a generator (PartManifest.iter_all), so only one part's filtered
+    rows are in memory; they are appended to the output files through sinks.CsvSink.
+    """
+    scanner = make_scanner(year, header_data, ndc_codes)
     selected_columns = ["pat_id", "to_dt", "condition"]
-    iqvia_data = iqvia_data[selected_columns]
-
     output_path = f'/home/stofer@chapman.edu/federated_analysis/tableau/data/iqvia_pat_{year}.csv'
-    iqvia_data.to_csv(output_path, index=False)
+    ndc_path = os.path.join(NDC_OUTPUT_FOLDER, f'iqvia_ndc_{year}.csv')
+
+    pat_sink = CsvSink(output_path)
+    ndc_sink = CsvSink(ndc_path) if ndc_codes is not None else None
+    pat_conditions = []
+    try:
+        for outputs in scanner.stream(part_results):
+            if ndc_sink is not None and not outputs['ndc'].empty:
+                ndc_sink.write(outputs['ndc'])
+            diagnosis = outputs['diagnosis']
+            if not diagnosis.empty:
+                pat_sink.write(diagnosis[selected_columns])
+                pat_conditions.append(diagnosis[['pat_id', 'condition']])
+        if ndc_sink is not None:
+            if not ndc_sink.rows:
+                # keep the claims header (5_ parses to_dt) even when no NDC rows matched
+                ndc_sink.write(pd.DataFrame(columns=header_data[year]))
+    except BaseException:
+        pat_sink.abort()
+        if ndc_sink is not None:
+            ndc_sink.abort()
+        raise
+    if ndc_sink is not None:
+        ndc_sink.close()
+    if pat_sink.rows:
+        pat_sink.close()
+    else:
+        pat_sink.abort()
+    scanner.report()
 
-    elapsed_time = time.time() - start_time
-    print(f"Year {year} completed in {elapsed_time:.2f} seconds", flush=True)
+    if pat_conditions:
+        iqvia_data = pd.concat(pat_conditions, ignore_index=True)
+    else:
+        iqvia_data = pd.DataFrame(columns=["pat_id", "condition"])
+    # pat_id -> strongest condition of this year, for the lookup used by 3_ and 8_
+    # (update_year saves the new pat_id codes before writing the table)
+    n_pats = update_year(year, iqvia_data['pat_id'], iqvia_data['condition'], pat_dict)
+    print(f"Year {year}: {n_pats} patients in the condition lookup", flush=True)
+    if not pat_sink.rows:
+        print(f"No valid patients found for year {year}", flush=True)
+        return
+    print(f"Year {year} saved", flush=True)
 
 def main():
+    start_time = time.time()
     years = [str(year) for year in range(2010, 2023)]
-    read_iqvia_header()  # still call if needed for consistency
-
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = {executor.submit(process_year, year): year for year in years}
-        for future in concurrent.futures.as_completed(futures):
-            year = futures[future]
-            try:
-                future.result()
-            except Exception as e:
-                print(f"Error processing year {year}: {e}", flush=True)
+    header_data = read_iqvia_header()
+    ndc_codes = read_ndc_codes() if EXTRACT_NDC else None
+
+    if INCREMENTAL:
+        # Only claims years that are new (e.g. claims_2023) or whose parts changed since the last run
+        state = OnboardingState()
+        digests = {year: partition_digest('claims', year) for year in available_years('claims') if year in header_data}
+        years = state.changed('0_claims', digests)
+        print(f"Incremental: {len(years)} new/changed claims years {years}", flush=True)
+
+    # Finished parts are kept per year (part_manifest.py), so a crashed run only redoes unfinished parts
+    key = config_key(obesity_codes, t2d_codes, ndc_codes)
+    manifests = {year: PartManifest('0_claims', year, key=key) for year in years}
+
+    # One task per (year, claims part); results are merged per year below
+    tasks = part_tasks('claims', years)
+    year_parts = {}
+    for year, file_path in tasks:
+        year_parts.setdefault(year, []).append(file_path)
+    pending = [(year, file_path) for year, parts in year_parts.items()
+               for file_path in manifests[year].pending(parts)]
+    print(f"{len(tasks) - len(pending)} of {len(tasks)} parts already done, processing {len(pending)}", flush=True)
+
+    scan_fn = functools.partial(scan_part, header_data=header_data, ndc_codes=ndc_codes)
+    task_fn = functools.partial(resumable_task, task_fn=scan_fn, stage='0_claims', key=key)
+    _, errors, timings = run_part_tasks(pending, task_fn)
+    utilization_report(timings)
+
+    pat_dict = PatDict()
+    saved_years = 0
+    for year in years:
+        if year in errors:
+            print(f"Error processing year {year}: {len(errors[year])} parts failed, not saved "
+                  f"(finished parts are kept for the next run)", flush=True)
+            continue
+        if year in year_parts:
+            part_results = manifests[year].iter_all(year_parts[year])
+            save_year(year, part_results, header_data, pat_dict, ndc_codes)
+            saved_years += 1
+            manifests[year].clear()
+            if INCREMENTAL:
+                state.mark('0_claims', year, digests[year])
+
+    if saved_years:
+        rebuild_lookup()
+
+    report_metrics()
+    elapsed_time = time.time() - start_time
+    print(f"All years completed in {elapsed_time:.2f} seconds", flush=True)
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
-import pandas as pd
+from onboarding import INCREMENTAL, OnboardingState, replace_years
+from schema import read_table, write_table, decode_pay_type
 
 # -----------------------------
 # Paths
@@ -6,32 +7,17 @@ import pandas as pd
 input_file = "/home/stofer@chapman.edu/federated_analysis/tableau/payment_almost_all_filled.csv"
 output_file = "/home/stofer@chapman.edu/federated_analysis/tableau/FINAL_DATA.csv"
 
-# -----------------------------
-# Mapping dictionary
-# -----------------------------
-insurance_map = {
-    "A": "Medicare Part C",
-    "C": "Commercial",
-    "K": "State Children's Health Insurance Program (SCHIP)",
-    "M": "Medicaid",
-    "R": "Medicare Risk",
-    "S": "Self-Insured",
-    "T": "Medicare Cost",
-    "U": "Unknown/Missing",
-    "X": "RX Only"
-}
-
 # -----------------------------
 # Load data
 # -----------------------------
-df = pd.read_csv(input_file, dtype=str)
+df = read_table(input_file)
 initial_rows = len(df)
 
 # -----------------------------
 # 1. Map pay_type
 # -----------------------------
-# Only replace if not already mapped
-df['pay_type'] = df['pay_type'].map(insurance_map).fillna(df['pay_type'])
+# Relabel the pay_type categories (schema.INSURANCE_MAP); already mapped names are kept
+df['pay_type'] = decode_pay_type(df['pay_type'])
 
 # -----------------------------
 # 2. Drop rows with ANY NA values
@@ -51,7 +37,13 @@ if 'zip' in df.columns:
 # -----------------------------
 # 4. Save final file
 # -----------------------------
-df.to_csv(output_file, index=False)
+if INCREMENTAL:
+    # input only holds the delta years written by 5_adjust_dataframe.py
+    state = OnboardingState()
+    replace_years(output_file, df, state.delta_years())
+    state.set_delta_years([])
+else:
+    write_table(df, output_file)
 
 print(f"Final dataset saved: {output_file}")
 print(f"Initial rows: {initial_rows}, Final rows: {after_drop}, Columns: {len(df.columns)}")
@@ -4,43 +4,44 @@ Train a LR model to predict GLP1 usage
 
 import pandas as pd
 import statsmodels.api as sm
+from sinks import write_csv
+from zip_enrichment import ZipEnrichment
+from rate_engine import read_chunks, distinct_counter
 
 # Load data
-final_df = pd.read_csv("FINAL_DATA.csv")
-uszips = pd.read_csv("uszips.csv")
+zips = ZipEnrichment()  # prebuilt uszips.csv indexed by integer ZIP (zip_enrichment.py)
 state_pop = pd.read_csv("state_pop_estimates.csv")
 
 print('Loaded data!')
 
-# Merge state population estimates on state + year
-final_df = final_df.merge(
-    state_pop,
-    left_on=["pat_state", "year"],
-    right_on=["state_abbrev", "year"],
-    how="left"
-)
-
-# Aggregate to zip × year
-df_grouped = final_df.groupby(['weighted_zip', 'year']).agg(
-    glp1ra_count=('pat_id', 'nunique'),   # number of unique patients on GLP1
-    state_population=('population', 'mean')  # from state_pop_estimates.csv
-).reset_index()
-
-# Merge with neighborhood data
-merged = pd.merge(
-    df_grouped,
-    uszips,
-    left_on="weighted_zip",
-    right_on="zip",
-    how="left",
-    suffixes=("_final", "_uszips")
-)
+# Aggregate to zip × year, reading only the needed FINAL_DATA columns in chunks (rate_engine.py)
+patients = distinct_counter(['weighted_zip', 'year'])  # number of unique patients on GLP1, exact across chunks (or HLL, hll.py)
+population_parts = []
+for chunk in read_chunks("FINAL_DATA.csv", ['pat_id', 'year', 'pat_state', 'weighted_zip'], dtype={'weighted_zip': str}):
+    # Merge state population estimates on state + year
+    chunk = chunk.merge(
+        state_pop,
+        left_on=["pat_state", "year"],
+        right_on=["state_abbrev", "year"],
+        how="left"
+    )
+    patients.add(chunk)
+    population_parts.append(chunk.groupby(['weighted_zip', 'year'])['population'].agg(['sum', 'count']))
+
+# state_population: mean of the row populations (from state_pop_estimates.csv)
+population = pd.concat(population_parts).groupby(level=[0, 1]).sum()
+df_grouped = patients.counts('glp1ra_count')
+df_grouped['state_population'] = (population['sum'] / population['count']).reindex(
+    pd.MultiIndex.from_frame(df_grouped[['weighted_zip', 'year']])).to_numpy()
+df_grouped['weighted_zip'] = pd.to_numeric(df_grouped['weighted_zip'])  # numeric, as read_csv parses it
+df_grouped = df_grouped.sort_values(['weighted_zip', 'year']).reset_index(drop=True)
+
+# Attach neighborhood data (weighted_zip -> uszips row)
+neighborhood = zips.attributes(df_grouped["weighted_zip"])
+neighborhood["zip"] = pd.to_numeric(neighborhood["zip"])  # numeric, as read from uszips.csv
+merged = pd.concat([df_grouped, neighborhood], axis=1)
 print('Merged all data!')
 
-# Drop FINAL_DATA duplicates if also in uszips
-drop_cols = [col for col in merged.columns if col.endswith("_final")]
-merged = merged.drop(columns=drop_cols)
-
 # Normalize outcome (rate per 1,000)
 merged['glp1ra_rate'] = merged['glp1ra_count'] / merged['state_population'] * 1000
 
@@ -79,4 +80,4 @@ model = sm.OLS(y, X).fit()
 print('Done!')
 print(model.summary())
 
-merged.to_csv('MERGED_DATA.csv', index = False)
+write_csv(merged, 'MERGED_DATA.csv')
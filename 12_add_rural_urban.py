@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from sinks import write_csv
 
 print("Loading data files...")
 
@@ -106,7 +107,7 @@ merged_df = merged_df.drop(columns=['county_fips_str'])
 
 # Save the result
 output_file = "MERGED_DATA_FOR_LR_NEW.csv"
-merged_df.to_csv(output_file, index=False)
+write_csv(merged_df, output_file)
 print(f"\n Saved to {output_file}")
 print(f"   Total rows: {len(merged_df)}")
 print(f"   Total columns: {len(merged_df.columns)}")
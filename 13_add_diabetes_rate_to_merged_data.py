@@ -5,6 +5,7 @@ to MERGED_DATA_FOR_LR_NEW.csv
 
 import pandas as pd
 import os
+from sinks import write_csv
 
 def add_diabetes_rate(input_file, output_file):
     """
@@ -78,7 +79,7 @@ def add_diabetes_rate(input_file, output_file):
     
     # Save to output file
     print(f"\nSaving to {output_file}...")
-    df_merged.to_csv(output_file, index=False)
+    write_csv(df_merged, output_file)
     
     print(f"   Saved! Output shape: {df_merged.shape}")
     print(f"   New columns added: 'diabetes_patients_count', 'diabetes_rate'")
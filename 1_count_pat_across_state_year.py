@@ -1,27 +1,53 @@
 import pandas as pd
+import numpy as np
 import os
+import glob
+from read_iqvia import ENROLL_HEADER, source_folder, list_parts, read_part
+from enroll_index import iter_enroll
+from pat_codes import PatDict
+from instrument import PartLog, report_metrics
+from onboarding import INCREMENTAL, OnboardingState, file_digest, partition_digest, replace_years
+from sinks import write_csv
+from rate_engine import distinct_counter
 
 # -----------------------------
 # Paths
 # -----------------------------
-claims_folder = '/sharefolder/IQVIA'
-year_folder = os.path.join(claims_folder, 'enroll_synth')
-csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
+csv_in_parts_folder = source_folder('enroll_synth')
 
 data_folder = '/home/stofer@chapman.edu/federated_analysis/tableau/data'
 output_file = os.path.join(data_folder, 'updated_state_counts.csv')
 
 # Enrollment file headers
-header_data = [
-    'der_sex', 'der_yob', 'pat_id', 'pat_region', 'pat_state', 'pat_zip3',
-    'grp_indv_cd', 'mh_cd', 'enr_rel'
-]
+header_data = ENROLL_HEADER
+# Only these enrollment columns are used below
+enroll_columns = ['der_yob', 'pat_id', 'pat_state']
+# Fetch patients through the pat_id index (enroll_index.py) instead of scanning every part
+USE_ENROLL_INDEX = True
+
+# -----------------------------
+# Years to count (incremental: only years whose patient file or the enrollment data changed)
+# -----------------------------
+count_years = list(range(2010, 2023))
+if INCREMENTAL:
+    state = OnboardingState()
+    pat_files = glob.glob(os.path.join(data_folder, "iqvia_pat_*.csv"))
+    year_digests = {int(os.path.basename(path)[len("iqvia_pat_"):-len(".csv")]): file_digest(path)
+                    for path in pat_files}
+    enroll_digest = partition_digest('enroll_synth')
+    if state.changed('1_enroll', {'enroll_synth': enroll_digest}):
+        count_years = sorted(year_digests)
+    else:
+        count_years = [int(year) for year in state.changed('1_counts', year_digests)]
+    print(f"Incremental: counting years {count_years}")
+    if not count_years:
+        raise SystemExit(f"No new or changed patient files, {output_file} is up to date")
 
 # -----------------------------
 # Collect patient IDs per year from condition files
 # -----------------------------
 patient_years = []
-for year in range(2010, 2023):
+for year in count_years:
     file_path = os.path.join(data_folder, f"iqvia_pat_{year}.csv")
     if not os.path.exists(file_path):
         print(f"File not found: {file_path}")
@@ -35,65 +61,95 @@ for year in range(2010, 2023):
     patient_years.append(df_pat[['pat_id', 'year']])
 
 patient_years_df = pd.concat(patient_years, ignore_index=True)
-patient_list = patient_years_df['pat_id'].unique().tolist()
+patient_list = patient_years_df['pat_id'].unique()
+
+# Join / dedupe / count on integer patient codes instead of pat_id strings
+pat_dict = PatDict()
+patient_years_df['pat_int'] = pat_dict.encode(patient_years_df['pat_id'])
+patient_years_df = patient_years_df[['pat_int', 'year']].drop_duplicates()
+pat_dict.save()
+
+# Patient-years sorted by pat_int: the years of a patient are one slice (found with searchsorted)
+patient_years_df = patient_years_df[patient_years_df['pat_int'] >= 0].sort_values(['pat_int', 'year'])
+year_pat_ints = patient_years_df['pat_int'].to_numpy()
+year_values = patient_years_df['year'].to_numpy()
+
+# pat_int -> in patient list (for filtering enrollment parts without a Python list / isin),
+# sized to the largest listed pat_int (empty when no patients were found)
+in_patient_list = np.zeros(year_pat_ints.max() + 1 if len(year_pat_ints) else 0, dtype=bool)
+in_patient_list[year_pat_ints] = True
 
 # -----------------------------
 # Read enrollment data in parts, filter to patient list
 # -----------------------------
-def read_enroll(header_data, patient_list):
+def enroll_parts(header_data, patient_list):
+    """Yield the enrollment rows (enroll_columns) of the listed patients, one part at a time."""
     if not os.path.exists(csv_in_parts_folder):
         print(f"Folder not found: {csv_in_parts_folder}")
-        return pd.DataFrame()
-
-    csv_files = [file for file in os.listdir(csv_in_parts_folder) if file.endswith('.csv')]
-    all_filtered_data = []
-
-    for i, csv_file in enumerate(csv_files, start=1):
-        file_path = os.path.join(csv_in_parts_folder, csv_file)
-        data_part = pd.read_csv(file_path, sep='|', header=None, dtype=str)
-        data_part.columns = header_data
-
-        filtered_data = data_part[data_part['pat_id'].isin(patient_list)]
-        all_filtered_data.append(filtered_data)
+        return
+
+    metrics = PartLog('1_read_enroll')
+    if USE_ENROLL_INDEX:
+        for part in iter_enroll(patient_list, header_data, metrics=metrics):
+            yield part[enroll_columns]
+        return
+
+    csv_files = list_parts('enroll_synth')
+    for i, file_path in enumerate(csv_files, start=1):
+        with metrics.part(file_path) as record:
+            with record.timer('parse'):
+                data_part = read_part(file_path, header_data, columns=enroll_columns)
+
+            with record.timer('filter'):
+                pat_ints = pat_dict.encode(data_part['pat_id'], add_new=False)
+                keep = (pat_ints >= 0) & (pat_ints < len(in_patient_list))
+                keep[keep] = in_patient_list[pat_ints[keep]]
+                filtered_data = data_part[keep]
+            record.rows(parsed=len(data_part), kept=len(filtered_data))
+        yield filtered_data
         print(f"Processed enroll file {i}/{len(csv_files)}", flush=True)
 
-    if all_filtered_data:
-        return pd.concat(all_filtered_data, ignore_index=True)
-    else:
-        return pd.DataFrame()
-
-enroll_result = read_enroll(header_data, patient_list)
-
-# -----------------------------
-# Merge patient list with enrollment demographics
-# -----------------------------
-# Merge patient list with enrollment demographics
-merged = pd.merge(patient_years_df, enroll_result, on='pat_id', how='inner')
-
-# NEW: drop duplicate rows to ensure counts aren’t inflated
-merged = merged.drop_duplicates(subset=['pat_id', 'year', 'pat_state'])
-# Drop missing yob
-merged = merged.dropna(subset=['der_yob'])
-merged['der_yob'] = merged['der_yob'].astype(int)
-
-# Compute age
-merged['age'] = merged['year'] - merged['der_yob']
-
-# Keep adults only (18–64)
-merged = merged[(merged['age'] >= 18) & (merged['age'] <= 65)]
-
 # -----------------------------
-# Group by year + state
+# Count adults per year + state while scanning
 # -----------------------------
-state_counts = (
-    merged.groupby(['year', 'pat_state'])['pat_id']
-    .nunique()
-    .reset_index()
-    .rename(columns={'pat_id': 'count'})
-)
+def count_part(counter, enroll_part):
+    """
+    Add one enrollment part to counter: one row per patient-year of its patients
+    (joined through the sorted patient-years, never the whole merge), ages 18-65 only
+    """
+    pat_ints = pat_dict.encode(enroll_part['pat_id'], add_new=False)
+    first = np.searchsorted(year_pat_ints, pat_ints, side='left')
+    n_years = np.searchsorted(year_pat_ints, pat_ints, side='right') - first
+    rows = np.repeat(np.arange(len(enroll_part)), n_years)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(n_years) - n_years, n_years)
+
+    merged = enroll_part.iloc[rows][['der_yob', 'pat_state']].assign(
+        pat_int=pat_ints[rows], year=year_values[first[rows] + offsets])
+
+    # Drop missing yob
+    merged = merged.dropna(subset=['der_yob'])
+    # Compute age, keep adults only (18–64)
+    age = merged['year'] - merged['der_yob'].astype(int)
+    counter.add(merged[(age >= 18) & (age <= 65)])
+
+# exact distinct (year, state, patient) pairs, or HyperLogLog sketches with hll.APPROX_DISTINCT
+# (see rate_engine.distinct_counter); duplicate enrollment rows are counted once either way
+counter = distinct_counter(['year', 'pat_state'], 'pat_int')
+for enroll_part in enroll_parts(header_data, patient_list):
+    count_part(counter, enroll_part)
+report_metrics()
+
+state_counts = counter.counts('count')
 
 # -----------------------------
 # Save
 # -----------------------------
-state_counts.to_csv(output_file, index=False)
+if INCREMENTAL:
+    # Distinct counts can't be added up, so the recounted years replace their old rows
+    replace_years(output_file, state_counts, count_years)
+    for year in count_years:
+        state.mark('1_counts', year, year_digests[year])
+    state.mark('1_enroll', 'enroll_synth', enroll_digest)
+else:
+    write_csv(state_counts, output_file)
 print(f"Saved state counts to {output_file}")
@@ -1,40 +1,43 @@
 import pandas as pd
-import os
-import concurrent.futures
+import functools
+from read_iqvia import ENROLL2_HEADER, read_part
+from composite_key import PatMonthSet
+from pat_codes import split_pat_key
+from part_scheduler import part_tasks, run_part_tasks, utilization_report
+from instrument import PartLog, report_metrics
+from part_manifest import PartManifest, config_key, file_key, resumable_task
+from sinks import write_csv
 
-def read_enroll(year_pat_date):
-    year, pat_date_list = year_pat_date
-    claims_folder = '/sharefolder/IQVIA'  
-    year_folder = os.path.join(claims_folder, f'enroll2_{year}')
-    csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
-    csv_files = [file for file in os.listdir(csv_in_parts_folder) if file.endswith('.csv')]
+GLP1_PAT_FILE = '/home/stofer@chapman.edu/federated_analysis/GLP1_pat_states.csv'
+OUTPUT_FILE = '/home/stofer@chapman.edu/federated_analysis/tableau/payment_type.csv'
 
+def pat_dates_for_year(pat_date_list):
     pat_date_df = pd.DataFrame(pat_date_list, columns=['pat_key', 'month_id'])
-    pat_date_df['pat_id'] = pat_date_df['pat_key'].str.extract(r'^(.*)_\d+$')
+    pat_date_df['pat_id'] = split_pat_key(pat_date_df['pat_key'])['pat_id']
+    return pat_date_df
 
-    pat_date_set = set(pat_date_df[['pat_id', 'month_id']].apply(tuple, axis=1))
-    header_data = ['pat_id', 'mstr_enroll_cd', 'prd_type', 'pay_type', 'pcob_type', 'mcob_type', 'month_id']
-    filtered_data_list = []
-
-    for i, csv_file in enumerate(csv_files, 1):
-        file_path = os.path.join(csv_in_parts_folder, csv_file)
-        data_part = pd.read_csv(file_path, sep='|', header=None, dtype=str)
-        data_part.columns = header_data
-
-        data_part = data_part[data_part[['pat_id', 'month_id']].apply(tuple, axis=1).isin(pat_date_set)]
-        filtered_data_list.append(data_part)
-        print(f"[{year}] Appended part {i}/{len(csv_files)}", flush=True)
+def filter_enroll_part(year, file_path, pat_date_sets):
+    """Scheduler task: keep the target (pat_id, month_id) rows of one enroll2 part."""
+    with PartLog('2_read_enroll', year).part(file_path) as record:
+        with record.timer('parse'):
+            data_part = read_part(file_path, ENROLL2_HEADER)
+        with record.timer('filter'):
+            filtered_data = data_part[pat_date_sets[year].isin(data_part['pat_id'], data_part['month_id'])]
+        record.rows(parsed=len(data_part), kept=len(filtered_data))
+    return filtered_data
 
+def merge_enroll_year(year, filtered_data_list, pat_date_df):
+    print(f"[{year}] Merging {len(filtered_data_list)} parts", flush=True)
     if filtered_data_list:
         result = pd.concat(filtered_data_list, ignore_index=True)
         # Merge back to restore pat_key
         result = result.merge(pat_date_df[['pat_key', 'pat_id', 'month_id']], on=['pat_id', 'month_id'], how='left')
         return result
     else:
-        return pd.DataFrame(columns=header_data + ['pat_key'])
+        return pd.DataFrame(columns=ENROLL2_HEADER + ['pat_key'])
     
 # Load condition + filter all_data
-all_data = pd.read_csv('/home/stofer@chapman.edu/federated_analysis/GLP1_pat_states.csv')
+all_data = pd.read_csv(GLP1_PAT_FILE)
 
 # Extract index_date and year
 all_data['index_date'] = pd.to_datetime(all_data['index_date'])
@@ -49,13 +52,36 @@ year_to_pat_date = (
     .to_dict()
 )
 
-# Use multiprocessing to process each year
+year_to_pat_date_df = {year: pat_dates_for_year(pat_date_list) for year, pat_date_list in year_to_pat_date.items()}
+pat_date_sets = {year: PatMonthSet(df['pat_id'], df['month_id']) for year, df in year_to_pat_date_df.items()}
+
+# Finished parts are kept per year (part_manifest.py); a rerun after a crash only reads unfinished parts
+key = config_key(file_key(GLP1_PAT_FILE))
+manifests = {year: PartManifest('2_enroll2', year, key=key) for year in year_to_pat_date}
+
+# Use multiprocessing over (year, part) tasks
 print("Starting parallel read of enrollment files...")
-with concurrent.futures.ProcessPoolExecutor() as executor:
-    results = list(executor.map(read_enroll, year_to_pat_date.items()))
+tasks = part_tasks('enroll2', sorted(year_to_pat_date))
+year_parts = {}
+for year, file_path in tasks:
+    year_parts.setdefault(year, []).append(file_path)
+pending = [(year, file_path) for year, parts in year_parts.items() for file_path in manifests[year].pending(parts)]
+print(f"{len(tasks) - len(pending)} of {len(tasks)} parts already done, processing {len(pending)}")
+
+task_fn = functools.partial(resumable_task, task_fn=filter_enroll_part, stage='2_enroll2', key=key)
+_, errors, timings = run_part_tasks(pending, task_fn, shared=pat_date_sets)
+utilization_report(timings)
+report_metrics()
+if errors:
+    raise RuntimeError(f"Enrollment parts failed for years {sorted(errors)} (finished parts are kept for the next run)")
+
+results = [merge_enroll_year(year, manifests[year].load_all(year_parts.get(year, [])), year_to_pat_date_df[year])
+           for year in sorted(year_to_pat_date)]
 
 # Combine all enrollment data
 final_enroll_df = pd.concat(results, ignore_index=True)
 
 # Get and save value counts
-final_enroll_df.to_csv("/home/stofer@chapman.edu/federated_analysis/tableau/payment_type.csv", header=True, index = False)
+write_csv(final_enroll_df, OUTPUT_FILE)
+for manifest in manifests.values():
+    manifest.clear()
@@ -1,25 +1,16 @@
 import pandas as pd
-
-# Your mapping dictionary
-insurance_map = {
-    "A": "Medicare Part C",
-    "C": "Commercial",
-    "K": "State Children's Health Insurance Program (SCHIP)",
-    "M": "Medicaid",
-    "R": "Medicare Risk",
-    "S": "Self-Insured",
-    "T": "Medicare Cost",
-    "U": "Unknown/Missing",
-    "X": "RX Only"
-}
+from sinks import write_csv
+from schema import decode_pay_type
+from pat_codes import split_pat_key
+from condition_lookup import ConditionLookup
 
 # -------------------------------
 # Step 1: Load the payment_type.csv
 # -------------------------------
 payment_df = pd.read_csv("payment_type.csv", dtype=str)
 
-# Step 2: Map pay_type codes to full descriptions
-payment_df["pay_type"] = payment_df["pay_type"].map(insurance_map)
+# Step 2: Map pay_type codes to full descriptions (categorical relabel, see schema.INSURANCE_MAP)
+payment_df["pay_type"] = decode_pay_type(payment_df["pay_type"], keep_unknown=False)
 
 # -------------------------------
 # Step 3: Load GLP1_pat_states.csv
@@ -32,17 +23,19 @@ glp1_df = pd.read_csv("/home/stofer@chapman.edu/federated_analysis/GLP1_pat_stat
 merged_df = glp1_df.merge(payment_df[["pat_key", "pay_type"]], on="pat_key", how="left")
 
 
-pat_conditions = pd.read_csv(
-    "/home/stofer@chapman.edu/merck_proposal/icd_pats/patient_conditions.csv"
-)  # columns: pat_key, condition
+# Attach each patient's condition in the year of the index date
+# ((pat_id, year) lookup maintained by 0_pull_all_T2Dobese_pats.py)
+lookup = ConditionLookup()
+index_year = pd.to_datetime(merged_df["index_date"], errors="coerce").dt.year
+merged_df["condition"] = lookup.conditions(split_pat_key(merged_df["pat_key"])["pat_id"], index_year)
 
-# Merge to attach condition to each patient
-df = merged_df.merge(pat_conditions, on="pat_key", how="inner")
+# Keep only patients with a known condition
+df = merged_df[merged_df["condition"].notna()].copy()
 
 
 # -------------------------------
 # Step 5: Save final results
 # -------------------------------
-df.to_csv("tableau_data_prep.csv", index=False)
+write_csv(df, "tableau_data_prep.csv")
 
 print("✅ Saved merged dataset as tableau_data.csv")
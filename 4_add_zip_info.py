@@ -1,4 +1,7 @@
 import pandas as pd
+from sinks import write_csv
+from normalize import has_zip3, pad_zip
+from zip_enrichment import ZipEnrichment
 
 # pat_key,age,der_sex,index_date,pat_state,pat_zip3,pay_type,condition
 
@@ -21,8 +24,8 @@ import pandas as pd
 # Load files
 # -----------------------------
 df = pd.read_csv('tableau_data.csv')
-us_zips = pd.read_csv('uszips.csv', dtype={'zip': str})
-zip_map = pd.read_csv('weighted_zip_by_zip3.csv', dtype={'zip3': str, 'weighted_zip': str})
+# uszips.csv / weighted_zip_by_zip3.csv, prebuilt and indexed by integer ZIP (zip_enrichment.py)
+zips = ZipEnrichment()
 
 initial_rows = len(df)
 
@@ -30,30 +33,24 @@ initial_rows = len(df)
 # 1. Clean tableau_data
 # -----------------------------
 before_clean = len(df)
-df = df[df['pat_zip3'].notna()]
-df = df[df['pat_zip3'] != '.']
+df = df[has_zip3(df['pat_zip3'])]
 after_clean = len(df)
 print(f"Step 1 - Clean pat_zip3: Dropped {before_clean - after_clean} rows")
 
-df['pat_zip3'] = df['pat_zip3'].astype(str).str.zfill(3)
-zip_map['weighted_zip'] = zip_map['weighted_zip'].astype(str).str.zfill(5)
+df['pat_zip3'] = pad_zip(df['pat_zip3'], 3)
 # -----------------------------
-# 2. Merge ZIP3 → weighted ZIP
+# 2. Attach ZIP3 → weighted ZIP
 # -----------------------------
 before_merge1 = len(df)
-df = df.merge(zip_map, left_on='pat_zip3', right_on='zip3', how='left')
+df = pd.concat([df, zips.zip3_columns(df['pat_zip3'])], axis=1)
 after_merge1 = len(df)
 print(df.columns)
 missing_zip3 = df['weighted_zip'].isna().sum()
 print(f"Step 2 - Merge weighted_zip: {missing_zip3} rows have no match")
 
 # -----------------------------
-# 3. Merge weighted_zip → us_zips
+# 3. Attach weighted_zip → us_zips attributes
 # -----------------------------
-# Normalize keys
-df['weighted_zip'] = df['weighted_zip'].astype(str).str.zfill(5)
-us_zips['zip'] = us_zips['zip'].astype(str).str.zfill(5)
-
 selected_cols = [
     'zip',
     'population',
@@ -69,10 +66,8 @@ selected_cols = [
     'race_white', 'race_black', 'race_asian', 'hispanic'
 ]
 
-us_zips = us_zips[selected_cols]
-
 before_merge2 = len(df)
-df = df.merge(us_zips, left_on='weighted_zip', right_on='zip', how='left')
+df = pd.concat([df, zips.attributes(df['weighted_zip'], selected_cols)], axis=1)
 after_merge2 = len(df)
 
 
@@ -87,7 +82,7 @@ print(f"Step 4 - Drop NAs: Dropped {before_dropna - after_dropna} rows")
 # -----------------------------
 # 5. Save cleaned file
 # -----------------------------
-df.to_csv('tableau_data_final.csv', index=False)
+write_csv(df, 'tableau_data_final.csv')
 
 print(f"Initial rows: {initial_rows}")
 print(f"Final dataset saved as tableau_data_final.csv with shape {df.shape}")
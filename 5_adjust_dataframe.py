@@ -3,8 +3,11 @@ Need to change tableau_data to instead by based on active patients instead of pa
 """
 import pandas as pd
 import os
-from datetime import timedelta
 from tqdm import tqdm
+from pat_codes import PatDict, encode_pat_keys
+from onboarding import INCREMENTAL, OnboardingState, file_digest
+from sinks import write_csv
+from rx_intervals import expand_to_years, year_span
 
 # Step 1: Load all prescription files
 def load_all_prescriptions(base_path, years):
@@ -16,19 +19,37 @@ def load_all_prescriptions(base_path, years):
         dfs.append(df)
     return pd.concat(dfs, ignore_index=True)
 
-# Step 2: Expand prescriptions into covered years
-def expand_to_years(df):
-    rows = []
-    for _, row in tqdm(df.iterrows(), total=len(df), desc="Expanding prescriptions"):
-        start = row["to_dt"]
-        try:
-            days = int(row["dayssup"]) if pd.notna(row["dayssup"]) else 0
-        except ValueError:
-            days = 0  # fallback if invalid value
-        end = start + timedelta(days=days)
-        for yr in range(start.year, end.year + 1):
-            rows.append({"pat_id": row["pat_id"], "year": yr})
-    return pd.DataFrame(rows).drop_duplicates()
+# Incremental mode: only the years touched by new/changed iqvia_ndc files
+def expand_changed_years(all_rx, changed_years, pending_years=()):
+    """
+    Expand only the prescriptions that overlap the years affected by changed files
+
+    Parameters:
+        all_rx: Prescriptions of every year file (a later year can be touched by an earlier file)
+        changed_years: Year files that are new or changed
+        pending_years: Delta years stage 10 has not merged yet (recomputed again)
+
+    Returns:
+        (expanded patient-years of the affected years only, sorted list of affected years)
+    """
+    start_year, end_year = year_span(all_rx)
+    changed = all_rx["year_file"].isin(changed_years)
+    spans = pd.DataFrame({"start": start_year[changed], "end": end_year[changed]}).dropna().drop_duplicates()
+    # a changed file's own year is always redone, even if its prescriptions were removed
+    affected = set(pending_years) | set(changed_years)
+    for start, end in zip(spans["start"], spans["end"]):
+        affected.update(range(int(start), int(end) + 1))
+    affected = sorted(affected)
+
+    empty = pd.DataFrame(columns=["pat_id", "year"])
+    if not affected:
+        return empty, affected
+
+    overlapping = all_rx[(start_year <= affected[-1]) & (end_year >= affected[0])]
+    if overlapping.empty:
+        return empty, affected
+    expanded = expand_to_years(overlapping)
+    return expanded[expanded["year"].isin(affected)], affected
 
 # Step 3: Merge with tableau_data_final
 def build_final_table(prescription_df, tableau_path, output_path):
@@ -37,10 +58,18 @@ def build_final_table(prescription_df, tableau_path, output_path):
     # Ensure index_date is datetime
     tableau["index_date"] = pd.to_datetime(tableau["index_date"], errors="coerce")
 
-    # Extract pat_id from pat_key
-    tableau["pat_id"] = tableau["pat_key"].str.split("_").str[0]
+    # Encode pat_key as (pat_int, pat_seq) and join on the integer patient code
+    pat_dict = PatDict()
+    tableau[["pat_int", "pat_seq"]] = encode_pat_keys(tableau["pat_key"], pat_dict)
+    tableau = tableau.drop(columns=["pat_seq"])
+    prescription_df = prescription_df.copy()
+    prescription_df["pat_int"] = pat_dict.encode(prescription_df["pat_id"])
+    pat_dict.save()
 
-    merged = prescription_df.merge(tableau, on="pat_id", how="left")
+    # -1 codes (missing pat_key/pat_id, pat_key without a numeric suffix) must not match each
+    # other: drop them from the tableau side, so those prescription rows keep no tableau match
+    tableau = tableau[tableau["pat_int"] >= 0]
+    merged = prescription_df.merge(tableau, on="pat_int", how="left").drop(columns=["pat_int"])
     # --- Filtering step ---
     # keep rows if index_date is NA OR index_date.year == year
     mask = merged["index_date"].isna() | (merged["index_date"].dt.year == merged["year"])
@@ -54,15 +83,33 @@ def build_final_table(prescription_df, tableau_path, output_path):
     ]
     merged = merged.drop(columns=[c for c in drop_cols if c in merged.columns])
 
-    merged.to_csv(output_path, index=False)
+    write_csv(merged, output_path)
     return merged
 
 # Example usage
 base_path = "/sharefolder/wanglab/merck_proposal/"
 years = list(range(2010, 2023))  # adjust years available
+if INCREMENTAL:
+    # every delivered year file; only the years touched by new/changed files are written
+    years = sorted(int(f[len("iqvia_ndc_"):-len(".csv")]) for f in os.listdir(base_path)
+                   if f.startswith("iqvia_ndc_") and f.endswith(".csv"))
 all_rx = load_all_prescriptions(base_path, years)
-expanded = expand_to_years(all_rx)
+
+if INCREMENTAL:
+    state = OnboardingState()
+    digests = {year: file_digest(os.path.join(base_path, f"iqvia_ndc_{year}.csv")) for year in years}
+    changed_years = [int(year) for year in state.changed("5_rx", digests)]
+    expanded, delta_years = expand_changed_years(all_rx, changed_years, state.delta_years())
+    print(f"Incremental: changed files {changed_years} -> delta years {delta_years}")
+else:
+    expanded = expand_to_years(all_rx)
 
 final = build_final_table(expanded, 
                           "tableau_data_final.csv",
-                          "final_patient_year.csv")
\ No newline at end of file
+                          "final_patient_year.csv")
+
+if INCREMENTAL:
+    # stages 6-9 now run on the delta years only; 10 merges them into FINAL_DATA.csv
+    state.set_delta_years(delta_years)
+    for year in changed_years:
+        state.mark("5_rx", year, digests[year])
\ No newline at end of file
@@ -1,67 +1,72 @@
 import os
-import re
+import numpy as np
 import pandas as pd
 from typing import List
-
-# ---------------------------
-# Helpers
-# ---------------------------
-ZIP3_RE = re.compile(r'^\d{3}$')
-
-def normalize_zip3(val):
-    """Return first 3 digits of val if possible, otherwise None."""
-    if pd.isna(val):
-        return None
-    s = re.sub(r'\D', '', str(val))
-    return s[:3] if len(s) >= 3 else None
-
-def is_valid_zip3(val):
-    return bool(val) and bool(ZIP3_RE.match(str(val)))
+from read_iqvia import ENROLL_HEADER, source_folder, list_parts, read_part, read_ragged_part
+from enroll_index import lookup_enroll
+from instrument import PartLog, report_metrics
+from schema import read_table, write_table, extend_categories
+from normalize import normalize_zip3, is_valid_zip3, compute_age
 
 # ---------------------------
 # Enrollment reader (robust)
 # ---------------------------
-def read_enroll(header_data: List[str], patient_list: List[str], claims_folder: str = '/sharefolder/IQVIA'):
+def read_enroll(header_data: List[str], patient_list: List[str], claims_folder: str = '/sharefolder/IQVIA',
+                use_index: bool = True):
     """
     Read enroll parts from /sharefolder/IQVIA/enroll_synth/csv_in_parts, return DataFrame
-    only containing rows for patient_list. Handles files with >= expected cols; skips smaller.
+    only containing rows for patient_list. Lines with extra cols are truncated to header_data;
+    lines with fewer cols are dropped and counted.
+    With use_index, rows are fetched through the pat_id index (enroll_index.py) instead, with the
+    same line-width checks.
     """
-    year_folder = os.path.join(claims_folder, 'enroll_synth')
-    csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
+    csv_in_parts_folder = source_folder('enroll_synth', claims_folder=claims_folder)
 
     if not os.path.isdir(csv_in_parts_folder):
         print(f"Enrollment folder not found: {csv_in_parts_folder}")
         return pd.DataFrame(columns=header_data)
 
-    csv_files = [f for f in os.listdir(csv_in_parts_folder) if f.endswith('.csv')]
-    parts = []
-    for i, fname in enumerate(csv_files, start=1):
-        path = os.path.join(csv_in_parts_folder, fname)
-        try:
-            part = pd.read_csv(path, sep='|', header=None, dtype=str, engine='python')
-        except Exception as e:
-            print(f"Skipping {fname} (read error): {e}")
-            continue
-
-        if part.shape[1] < len(header_data):
-            print(f"Skipping {fname}: has {part.shape[1]} columns (expected >= {len(header_data)})")
-            continue
-
-        # keep only first N cols that correspond to header_data
-        part = part.iloc[:, :len(header_data)]
-        part.columns = header_data
-
-        # normalize pat_id and keep only relevant patients to reduce memory
-        part['pat_id'] = part['pat_id'].astype(str).str.strip()
-        part = part[part['pat_id'].isin(patient_list)]
-
-        if not part.empty:
-            # normalize useful fields
-            part['pat_zip3'] = part['pat_zip3'].apply(normalize_zip3)
-            part['der_yob'] = pd.to_numeric(part['der_yob'], errors='coerce')
-            parts.append(part)
-
-        print(f"Processed {i}/{len(csv_files)}: {fname}  -> kept {len(part)} rows")
+    metrics = PartLog('6_read_enroll')
+    if use_index:
+        # only read the lines/row groups the pat_id index points at
+        part = lookup_enroll(patient_list, header_data, metrics=metrics)
+        part['pat_zip3'] = normalize_zip3(part['pat_zip3'])
+        part['der_yob'] = pd.to_numeric(part['der_yob'], errors='coerce')
+        parts = [part] if not part.empty else []
+    else:
+        csv_files = list_parts('enroll_synth', claims_folder=claims_folder)
+        parts = []
+        for i, path in enumerate(csv_files, start=1):
+            fname = os.path.basename(path)
+            with metrics.part(path) as record:
+                try:
+                    with record.timer('parse'):
+                        if path.endswith('.parquet'):
+                            part = read_part(path, header_data)
+                        else:
+                            part, line_stats = read_ragged_part(path, header_data)
+                            record.rows(malformed=line_stats['short'])
+                            if line_stats['short'] or line_stats['wide']:
+                                print(f"{fname}: dropped {line_stats['short']} short lines, "
+                                      f"truncated {line_stats['wide']} wide lines")
+                except Exception as e:
+                    print(f"Skipping {fname} (read error): {e}")
+                    continue
+
+                rows_parsed = len(part)
+                with record.timer('filter'):
+                    # normalize pat_id and keep only relevant patients to reduce memory
+                    part['pat_id'] = part['pat_id'].astype(str).str.strip()
+                    part = part[part['pat_id'].isin(patient_list)]
+
+                    if not part.empty:
+                        # normalize useful fields
+                        part['pat_zip3'] = normalize_zip3(part['pat_zip3'])
+                        part['der_yob'] = pd.to_numeric(part['der_yob'], errors='coerce')
+                        parts.append(part)
+                record.rows(parsed=rows_parsed, kept=len(part))
+
+            print(f"Processed {i}/{len(csv_files)}: {fname}  -> kept {len(part)} rows")
 
     if not parts:
         return pd.DataFrame(columns=header_data)
@@ -76,13 +81,10 @@ def read_enroll(header_data: List[str], patient_list: List[str], claims_folder:
 # ---------------------------
 
 # Enrollment file headers (as you provided)
-header_data = [
-    'der_sex', 'der_yob', 'pat_id', 'pat_region', 'pat_state', 'pat_zip3',
-    'grp_indv_cd', 'mh_cd', 'enr_rel'
-]
+header_data = ENROLL_HEADER
 
-# Read main file with conservative dtype (keep pat_id as string)
-pat_years = pd.read_csv('patient_year.csv', dtype=str)
+# Read main file with the patient-year schema (pat_id stays a string; see schema.py)
+pat_years = read_table('patient_year.csv')
 
 # Normalize types
 pat_years['pat_id'] = pat_years['pat_id'].astype(str).str.strip()
@@ -91,13 +93,13 @@ pat_years['age'] = pd.to_numeric(pat_years.get('age'), errors='coerce')  # may b
 pat_years['der_sex'] = pat_years['der_sex'].replace({'': pd.NA}).where(lambda s: s.notna(), pd.NA)
 pat_years['pat_state'] = pat_years['pat_state'].replace({'': pd.NA}).where(lambda s: s.notna(), pd.NA)
 # Normalize existing pat_zip3 so '12345' or '123-45' becomes '123', '.' or missing becomes None
-pat_years['pat_zip3'] = pat_years['pat_zip3'].apply(normalize_zip3)
+pat_years['pat_zip3'] = normalize_zip3(pat_years['pat_zip3'])
 
 # Which rows need filling? (any of these missing/invalid)
 mask_age_missing = pat_years['age'].isna()
 mask_sex_missing = pat_years['der_sex'].isna()
 mask_state_missing = pat_years['pat_state'].isna()
-mask_zip3_invalid = ~pat_years['pat_zip3'].apply(is_valid_zip3)
+mask_zip3_invalid = ~is_valid_zip3(pat_years['pat_zip3'])
 
 needs_mask = mask_age_missing | mask_sex_missing | mask_state_missing | mask_zip3_invalid
 needs_fill = pat_years[needs_mask].copy()
@@ -106,14 +108,15 @@ print(f"{len(needs_fill)} rows need filling out of {len(pat_years)} total rows")
 
 if needs_fill.empty:
     print("Nothing to fill. Writing original file out.")
-    pat_years.to_csv('patient_year_filled.csv', index=False)
+    write_table(pat_years, 'patient_year_filled.csv')
 else:
     # Read enroll only for the patients we need (reduces I/O)
     enroll = read_enroll(header_data, needs_fill['pat_id'].unique().tolist())
+    report_metrics()
 
     if enroll.empty:
         print("No enrollment data found for the requested patients. No fills performed.")
-        pat_years.to_csv('patient_year_filled.csv', index=False)
+        write_table(pat_years, 'patient_year_filled.csv')
     else:
         # Ensure consistent types
         enroll['pat_id'] = enroll['pat_id'].astype(str).str.strip()
@@ -124,9 +127,7 @@ else:
         # compute age where possible
         merged['year'] = pd.to_numeric(merged['year'], errors='coerce')
         merged['der_yob'] = pd.to_numeric(merged['der_yob'], errors='coerce')
-        merged['age'] = merged.apply(lambda r: (r['year'] - r['der_yob'])
-                                    if pd.notna(r['year']) and pd.notna(r['der_yob']) else pd.NA, axis=1)
-        merged['age'] = pd.to_numeric(merged['age'], errors='coerce')
+        merged['age'] = compute_age(merged['year'], merged['der_yob'])
 
         # Keep only rows with a calculable dob -> age, and age in [18,64] (exclude <18 or >=65)
         mask_valid_age_range = merged['age'].notna() & (merged['age'] >= 18) & (merged['age'] <= 65)
@@ -135,32 +136,36 @@ else:
 
         if valid_filled.empty:
             print("No valid fills after age filtering. Writing original file out.")
-            pat_years.to_csv('patient_year_filled.csv', index=False)
+            write_table(pat_years, 'patient_year_filled.csv')
         else:
             # Prepare fill subset and de-duplicate on pat_id+year
             fill_cols = ['pat_id', 'year', 'age', 'der_sex', 'pat_state', 'pat_zip3']
             filled_subset = valid_filled[fill_cols].drop_duplicates(subset=['pat_id', 'year'], keep='first').copy()
             # Normalize zip3 in filled_subset
-            filled_subset['pat_zip3'] = filled_subset['pat_zip3'].apply(normalize_zip3)
+            filled_subset['pat_zip3'] = normalize_zip3(filled_subset['pat_zip3'])
 
-            # Build a key for mapping: "pat_id|year"
-            filled_subset['year_int'] = filled_subset['year'].astype(int).astype(str)
-            filled_subset['key'] = filled_subset['pat_id'].astype(str) + '|' + filled_subset['year_int']
+            # Build an integer key for mapping: pat code * 10000 + year; the codes are local to this
+            # merge (positions in pat_codes), so the shared pat_id dictionary is not touched
+            filled_subset = filled_subset[filled_subset['pat_id'].notna()]
+            pat_codes = pd.Index(filled_subset['pat_id'].str.strip().unique())
+            filled_subset['key'] = (pat_codes.get_indexer(filled_subset['pat_id'].str.strip()) * 10000
+                                    + filled_subset['year'].astype(int).to_numpy())
 
-            # Prepare mapping dictionaries
+            # Prepare mapping series (key -> value)
             mappings = {}
             for c in ['age', 'der_sex', 'pat_state', 'pat_zip3']:
-                mappings[c] = dict(zip(filled_subset['key'], filled_subset[c]))
+                mappings[c] = pd.Series(filled_subset[c].to_numpy(), index=filled_subset['key'].to_numpy())
 
-            # Add key column to pat_years (use int year -> str)
-            # If year is missing in pat_years this will produce "pat|0"; those won't map and will be ignored
-            pat_years['year_int'] = pat_years['year'].fillna(0).astype(int).astype(str)
-            pat_years['key'] = pat_years['pat_id'].astype(str) + '|' + pat_years['year_int']
+            # Add key column to pat_years
+            # If year is missing in pat_years this will produce code * 10000; those won't map and will be ignored.
+            # pat_ids missing from the enrollment fills (or missing altogether) get key -1, which never maps.
+            codes = pat_codes.get_indexer(pat_years['pat_id'].str.strip())
+            pat_years['key'] = np.where(codes >= 0, codes * 10000 + pat_years['year'].fillna(0).astype(int).to_numpy(), -1)
 
             # For each column, only update rows that are missing/invalid
             def update_column(col):
                 if col == 'pat_zip3':
-                    mask = ~pat_years['pat_zip3'].apply(is_valid_zip3)
+                    mask = ~is_valid_zip3(pat_years['pat_zip3'])
                 else:
                     mask = pat_years[col].isna()
                 if mask.sum() == 0:
@@ -169,6 +174,7 @@ else:
                 # only assign when mapping has a non-null value
                 assign_mask = mapped.notna()
                 indices_to_assign = pat_years.loc[mask].index[assign_mask]
+                pat_years[col] = extend_categories(pat_years[col], mapped)
                 pat_years.loc[indices_to_assign, col] = mapped.loc[assign_mask].values
                 return len(indices_to_assign)
 
@@ -176,10 +182,10 @@ else:
             print("Filled counts by column:", filled_counts)
 
             # Clean up temporary cols
-            pat_years.drop(columns=['year_int', 'key'], inplace=True)
+            pat_years.drop(columns=['key'], inplace=True)
 
             # Build validity masks
-            valid_zip_mask = pat_years['pat_zip3'].apply(is_valid_zip3)
+            valid_zip_mask = is_valid_zip3(pat_years['pat_zip3'])
             valid_age_mask = pat_years['age'].notna()
             valid_sex_mask = pat_years['der_sex'].notna()
             valid_state_mask = pat_years['pat_state'].notna()
@@ -193,5 +199,5 @@ else:
             print(f"Dropped {dropped_count} rows due to missing/invalid age, sex, state, or ZIP3")
 
             # Write result
-            pat_years.to_csv('patient_year_filled.csv', index=False)
+            write_table(pat_years, 'patient_year_filled.csv')
             print("Wrote patient_year_filled.csv")
\ No newline at end of file
@@ -1,50 +1,36 @@
 import pandas as pd
 import os
-import concurrent.futures
+from read_iqvia import ENROLL2_HEADER, source_folder, list_parts, read_part
+from composite_key import PatMonthSet
+from part_scheduler import part_tasks, run_part_tasks, utilization_report
+from instrument import PartLog, report_metrics
+from schema import read_table, write_table, extend_categories
 
 # ------------------------------------------
 # Enrollment Reader
 # ------------------------------------------
-def read_enroll(year_pat_list):
-    """Read enrollment for one year, filtering only for needed pat_ids."""
-    year, pat_list = year_pat_list
-    claims_folder = '/sharefolder/IQVIA'
-    year_folder = os.path.join(claims_folder, f'enroll2_{year}')
-    csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
+# only these columns are kept below
+ENROLL_COLUMNS = ['pat_id', 'pay_type', 'month_id']
 
-    if not os.path.isdir(csv_in_parts_folder):
-        print(f"[{year}] Folder not found: {csv_in_parts_folder}")
-        return pd.DataFrame(columns=['pat_id', 'pay_type', 'year'])
-
-    csv_files = [f for f in os.listdir(csv_in_parts_folder) if f.endswith('.csv')]
-    header_data = ['pat_id', 'mstr_enroll_cd', 'prd_type',
-                   'pay_type', 'pcob_type', 'mcob_type', 'month_id']
-
-    pat_set = set(pat_list)
-    filtered_parts = []
-
-    for i, csv_file in enumerate(csv_files, 1):
-        path = os.path.join(csv_in_parts_folder, csv_file)
+def filter_enroll_part(year, path, pat_sets):
+    """Read one enrollment part, keeping only needed pat_ids (pat_sets: year -> PatMonthSet)."""
+    with PartLog('7_read_enroll', year).part(path) as record:
         try:
-            df = pd.read_csv(path, sep='|', header=None, dtype=str)
+            with record.timer('parse'):
+                df = read_part(path, ENROLL2_HEADER, columns=ENROLL_COLUMNS)
         except Exception as e:
-            print(f"[{year}] Skipping {csv_file}: {e}")
-            continue
-
-        if df.shape[1] < len(header_data):
-            print(f"[{year}] Skipping {csv_file}: bad column count {df.shape[1]}")
-            continue
-
-        df = df.iloc[:, :len(header_data)]
-        df.columns = header_data
+            print(f"[{year}] Skipping {os.path.basename(path)}: {e}")
+            return None
 
         # filter only needed pat_ids
-        df = df[df['pat_id'].isin(pat_set)]
-        if not df.empty:
-            filtered_parts.append(df)
-
-        print(f"[{year}] Processed part {i}/{len(csv_files)}")
-
+        with record.timer('filter'):
+            filtered_df = df[pat_sets[year].isin(df['pat_id'], df['month_id'])]
+        record.rows(parsed=len(df), kept=len(filtered_df))
+    return filtered_df
+
+def merge_enroll_year(year, parts):
+    """Combine the filtered parts of one year into one pay_type per patient."""
+    filtered_parts = [df for df in parts if df is not None and not df.empty]
     if filtered_parts:
         result = pd.concat(filtered_parts, ignore_index=True)
         # keep one record per patient (latest month_id if multiple)
@@ -57,15 +43,36 @@ def read_enroll(year_pat_list):
     else:
         return pd.DataFrame(columns=['pat_id', 'pay_type', 'year'])
 
+def read_enroll(year_pat_list, month_list=None):
+    """
+    Read enrollment for one year, filtering only for needed pat_ids.
+    If month_list is given (same length as pat_list), only those (pat_id, month_id) pairs are kept.
+    """
+    year, pat_list = year_pat_list
+    csv_in_parts_folder = source_folder('enroll2', year)
+
+    if not os.path.isdir(csv_in_parts_folder):
+        print(f"[{year}] Folder not found: {csv_in_parts_folder}")
+        return pd.DataFrame(columns=['pat_id', 'pay_type', 'year'])
+
+    csv_files = list_parts('enroll2', year)
+    pat_sets = {year: PatMonthSet(pat_list, month_list)}
+    filtered_parts = []
+
+    for i, path in enumerate(csv_files, 1):
+        filtered_parts.append(filter_enroll_part(year, path, pat_sets))
+        print(f"[{year}] Processed part {i}/{len(csv_files)}")
+
+    return merge_enroll_year(year, filtered_parts)
+
 
 # ------------------------------------------
 # Main script
 # ------------------------------------------
 print("Loading patient_year_filled.csv...")
-pat_years = pd.read_csv("patient_year_filled.csv", dtype=str)
+pat_years = read_table("patient_year_filled.csv")
 
-# normalize types
-pat_years['year'] = pd.to_numeric(pat_years['year'], errors='coerce').astype('Int64')
+# normalize types (year is already Int16, pay_type categorical; see schema.py)
 pat_years['pat_id'] = pat_years['pat_id'].astype(str).str.strip()
 
 # Find rows that still need filling
@@ -83,9 +90,17 @@ else:
         .to_dict()
     )
 
+    pat_sets = {year: PatMonthSet(pat_list) for year, pat_list in year_to_patids.items()}
+
+    # one task per (year, enrollment part), merged per year afterwards
     print("Starting parallel read of enrollment files...")
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        results = list(executor.map(read_enroll, year_to_patids.items()))
+    tasks = part_tasks('enroll2', sorted(year_to_patids))
+    part_results, errors, timings = run_part_tasks(tasks, filter_enroll_part, shared=pat_sets)
+    utilization_report(timings)
+    report_metrics()
+    if errors:
+        raise RuntimeError(f"Enrollment parts failed for years {sorted(errors)}, pay_type not filled")
+    results = [merge_enroll_year(year, part_results.get(year, [])) for year in sorted(year_to_patids)]
 
     # combine enrollment results
     enroll_df = pd.concat(results, ignore_index=True)
@@ -94,7 +109,7 @@ else:
     merged = pat_years.merge(enroll_df, on=['pat_id', 'year'], how='left', suffixes=('', '_new'))
 
     # fill pay_type only if missing
-    merged['pay_type'] = merged['pay_type'].fillna(merged['pay_type_new'])
+    merged['pay_type'] = extend_categories(merged['pay_type'], merged['pay_type_new']).fillna(merged['pay_type_new'])
     merged.drop(columns=['pay_type_new'], inplace=True)
 
     final = merged.copy()
@@ -102,11 +117,11 @@ else:
 # ------------------------------------------
 # Handle missing pay_type as "U"
 # ------------------------------------------
-final['pay_type'] = final['pay_type'].fillna("U")
+final['pay_type'] = extend_categories(final['pay_type'], ["U"]).fillna("U")
 
 # Save result
 out_path = "payment_type_filled.csv"
-final.to_csv(out_path, index=False)
+write_table(final, out_path)
 print(f"Saved {len(final)} rows to {out_path}")
 
 
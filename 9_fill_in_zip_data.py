@@ -1,20 +1,19 @@
-import pandas as pd
-import os
+from schema import read_table, write_table
+from normalize import has_zip3, pad_zip
+from zip_enrichment import ZipEnrichment
 
 # -----------------------------
 # Paths
 # -----------------------------
 payment_file = "/home/stofer@chapman.edu/federated_analysis/tableau/payment_type_filled_with_condition.csv"
-zip_map_file = "/home/stofer@chapman.edu/federated_analysis/tableau/weighted_zip_by_zip3.csv"
-us_zips_file = "/home/stofer@chapman.edu/federated_analysis/tableau/uszips.csv"
 output_file = "/home/stofer@chapman.edu/federated_analysis/tableau/payment_almost_all_filled.csv"
 
 # -----------------------------
 # Load files
 # -----------------------------
-df = pd.read_csv(payment_file, dtype=str)
-us_zips = pd.read_csv(us_zips_file, dtype={'zip': str})
-zip_map = pd.read_csv(zip_map_file, dtype={'zip3': str, 'weighted_zip': str})
+df = read_table(payment_file)
+# uszips.csv / weighted_zip_by_zip3.csv, prebuilt and indexed by integer ZIP (zip_enrichment.py)
+zips = ZipEnrichment()
 
 initial_rows = len(df)
 
@@ -22,38 +21,29 @@ initial_rows = len(df)
 # 1. Clean pat_zip3
 # -----------------------------
 before_clean = len(df)
-df = df[df['pat_zip3'].notna()]
-df = df[df['pat_zip3'] != '.']
+df = df[has_zip3(df['pat_zip3'])]
 after_clean = len(df)
 print(f"Step 1 - Clean pat_zip3: Dropped {before_clean - after_clean} rows")
 
-df['pat_zip3'] = df['pat_zip3'].astype(str).str.zfill(3)
-zip_map['weighted_zip'] = zip_map['weighted_zip'].astype(str).str.zfill(5)
+df['pat_zip3'] = pad_zip(df['pat_zip3'], 3)
 
 # -----------------------------
-# 2. Merge ZIP3 → weighted ZIP
+# 2. Attach ZIP3 → weighted ZIP
 # -----------------------------
 before_merge1 = len(df)
-df = df.merge(
-    zip_map[['zip3', 'weighted_zip']],
-    left_on='pat_zip3',
-    right_on='zip3',
-    how='left',
-    suffixes=("", "_dup")
-)
+weighted_zip = zips.zip3_columns(df['pat_zip3'], ['weighted_zip'])['weighted_zip']
 # If weighted_zip already existed, prefer the new one
-if 'weighted_zip_dup' in df.columns:
-    df['weighted_zip'] = df['weighted_zip_dup'].fillna(df.get('weighted_zip'))
-    df = df.drop(columns=['weighted_zip_dup'])
+if 'weighted_zip' in df.columns:
+    weighted_zip = weighted_zip.fillna(df['weighted_zip'])
+df['weighted_zip'] = weighted_zip
 
 missing_zip3 = df['weighted_zip'].isna().sum()
 print(f"Step 2 - Merge weighted_zip: {missing_zip3} rows have no match")
 
 # -----------------------------
-# 3. Merge weighted_zip → us_zips
+# 3. Attach weighted_zip → us_zips attributes
 # -----------------------------
-df['weighted_zip'] = df['weighted_zip'].astype(str).str.zfill(5)
-us_zips['zip'] = us_zips['zip'].astype(str).str.zfill(5)
+df['weighted_zip'] = pad_zip(df['weighted_zip'], 5).where(df['weighted_zip'].notna())
 
 selected_cols = [
     'zip',
@@ -63,16 +53,12 @@ selected_cols = [
     'race_white', 'race_black', 'race_asian', 'hispanic'
 ]
 
-us_zips = us_zips[selected_cols]
-
 before_merge2 = len(df)
-df = df.merge(us_zips, left_on='weighted_zip', right_on='zip', how='left', suffixes=("", "_dup"))
+attributes = zips.attributes(df['weighted_zip'], selected_cols)
 
-# If duplicate columns came in from us_zips merge, prefer the new values
+# If the columns already existed, prefer the new values
 for col in selected_cols:
-    if f"{col}_dup" in df.columns:
-        df[col] = df[f"{col}_dup"].fillna(df[col])
-        df = df.drop(columns=[f"{col}_dup"])
+    df[col] = attributes[col].fillna(df[col]) if col in df.columns else attributes[col]
 
 
 # -----------------------------
@@ -109,7 +95,7 @@ df = df[final_cols]
 # -----------------------------
 # 7. Save final file
 # -----------------------------
-df.to_csv(output_file, index=False)
+write_table(df, output_file)
 
 print(f"Initial rows: {initial_rows}")
 print(f"Final dataset saved as {output_file} with shape {df.shape}")
@@ -0,0 +1,50 @@
+"""
+Benchmark classify_diags (vectorized) against the row-wise classify_row apply
+used by 0_pull_all_T2Dobese_pats.py, on synthetic diag1–12 data.
+"""
+import time
+import numpy as np
+import pandas as pd
+from classify_diag import classify_row, classify_diags
+
+N_ROWS = 200_000
+N_CODES = 20_000
+SEED = 42
+
+DIAG_COLS = [f"diag{i}" for i in range(1, 13)]
+
+
+def make_claims(n_rows, n_codes, rng):
+    code_pool = np.array([f"C{i:05d}" for i in range(n_codes)], dtype=object)
+    values = code_pool[rng.integers(0, n_codes, size=(n_rows, len(DIAG_COLS)))]
+    # Later diag slots are mostly empty, like the real claims
+    fill_rate = np.linspace(0.95, 0.05, len(DIAG_COLS))
+    values[rng.random((n_rows, len(DIAG_COLS))) > fill_rate] = np.nan
+    return pd.DataFrame(values, columns=DIAG_COLS), code_pool
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    claims, code_pool = make_claims(N_ROWS, N_CODES, rng)
+    obesity_codes = set(rng.choice(code_pool, 150, replace=False))
+    t2d_codes = set(rng.choice(code_pool, 300, replace=False))
+    print(f"Synthetic claims: {len(claims):,} rows, {len(obesity_codes)} obesity / {len(t2d_codes)} T2D codes")
+
+    start_time = time.time()
+    expected = claims.apply(lambda row: classify_row(row.values, obesity_codes, t2d_codes), axis=1)
+    rowwise_seconds = time.time() - start_time
+
+    start_time = time.time()
+    result = classify_diags(claims, obesity_codes, t2d_codes)
+    vectorized_seconds = time.time() - start_time
+
+    same = expected.fillna("").equals(result.fillna(""))
+    print(f"classify_row apply: {rowwise_seconds:8.2f} s")
+    print(f"classify_diags:     {vectorized_seconds:8.2f} s")
+    print(f"Speedup:            {rowwise_seconds / vectorized_seconds:8.1f}x")
+    print(f"Labels identical:   {same}")
+    print(result.value_counts(dropna=False).to_string())
+
+
+if __name__ == "__main__":
+    main()
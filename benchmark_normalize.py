@@ -0,0 +1,70 @@
+"""
+Benchmark the vectorized ZIP3/age normalization (normalize.py) against the
+row-wise .apply versions 6_fill_in_enroll_data.py used, on a synthetic
+multi-million-row patient-year table.
+"""
+import time
+import numpy as np
+import pandas as pd
+from normalize import (normalize_zip3, is_valid_zip3, compute_age,
+                       normalize_zip3_value, is_valid_zip3_value)
+
+N_ROWS = 3_000_000
+SEED = 42
+
+
+def make_patient_years(n_rows, rng):
+    zips = rng.integers(0, 100_000, n_rows)
+    formats = rng.integers(0, 6, n_rows)
+    zip_values = np.where(formats == 0, [f"{z:05d}" for z in zips], None)
+    zip_values = np.where(formats == 1, [f"{z // 100:03d}" for z in zips], zip_values)
+    zip_values = np.where(formats == 2, [f"{z:05d}-1234" for z in zips], zip_values)
+    zip_values = np.where(formats == 3, '.', zip_values)
+    zip_values = np.where(formats == 4, [str(z % 100) for z in zips], zip_values)
+    yob = rng.integers(1930, 2010, n_rows).astype(float)
+    yob[rng.random(n_rows) < 0.1] = np.nan
+    return pd.DataFrame({
+        'year': rng.integers(2010, 2023, n_rows),
+        'der_yob': yob,
+        'pat_zip3': pd.Series(zip_values, dtype=object),
+    })
+
+
+def timed(fn):
+    start_time = time.time()
+    result = fn()
+    return result, time.time() - start_time
+
+
+def same_values(expected, result):
+    # missing is None (object) or NaN (pandas str dtype) depending on the pandas version
+    return expected.astype(object).fillna('').equals(result.astype(object).fillna(''))
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    df = make_patient_years(N_ROWS, rng)
+    print(f"Synthetic patient-years: {len(df):,} rows")
+
+    zip_apply, zip_apply_s = timed(lambda: df['pat_zip3'].apply(normalize_zip3_value))
+    zip_vec, zip_vec_s = timed(lambda: normalize_zip3(df['pat_zip3']))
+
+    valid_apply, valid_apply_s = timed(lambda: zip_apply.apply(is_valid_zip3_value))
+    valid_vec, valid_vec_s = timed(lambda: is_valid_zip3(zip_vec))
+
+    age_apply, age_apply_s = timed(lambda: pd.to_numeric(df.apply(
+        lambda r: (r['year'] - r['der_yob']) if pd.notna(r['year']) and pd.notna(r['der_yob']) else pd.NA,
+        axis=1), errors='coerce'))
+    age_vec, age_vec_s = timed(lambda: compute_age(df['year'], df['der_yob']))
+
+    for name, apply_s, vec_s, same in [
+        ('normalize_zip3', zip_apply_s, zip_vec_s, same_values(zip_apply, zip_vec)),
+        ('is_valid_zip3', valid_apply_s, valid_vec_s, valid_apply.astype(bool).equals(valid_vec)),
+        ('age', age_apply_s, age_vec_s, age_apply.equals(age_vec)),
+    ]:
+        print(f"{name:15s} apply: {apply_s:8.2f} s  vectorized: {vec_s:6.2f} s  "
+              f"speedup: {apply_s / vec_s:6.1f}x  identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
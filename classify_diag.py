@@ -0,0 +1,54 @@
+"""
+Classify claims as "Both"/"Obesity"/"T2D" from their diag1–12 codes.
+
+classify_row is the original per-row version. classify_diags does the same for a
+whole block of diag columns at once: each distinct code is looked up once, turned
+into a bitmask (1 = obesity, 2 = T2D) and the bits are OR-ed across the 12 columns.
+"""
+import numpy as np
+import pandas as pd
+
+OBESITY_BIT = 1
+T2D_BIT = 2
+LABELS = np.array([None, "Obesity", "T2D", "Both"], dtype=object)  # indexed by bitmask
+
+
+def classify_row(diags, obesity_codes, t2d_codes):
+    patient_codes = set(filter(pd.notna, diags))  # drop NaNs
+    has_obesity = not patient_codes.isdisjoint(obesity_codes)
+    has_t2d = not patient_codes.isdisjoint(t2d_codes)
+
+    if has_obesity and has_t2d:
+        return "Both"
+    elif has_obesity:
+        return "Obesity"
+    elif has_t2d:
+        return "T2D"
+    else:
+        return None  # filter out later
+
+
+def classify_diags(diags, obesity_codes, t2d_codes):
+    """
+    Vectorized classify_row over a DataFrame of diag columns
+
+    Parameters:
+        diags: DataFrame with one column per diag code (e.g. diag1–diag12)
+        obesity_codes: Set of obesity diagnosis codes
+        t2d_codes: Set of T2D diagnosis codes
+
+    Returns:
+        Series of "Both"/"Obesity"/"T2D"/None aligned with diags.index
+    """
+    n_rows, n_cols = diags.shape
+    codes, uniques = pd.factorize(diags.to_numpy(dtype=object).ravel())  # NaN -> -1
+
+    uniques = pd.Index(uniques)
+    unique_bits = (uniques.isin(obesity_codes).astype(np.uint8) * OBESITY_BIT
+                   | uniques.isin(t2d_codes).astype(np.uint8) * T2D_BIT)
+    # Append a 0 so missing codes (-1) index the last slot
+    unique_bits = np.append(unique_bits, np.uint8(0))
+
+    bits = unique_bits[codes].reshape(n_rows, n_cols)
+    mask = np.bitwise_or.reduce(bits, axis=1) if n_cols else np.zeros(n_rows, dtype=np.uint8)
+    return pd.Series(LABELS[mask], index=diags.index)
@@ -0,0 +1,61 @@
+"""
+Vectorized (pat_id, month_id) membership for enrollment filtering.
+
+pat_ids are encoded against the target patients with a pd.Index lookup, and the
+code is packed with the YYYYMM month into one int64:
+
+    key = pat_code * MONTH_SPAN + month_id
+
+so filtering a part is one hash lookup per row instead of building a Python
+tuple per row. Codes are exact (no hashing of the pat_id string), so there are
+no false positives.
+"""
+import numpy as np
+import pandas as pd
+
+MONTH_SPAN = 1_000_000  # month_id is YYYYMM
+
+
+def to_month_int(month_ids):
+    """month_id as int64 (YYYYMM); missing or invalid values become -1."""
+    months = pd.to_numeric(pd.Series(month_ids, copy=False), errors='coerce')
+    return months.fillna(-1).astype(np.int64).to_numpy()
+
+
+def pack_pat_month(pat_codes, months):
+    return np.asarray(pat_codes, dtype=np.int64) * MONTH_SPAN + months
+
+
+class PatMonthSet:
+    """
+    Set of target (pat_id, month_id) pairs
+
+    Parameters:
+        pat_ids: Target pat_ids
+        month_ids: Matching month_ids (YYYYMM, str or int). If None, any month matches.
+    """
+
+    def __init__(self, pat_ids, month_ids=None):
+        pat_ids = pd.Series(pat_ids, copy=False).astype(str)
+        self.pat_index = pd.Index(pat_ids.unique())
+        if month_ids is None:
+            self.keys = None
+        else:
+            codes = self.pat_index.get_indexer(pat_ids)
+            self.keys = pd.Index(np.unique(pack_pat_month(codes, to_month_int(month_ids))))
+
+    def __len__(self):
+        return len(self.pat_index) if self.keys is None else len(self.keys)
+
+    def pat_codes(self, pat_ids):
+        """Position of each pat_id in the target patients, -1 if not a target."""
+        return self.pat_index.get_indexer(pd.Series(pat_ids, copy=False).astype(str))
+
+    def isin(self, pat_ids, month_ids=None):
+        """Boolean mask: is each (pat_id, month_id) row one of the target pairs."""
+        codes = self.pat_codes(pat_ids)
+        mask = codes >= 0
+        if self.keys is not None:
+            keys = pack_pat_month(codes, to_month_int(month_ids))
+            mask &= pd.Index(keys).isin(self.keys)
+        return mask
@@ -0,0 +1,176 @@
+"""
+Persistent (pat_id, year) -> strongest condition lookup, maintained by 0_pull_all_T2Dobese_pats.py.
+
+Conditions are stored as classify_diag bitmasks (1 = Obesity, 2 = T2D, 3 = Both)
+keyed by pat_int (pat_codes.PatDict):
+
+    data/pat_condition/condition_{year}.parquet   pat_int, bits         one row per patient of that claims year
+    data/pat_condition_by_year.parquet            pat_int, year, bits   all years, sorted by pat_int and year
+
+A patient's condition in a year is the strongest one of that year's claims (Both if
+the year shows both). Years are never OR-ed together: a patient with Obesity in 2012
+and T2D in 2015 is Obesity in 2012 and T2D in 2015, not Both. Where a patient has no
+classified claim in the requested year, the condition of their earliest year is used.
+Replacing one year and rebuilding the lookup never needs the iqvia_pat_{year}.csv files again.
+
+This is a per-year lookup, not one condition per patient, so the outputs differ from
+the scripts it replaced:
+    8_fill_in_condition.py   used to fill every row of a patient with the condition of
+                             their earliest iqvia_pat_{year}.csv; it now uses the row's year
+    3_compile_demo_info_GLP.py  used to merge patient_conditions.csv on pat_key; it now
+                             uses the condition of the GLP1-RA index-date year
+
+    lookup = ConditionLookup()
+    df['condition'] = lookup.conditions(df['pat_id'], df['year'])   # None where unknown
+"""
+import os
+import glob
+import numpy as np
+import pandas as pd
+from classify_diag import LABELS
+from pat_codes import DATA_FOLDER, PatDict
+
+CONDITION_FOLDER = os.path.join(DATA_FOLDER, 'pat_condition')
+LOOKUP_FILE = os.path.join(DATA_FOLDER, 'pat_condition_by_year.parquet')
+IQVIA_PAT_PATTERN = os.path.join(DATA_FOLDER, 'iqvia_pat_*.csv')
+
+LABEL_BITS = {label: bits for bits, label in enumerate(LABELS) if label is not None}
+
+
+def condition_bits(conditions):
+    """"Both"/"Obesity"/"T2D" labels -> uint8 bitmasks (0 for missing/other)."""
+    conditions = pd.Series(conditions, copy=False).astype(object)
+    return conditions.map(LABEL_BITS).fillna(0).to_numpy().astype(np.uint8)
+
+
+def patient_bits(pat_ints, bits):
+    """OR of bits per patient. Returns (sorted unique pat_ints, bits); negative pat_ints are dropped."""
+    pat_ints, bits = np.asarray(pat_ints, dtype=np.int64), np.asarray(bits, dtype=np.uint8)
+    keep = pat_ints >= 0
+    pat_ints, bits = pat_ints[keep], bits[keep]
+    order = np.argsort(pat_ints, kind='stable')
+    pat_ints, bits = pat_ints[order], bits[order]
+    if not len(pat_ints):
+        return pat_ints, bits
+
+    first = np.flatnonzero(np.r_[True, pat_ints[1:] != pat_ints[:-1]])
+    return pat_ints[first], np.bitwise_or.reduceat(bits, first)
+
+
+def write_table(pat_ints, bits, path, years=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    table = pd.DataFrame({'pat_int': pat_ints, 'bits': bits})
+    if years is not None:
+        table.insert(1, 'year', years)
+    table.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def year_file(year, folder=CONDITION_FOLDER):
+    return os.path.join(folder, f'condition_{year}.parquet')
+
+
+def update_year(year, pat_ids, conditions, pat_dict, folder=CONDITION_FOLDER):
+    """
+    Replace the condition table of one claims year
+
+    Parameters:
+        year: Claims year
+        pat_ids: pat_id of each classified claim (duplicates are OR-ed together)
+        conditions: Matching "Both"/"Obesity"/"T2D" labels
+        pat_dict: PatDict used to encode pat_ids (new patients are added and saved before
+            the table is written, so a table never refers to codes missing from the dictionary)
+
+    Returns:
+        Number of patients in the year
+    """
+    pat_ints, bits = patient_bits(pat_dict.encode(pat_ids), condition_bits(conditions))
+    pat_dict.save()
+    write_table(pat_ints, bits, year_file(year, folder))
+    return len(pat_ints)
+
+
+def rebuild_lookup(folder=CONDITION_FOLDER, path=LOOKUP_FILE):
+    """Stack the per-year tables into the lookup file, sorted by pat_int and year. Returns the number of patients."""
+    tables = []
+    for file in sorted(glob.glob(os.path.join(folder, 'condition_*.parquet'))):
+        year = int(os.path.basename(file)[len('condition_'):-len('.parquet')])
+        tables.append(pd.read_parquet(file).assign(year=year))
+    if tables:
+        table = pd.concat(tables, ignore_index=True).sort_values(['pat_int', 'year'], kind='stable')
+    else:
+        table = pd.DataFrame({'pat_int': np.zeros(0, dtype=np.int64), 'bits': np.zeros(0, dtype=np.uint8),
+                              'year': np.zeros(0, dtype=np.int64)})
+    write_table(table['pat_int'].to_numpy(dtype=np.int64), table['bits'].to_numpy(dtype=np.uint8), path,
+                years=table['year'].to_numpy(dtype=np.int64))
+    n_pats = table['pat_int'].nunique()
+    print(f"Condition lookup: {n_pats} patients, {len(table)} patient years from {len(tables)} years", flush=True)
+    return n_pats
+
+
+def build_from_files(pattern=IQVIA_PAT_PATTERN, folder=CONDITION_FOLDER, path=LOOKUP_FILE, pat_dict=None):
+    """One-time build from existing iqvia_pat_{year}.csv outputs (for data extracted before the lookup existed)."""
+    pat_dict = PatDict() if pat_dict is None else pat_dict
+    for iqvia_file in sorted(glob.glob(pattern)):
+        year = os.path.basename(iqvia_file)[len('iqvia_pat_'):-len('.csv')]
+        iqvia_df = pd.read_csv(iqvia_file, dtype=str, usecols=['pat_id', 'condition'])
+        n_pats = update_year(year, iqvia_df['pat_id'], iqvia_df['condition'].str.strip(), pat_dict, folder)
+        print(f"Condition lookup: {year} -> {n_pats} patients", flush=True)
+    return rebuild_lookup(folder, path)
+
+
+class ConditionLookup:
+    def __init__(self, path=LOOKUP_FILE, pat_dict=None):
+        self.pat_dict = PatDict() if pat_dict is None else pat_dict
+        if not os.path.exists(path):
+            if glob.glob(os.path.join(CONDITION_FOLDER, 'condition_*.parquet')):
+                print(f"{path} not found, building it from {CONDITION_FOLDER}", flush=True)
+                rebuild_lookup(path=path)
+            else:
+                print(f"{path} not found, building it from {IQVIA_PAT_PATTERN}", flush=True)
+                build_from_files(path=path, pat_dict=self.pat_dict)
+        table = pd.read_parquet(path)
+        # sorted (pat_int, year) pairs as one int64 key each, as in 6_fill_in_enroll_data.py
+        self.keys = table['pat_int'].to_numpy(dtype=np.int64) * 10000 + table['year'].to_numpy(dtype=np.int64)
+        self.bits = table['bits'].to_numpy(dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, keys, first_of_patient=False):
+        """Bits at keys (pat_int * 10000 + year); with first_of_patient, of the patient's earliest year instead."""
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        if first_of_patient:
+            found = self.keys[pos] // 10000 == keys // 10000
+        else:
+            found = self.keys[pos] == keys
+        return np.where(found, self.bits[pos], 0).astype(np.uint8)
+
+    def lookup_bits(self, pat_ids, years=None):
+        """
+        Condition bitmask per pat_id (0 where the patient is not in the lookup)
+
+        years: Year of each pat_id; the condition of that claims year is used, or of the
+            patient's earliest year where that year has none (always, if years is None)
+        """
+        codes = self.pat_dict.encode(pat_ids, add_new=False)
+        if not len(self.keys):
+            return np.zeros(len(codes), dtype=np.uint8)
+        bits = np.zeros(len(codes), dtype=np.uint8)
+        known = codes >= 0
+        if years is not None:
+            years = pd.to_numeric(pd.Series(years, copy=False), errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+            bits[known] = self.find(codes[known] * 10000 + years[known])
+        first = known & (bits == 0)
+        bits[first] = self.find(codes[first] * 10000, first_of_patient=True)
+        return bits
+
+    def conditions(self, pat_ids, years=None):
+        """Strongest condition label per pat_id and year ("Both"/"T2D"/"Obesity", None if unknown)."""
+        pat_ids = pd.Series(pat_ids, copy=False)
+        return pd.Series(LABELS[self.lookup_bits(pat_ids, years)], index=pat_ids.index, dtype=object)
+
+
+if __name__ == "__main__":
+    build_from_files()
@@ -0,0 +1,176 @@
+"""
+Persistent pat_id -> (part file, location) index over enroll_synth.
+
+location is the byte offset of the patient's line for raw .csv parts, or the row
+group number for cached .parquet parts. lookup_enroll() (or iter_enroll(), one part
+at a time) reads only those lines / row groups instead of scanning every part.
+
+The index is rebuilt incrementally: parts whose size or mtime changed (or that
+are new) are re-indexed, removed parts are dropped, the rest is reused.
+"""
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from read_iqvia import IQVIA_FOLDER, ENROLL_HEADER, list_parts, parquet_as_text, parse_ragged
+from instrument import PartLog
+
+INDEX_FOLDER = os.path.join(IQVIA_FOLDER, 'index')
+INDEX_FILE = os.path.join(INDEX_FOLDER, 'enroll_synth_pat_index.parquet')
+PARTS_FILE = os.path.join(INDEX_FOLDER, 'enroll_synth_parts.csv')
+
+PAT_ID_POS = ENROLL_HEADER.index('pat_id')
+BLOCK_SIZE = 64 * 1024 * 1024
+
+
+def part_fingerprints(parts):
+    stats = [os.stat(part) for part in parts]
+    return pd.DataFrame({
+        'part': parts,
+        'size': [st.st_size for st in stats],
+        'mtime': [int(st.st_mtime) for st in stats],
+    })
+
+
+def line_offsets(path):
+    """Byte offset of the start of every line in a text part."""
+    starts = [np.zeros(1, dtype=np.int64)]
+    pos = 0
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(BLOCK_SIZE)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            starts.append(newlines.astype(np.int64) + pos + 1)
+            pos += len(block)
+    starts = np.concatenate(starts)
+    return starts[starts < pos]
+
+
+def index_part(path):
+    if path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(path)
+        frames = []
+        for row_group in range(parquet_file.num_row_groups):
+            pat_ids = parquet_file.read_row_group(row_group, columns=['pat_id']).column(0).to_pandas()
+            frames.append(pd.DataFrame({'pat_id': pat_ids.unique(), 'location': row_group}))
+        index = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['pat_id', 'location'])
+    else:
+        offsets = line_offsets(path)
+        pat_ids = pd.read_csv(path, sep='|', header=None, dtype=str, usecols=[PAT_ID_POS],
+                              skip_blank_lines=False).iloc[:, 0]
+        if len(pat_ids) != len(offsets):
+            raise ValueError(f"{path}: parsed {len(pat_ids)} rows but found {len(offsets)} lines")
+        index = pd.DataFrame({'pat_id': pat_ids.to_numpy(), 'location': offsets})
+        index = index.dropna(subset=['pat_id'])
+
+    index['pat_id'] = index['pat_id'].astype(str).str.strip()
+    index['location'] = index['location'].astype('int64')
+    index['part'] = path
+    return index[['pat_id', 'part', 'location']]
+
+
+def build_enroll_index(parts=None):
+    """Build or incrementally update the index. Returns the index DataFrame."""
+    if parts is None:
+        parts = list_parts('enroll_synth')
+    current = part_fingerprints(parts)
+
+    previous = set()
+    unchanged = set()
+    index = pd.DataFrame(columns=['pat_id', 'part', 'location'])
+    if os.path.exists(INDEX_FILE) and os.path.exists(PARTS_FILE):
+        indexed = pd.read_csv(PARTS_FILE, dtype={'part': str})
+        previous = set(indexed['part'])
+        unchanged = set(current.merge(indexed, on=['part', 'size', 'mtime'], how='inner')['part'])
+        index = pd.read_parquet(INDEX_FILE)
+        index['part'] = index['part'].astype(str)
+        index = index[index['part'].isin(unchanged)]
+
+    to_index = [part for part in parts if part not in unchanged]
+    if not to_index and previous == set(parts):
+        return index
+
+    new_parts = []
+    for i, part in enumerate(to_index, start=1):
+        new_parts.append(index_part(part))
+        print(f"Indexed enroll part {i}/{len(to_index)}: {os.path.basename(part)}", flush=True)
+
+    index = pd.concat([index] + new_parts, ignore_index=True)
+    index = index.sort_values(['part', 'location'], kind='stable').reset_index(drop=True)
+
+    os.makedirs(INDEX_FOLDER, exist_ok=True)
+    index.to_parquet(INDEX_FILE + '.tmp', index=False)
+    current.to_csv(PARTS_FILE + '.tmp', index=False)
+    os.replace(INDEX_FILE + '.tmp', INDEX_FILE)
+    os.replace(PARTS_FILE + '.tmp', PARTS_FILE)
+    print(f"Enroll index: {len(to_index)} parts (re)indexed, {len(parts) - len(to_index)} reused", flush=True)
+    return index
+
+
+def read_lines(path, offsets):
+    lines = []
+    with open(path, 'rb') as file:
+        for offset in offsets:
+            file.seek(offset)
+            lines.append(file.readline())
+    return b''.join(lines)
+
+
+def iter_enroll(patient_list, header_data=ENROLL_HEADER, index=None, metrics=None):
+    """
+    Yield the enroll_synth rows for patient_list one part at a time, reading only the indexed blocks
+
+    Parameters:
+        patient_list: pat_ids to look up
+        header_data: Enrollment header; raw lines are truncated to its width, lines with
+            fewer fields are dropped and counted as malformed (as read_ragged_part does)
+        index: Index from build_enroll_index() (built/updated if None)
+        metrics: Optional instrument.PartLog; one record per part read
+    """
+    if index is None:
+        index = build_enroll_index()
+    pat_set = set(str(pat_id).strip() for pat_id in patient_list)
+    hits = index[index['pat_id'].isin(pat_set)]
+
+    if metrics is None:
+        metrics = PartLog('lookup_enroll')
+
+    n_parts = 0
+    for part, part_hits in hits.groupby('part', sort=True):
+        locations = np.unique(part_hits['location'].to_numpy())
+        with metrics.part(part) as record:
+            with record.timer('parse'):
+                if part.endswith('.parquet'):
+                    parquet_file = pq.ParquetFile(part)
+                    record.bytes(sum(parquet_file.metadata.row_group(int(i)).total_byte_size for i in locations))
+                    data_part = parquet_as_text(parquet_file.read_row_groups(locations.tolist()).to_pandas())
+                else:
+                    lines = read_lines(part, locations)
+                    record.bytes(len(lines))
+                    data_part, line_stats = parse_ragged(lines, header_data, os.path.basename(part))
+                    record.rows(malformed=line_stats['short'])
+                    if line_stats['short'] or line_stats['wide']:
+                        print(f"{os.path.basename(part)}: dropped {line_stats['short']} short lines, "
+                              f"truncated {line_stats['wide']} wide lines", flush=True)
+            with record.timer('filter'):
+                data_part['pat_id'] = data_part['pat_id'].astype(str).str.strip()
+                filtered_data = data_part[data_part['pat_id'].isin(pat_set)]
+            record.rows(parsed=len(data_part), kept=len(filtered_data))
+        n_parts += 1
+        yield filtered_data
+
+    print(f"Enroll lookup: {len(pat_set)} patients -> {len(hits)} blocks in {n_parts} parts", flush=True)
+
+
+def lookup_enroll(patient_list, header_data=ENROLL_HEADER, index=None, metrics=None):
+    """Return the enroll_synth rows for patient_list as one DataFrame (see iter_enroll)."""
+    frames = list(iter_enroll(patient_list, header_data, index, metrics))
+    if not frames:
+        return pd.DataFrame(columns=header_data)
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == "__main__":
+    build_enroll_index()
@@ -0,0 +1,128 @@
+"""
+Per-part throughput and memory instrumentation for the IQVIA readers.
+
+Each reader wraps the work on one part in a PartLog record; on exit one JSON line
+is appended to ingest_metrics.jsonl with bytes read, rows parsed/kept/malformed, parse and
+filter seconds and the process's peak RSS. report_metrics() summarizes a run per
+stage so a slow refresh can be attributed to I/O + parsing or to filtering.
+
+    metrics = PartLog('7_read_enroll', year)
+    with metrics.part(file_path) as record:
+        with record.timer('parse'):
+            df = read_part(file_path, header)
+        with record.timer('filter'):
+            kept = df[df['pat_id'].isin(pat_set)]
+        record.rows(parsed=len(df), kept=len(kept))
+"""
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+import pandas as pd
+
+METRICS_FILE = 'ingest_metrics.jsonl'
+
+def new_run_id():
+    """Id of this stage process: start time, script name and pid."""
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{script}-{os.getpid()}"
+
+
+# One run per stage process (not inherited through the environment, so stages started
+# by run_pipeline.py never share a run); part_scheduler hands it to its pool workers
+RUN_ID = new_run_id()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class PartRecord:
+    def __init__(self, stage, year, file_path):
+        self.data = {
+            'run': RUN_ID, 'stage': stage, 'year': None if year is None else str(year),
+            'part': os.path.basename(file_path), 'pid': os.getpid(),
+            'bytes_read': os.path.getsize(file_path) if os.path.exists(file_path) else 0,
+            'rows_parsed': 0, 'rows_kept': 0, 'rows_malformed': 0, 'parse_seconds': 0.0, 'filter_seconds': 0.0,
+        }
+
+    @contextmanager
+    def timer(self, phase):
+        """Accumulate the time of the with-block into <phase>_seconds ('parse' or 'filter')."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.data[f'{phase}_seconds'] += time.perf_counter() - start_time
+
+    def rows(self, parsed=0, kept=0, malformed=0):
+        self.data['rows_parsed'] += parsed
+        self.data['rows_kept'] += kept
+        self.data['rows_malformed'] += malformed
+
+    def bytes(self, n_bytes):
+        """Override bytes_read (e.g. for index lookups that read only part of a file)."""
+        self.data['bytes_read'] = n_bytes
+
+
+class PartLog:
+    def __init__(self, stage, year=None, path=METRICS_FILE):
+        self.stage = stage
+        self.year = year
+        self.path = path
+
+    @contextmanager
+    def part(self, file_path):
+        record = PartRecord(self.stage, self.year, file_path)
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.data['total_seconds'] = time.perf_counter() - start_time
+            record.data['peak_rss_mb'] = peak_rss_mb()
+            self.write(record.data)
+
+    def write(self, data):
+        # One short append per record, so concurrent workers don't interleave lines
+        with open(self.path, 'a') as file:
+            file.write(json.dumps(data) + '\n')
+
+
+def load_metrics(path=METRICS_FILE, run=RUN_ID):
+    """Metrics of one run (all runs if run is None) as a DataFrame."""
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    metrics = pd.read_json(path, lines=True, dtype={'year': str, 'run': str})
+    if run is not None and not metrics.empty:
+        metrics = metrics[metrics['run'] == run]
+    return metrics
+
+
+def report_metrics(path=METRICS_FILE, run=RUN_ID):
+    """Print and return a per-stage summary of one run."""
+    metrics = load_metrics(path, run)
+    if metrics.empty:
+        print("No ingest metrics recorded", flush=True)
+        return metrics
+
+    if 'rows_malformed' not in metrics.columns:
+        metrics['rows_malformed'] = 0  # metrics files written before malformed lines were counted
+    summary = metrics.groupby('stage').agg(
+        parts=('part', 'count'), gb_read=('bytes_read', lambda x: x.sum() / 1e9),
+        rows_parsed=('rows_parsed', 'sum'), rows_kept=('rows_kept', 'sum'),
+        rows_malformed=('rows_malformed', lambda x: x.fillna(0).sum()),
+        parse_seconds=('parse_seconds', 'sum'), filter_seconds=('filter_seconds', 'sum'),
+        total_seconds=('total_seconds', 'sum'), peak_rss_mb=('peak_rss_mb', 'max'),
+    )
+    summary['read_mb_per_s'] = summary['gb_read'] * 1000 / summary['parse_seconds'].where(summary['parse_seconds'] > 0)
+    summary['kept_pct'] = 100 * summary['rows_kept'] / summary['rows_parsed'].where(summary['rows_parsed'] > 0)
+    other_seconds = summary['total_seconds'] - summary['parse_seconds'] - summary['filter_seconds']
+    summary['bound'] = pd.DataFrame({'read+parse': summary['parse_seconds'], 'filter': summary['filter_seconds'],
+                                     'other': other_seconds}).idxmax(axis=1)
+
+    print(f"Ingest metrics for run {run} ({path}):", flush=True)
+    print(summary.to_string(float_format=lambda x: f"{x:.2f}"), flush=True)
+    return summary
@@ -0,0 +1,59 @@
+"""
+Vectorized cleaning of patient-year fields: ZIP3 codes and age.
+
+normalize_zip3() / is_valid_zip3() are the column versions of the per-value
+helpers that 6_fill_in_enroll_data.py applied row by row (kept as
+normalize_zip3_value() / is_valid_zip3_value() for comparison);
+benchmark_normalize.py compares the two.
+"""
+import re
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+ZIP3_RE = re.compile(r'^\d{3}$')
+
+
+def normalize_zip3_value(val):
+    """Return first 3 digits of val if possible, otherwise None."""
+    if pd.isna(val):
+        return None
+    s = re.sub(r'\D', '', str(val))
+    return s[:3] if len(s) >= 3 else None
+
+
+def is_valid_zip3_value(val):
+    return bool(val) and bool(ZIP3_RE.match(str(val)))
+
+
+def normalize_zip3(values):
+    """First 3 digits of each value ('12345', '123-45' -> '123'); None if missing or under 3 digits."""
+    values = pd.Series(values, copy=False)
+    digits = values.astype(str).str.replace(r'\D', '', regex=True)
+    keep = values.notna() & (digits.str.len() >= 3)
+    return digits.str[:3].astype(object).where(keep, None)
+
+
+def is_valid_zip3(values):
+    """Boolean mask: value is exactly three digits."""
+    values = pd.Series(values, copy=False)
+    return values.notna() & values.astype(str).str.fullmatch(r'\d{3}').fillna(False).astype(bool)
+
+
+def has_zip3(values):
+    """Rows with a usable pat_zip3 (not missing and not the '.' placeholder)."""
+    values = pd.Series(values, copy=False)
+    return values.notna() & (values != '.')
+
+
+def pad_zip(values, width=3):
+    """ZIP codes as zero-padded strings (e.g. 7 -> '007' for ZIP3, 501 -> '00501' for ZIP5)."""
+    values = pd.Series(values, copy=False)
+    if is_numeric_dtype(values):
+        # read_csv parses all-digit columns as numbers (float if any are missing)
+        values = values.astype('Int64')
+    return values.astype(str).str.zfill(width)
+
+
+def compute_age(year, der_yob):
+    """year - der_yob as float; NaN where either is missing or not numeric."""
+    return pd.to_numeric(year, errors='coerce') - pd.to_numeric(der_yob, errors='coerce')
@@ -0,0 +1,114 @@
+"""
+Incremental onboarding of new or changed IQVIA partitions.
+
+Every stage that supports incremental mode records, per input partition (a
+claims_{year} folder, enroll_synth, an iqvia_pat_{year}.csv, ...), the digest
+it last processed in onboarding_state.json. With INCREMENTAL = True a stage
+only processes partitions whose digest changed and merges its results into the
+existing output with replace_years(), instead of recomputing 2010-2022.
+
+Stages 5-9 work row by row on (pat_id, year), so in incremental mode 5 writes
+only the affected years (recorded as delta_years) and 10 replaces those years
+in FINAL_DATA.csv.
+"""
+import os
+import json
+import hashlib
+import pandas as pd
+from read_iqvia import IQVIA_FOLDER, source_folder
+from sinks import write_csv
+
+# One switch for the whole chain: intermediate files 5-9 only hold delta years when it is on
+INCREMENTAL = False
+
+STATE_FILE = '/home/stofer@chapman.edu/federated_analysis/tableau/data/onboarding_state.json'
+DELTA_YEARS = 'delta_years'
+
+
+def available_years(dataset, claims_folder=IQVIA_FOLDER):
+    """Years with a {dataset}_{year} folder, e.g. claims_2023 once it is delivered."""
+    prefix = dataset + '_'
+    return sorted(name[len(prefix):] for name in os.listdir(claims_folder)
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def file_digest(*paths):
+    """Digest of the names, sizes and mtimes of paths."""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        st = os.stat(path)
+        digest.update(f'{os.path.basename(path)}|{st.st_size}|{int(st.st_mtime)}\n'.encode())
+    return digest.hexdigest()
+
+
+def partition_digest(dataset, year=None, claims_folder=IQVIA_FOLDER):
+    """Digest of a raw csv_in_parts partition; changes when a part is added, removed or rewritten."""
+    folder = source_folder(dataset, year, claims_folder=claims_folder)
+    return file_digest(*(os.path.join(folder, file) for file in os.listdir(folder) if file.endswith('.csv')))
+
+
+class OnboardingState:
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        if os.path.exists(path):
+            with open(path) as file:
+                self.state = json.load(file)
+        else:
+            self.state = {}
+
+    def changed(self, stage, digests):
+        """Partitions (keys of digests) whose digest differs from the one stage last processed."""
+        done = self.state.get(stage, {})
+        return sorted(partition for partition, digest in digests.items() if done.get(str(partition)) != digest)
+
+    def mark(self, stage, partition, digest):
+        """Record a processed partition (saved immediately, so a crash keeps earlier partitions)."""
+        self.state.setdefault(stage, {})[str(partition)] = digest
+        self.save()
+
+    def delta_years(self):
+        """Years written by stage 5 that stage 10 has not merged into FINAL_DATA.csv yet."""
+        return [int(year) for year in self.state.get(DELTA_YEARS, [])]
+
+    def set_delta_years(self, years):
+        self.state[DELTA_YEARS] = sorted(int(year) for year in years)
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.state, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def replace_years(path, delta, years, year_col='year'):
+    """
+    Merge delta into the CSV at path: rows of years are replaced by delta, other years are kept
+
+    Parameters:
+        path: Existing output (created from delta if missing)
+        delta: DataFrame with the recomputed rows of years
+        years: Years that were recomputed (their old rows are dropped even if delta has none);
+            the years present in delta are always replaced too, so a rerun never duplicates rows
+        year_col: Year column in both
+
+    Rows stay ordered by year (stable), and the file is replaced atomically. Nothing is
+    written when there are no years to replace.
+    """
+    years = set(str(year) for year in years) | set(delta[year_col].dropna().astype(str))
+    if not years:
+        print(f"No years to merge into {path}, left unchanged", flush=True)
+        return None
+    if os.path.exists(path):
+        existing = pd.read_csv(path, dtype=str)
+        kept = existing[~existing[year_col].isin(years)]
+        merged = pd.concat([kept, delta], ignore_index=True)
+    else:
+        kept = pd.DataFrame()
+        merged = delta
+    merged = merged.sort_values(year_col, key=lambda s: pd.to_numeric(s, errors='coerce'), kind='stable')
+
+    write_csv(merged, path)
+    print(f"Merged {len(delta)} rows for years {sorted(years)} into {path} "
+          f"({len(kept)} rows of other years kept)", flush=True)
+    return merged
@@ -0,0 +1,99 @@
+"""
+One-time conversion of the IQVIA csv_in_parts folders to a typed, compressed Parquet cache.
+
+Layout (under /sharefolder/IQVIA/parquet):
+    claims/year=2010/<part>.parquet    columns from header_claims_2010
+    enroll2/year=2010/<part>.parquet   columns from ENROLL2_HEADER
+    enroll_synth/<part>.parquet        columns from ENROLL_HEADER
+
+read_iqvia.list_parts() returns the Parquet part for every raw part whose cached copy
+is at least as new (the raw part otherwise), and read_iqvia.read_part() loads only
+the requested columns, skipping text parsing. The typed columns are cast back to str
+on read (read_iqvia.parquet_as_text), so a year that mixes cached and raw parts
+gives one set of column types.
+Parts whose Parquet file is newer than the source are skipped, so rerunning only
+converts new or changed parts.
+"""
+import os
+import time
+import concurrent.futures
+import pandas as pd
+from read_iqvia import (read_iqvia_header, read_part, read_ragged_part, source_folder, parquet_folder, list_parts,
+                        ENROLL_HEADER, ENROLL2_HEADER)
+
+YEARS = [str(year) for year in range(2010, 2023)]
+COMPRESSION = 'zstd'
+
+# Columns stored as numbers; columns ending in _dt are stored as dates; everything else
+# (pat_id, diag codes, ndc, zip3, ...) stays text so leading zeros are kept.
+INT_COLUMNS = ['der_yob', 'month_id', 'dayssup']
+
+
+def convert_types(data_part):
+    for col in data_part.columns:
+        if col.endswith('_dt'):
+            data_part[col] = pd.to_datetime(data_part[col], errors='coerce')
+        elif col in INT_COLUMNS:
+            data_part[col] = pd.to_numeric(data_part[col], errors='coerce').astype('Int32')
+    return data_part
+
+
+def read_source_part(file_path, header):
+    """Read a raw part; falls back to read_ragged_part() for parts with extra or missing columns."""
+    try:
+        return read_part(file_path, header)
+    except (pd.errors.ParserError, ValueError):
+        data_part, line_stats = read_ragged_part(file_path, header)
+        print(f"{os.path.basename(file_path)}: dropped {line_stats['short']} short lines, "
+              f"truncated {line_stats['wide']} wide lines", flush=True)
+        return data_part
+
+
+def convert_folder(dataset, header, year=None):
+    """Convert every csv part of one dataset folder. Returns the number of parts written."""
+    csv_files = list_parts(dataset, year, use_cache=False)
+    out_folder = parquet_folder(dataset, year)
+    os.makedirs(out_folder, exist_ok=True)
+
+    label = dataset if year is None else f"{dataset}_{year}"
+    written = 0
+    for i, file_path in enumerate(csv_files, start=1):
+        part_name = os.path.splitext(os.path.basename(file_path))[0]
+        out_path = os.path.join(out_folder, f"{part_name}.parquet")
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(file_path):
+            continue
+
+        data_part = convert_types(read_source_part(file_path, header))
+        # Write to a temp name first so an interrupted run never leaves a truncated part
+        tmp_path = out_path + '.tmp'
+        data_part.to_parquet(tmp_path, compression=COMPRESSION, index=False)
+        os.replace(tmp_path, out_path)
+        written += 1
+        print(f"[{label}] Converted part {i}/{len(csv_files)}", flush=True)
+    return written
+
+
+def convert_task(task):
+    dataset, header, year = task
+    start_time = time.time()
+    if not os.path.isdir(source_folder(dataset, year)):
+        print(f"Folder not found: {source_folder(dataset, year)}", flush=True)
+        return 0
+    written = convert_folder(dataset, header, year)
+    print(f"{dataset} {year or ''} done: {written} parts in {time.time() - start_time:.2f} seconds", flush=True)
+    return written
+
+
+def main():
+    header_data = read_iqvia_header()
+    tasks = [('claims', header_data[year], year) for year in YEARS if year in header_data]
+    tasks += [('enroll2', ENROLL2_HEADER, year) for year in YEARS]
+    tasks.append(('enroll_synth', ENROLL_HEADER, None))
+
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        written = sum(executor.map(convert_task, tasks))
+    print(f"Wrote {written} Parquet parts", flush=True)
+
+
+if __name__ == "__main__":
+    main()
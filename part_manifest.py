@@ -0,0 +1,126 @@
+"""
+Per-part completion manifests, so a crashed (year, part) ingest resumes where it stopped.
+
+Each finished part's result is pickled to <folder>/<stage>_<year>/<part>.pkl
+(atomic rename) and then recorded in that folder's manifest.jsonl together with
+the source part's size/mtime and a run key (e.g. a hash of the code lists). On
+restart only parts without a matching manifest entry are processed; the caller
+loads every part's result in part order, writes its final output atomically and
+then clears the manifest.
+
+    manifest = PartManifest('0_claims', year, key=config_key)
+    pending = manifest.pending(parts)
+    ...                                   # run resumable_task over the pending parts
+    part_results = manifest.load_all(parts)
+"""
+import os
+import json
+import pickle
+import shutil
+import hashlib
+
+MANIFEST_FOLDER = '/home/stofer@chapman.edu/federated_analysis/tableau/data/part_manifests'
+
+
+def config_key(*values):
+    """Short hash of the inputs that change a stage's per-part results (code lists, input files, ...)."""
+    digest = hashlib.sha1()
+    for value in values:
+        if isinstance(value, (set, frozenset, list, tuple)):
+            value = sorted(str(item) for item in value)
+        digest.update(repr(value).encode())
+    return digest.hexdigest()[:16]
+
+
+def file_key(path):
+    """Size/mtime fingerprint of an input file, for use in config_key()."""
+    st = os.stat(path)
+    return path, st.st_size, int(st.st_mtime)
+
+
+def fingerprint(file_path):
+    st = os.stat(file_path)
+    return {'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+
+class PartManifest:
+    def __init__(self, stage, year, key='', folder=MANIFEST_FOLDER):
+        self.stage = stage
+        self.year = str(year)
+        self.key = key
+        self.folder = os.path.join(folder, f'{stage}_{self.year}')
+        self.manifest_path = os.path.join(self.folder, 'manifest.jsonl')
+
+    def result_path(self, file_path):
+        return os.path.join(self.folder, os.path.basename(file_path) + '.pkl')
+
+    def completed(self):
+        """{part name: manifest entry} for parts finished under the current key."""
+        if not os.path.exists(self.manifest_path):
+            return {}
+        entries = {}
+        with open(self.manifest_path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # line cut short by a crash
+                if entry.get('key') == self.key:
+                    entries[entry['part']] = entry
+        return entries
+
+    def is_done(self, file_path, completed=None):
+        entry = (self.completed() if completed is None else completed).get(os.path.basename(file_path))
+        return (entry is not None and entry['fingerprint'] == fingerprint(file_path)
+                and os.path.exists(self.result_path(file_path)))
+
+    def pending(self, parts):
+        """Parts that still have to be processed."""
+        completed = self.completed()
+        return [file_path for file_path in parts if not self.is_done(file_path, completed)]
+
+    def save(self, file_path, result):
+        """Store one part's result, then record the part as done."""
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.result_path(file_path)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            pickle.dump(result, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        entry = {'part': os.path.basename(file_path), 'key': self.key, 'fingerprint': fingerprint(file_path)}
+        # One short append per part, so concurrent workers don't interleave lines
+        with open(self.manifest_path, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+
+    def load(self, file_path):
+        with open(self.result_path(file_path), 'rb') as file:
+            return pickle.load(file)
+
+    def load_all(self, parts):
+        """Results of every part, in the given (part) order. Raises if a part is not done."""
+        return list(self.iter_all(parts))
+
+    def iter_all(self, parts):
+        """load_all() one part at a time, so only one part's result is in memory (checked up front)."""
+        completed = self.completed()
+        missing = [file_path for file_path in parts if not self.is_done(file_path, completed)]
+        if missing:
+            raise RuntimeError(f"[{self.year}] {len(missing)} {self.stage} parts not finished, "
+                               f"e.g. {os.path.basename(missing[0])}")
+        return (self.load(file_path) for file_path in parts)
+
+    def clear(self):
+        """Remove the partial results once the final output has been written."""
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def resumable_task(year, file_path, *shared, task_fn, stage, key='', folder=MANIFEST_FOLDER):
+    """
+    Scheduler task wrapper: run task_fn(year, file_path, *shared) and save its result to the manifest
+
+    Use with functools.partial(resumable_task, task_fn=..., stage=..., key=...). Returns
+    None; the parent reads results back with PartManifest.load_all().
+    """
+    result = task_fn(year, file_path, *shared)
+    PartManifest(stage, year, key=key, folder=folder).save(file_path, result)
@@ -0,0 +1,125 @@
+"""
+(year, part)-level task scheduler for the per-year IQVIA readers (0_, 2_, 7_).
+
+Instead of handing whole years to ProcessPoolExecutor, every (year, part file)
+pair is its own task. Tasks are queued largest file first and idle workers pull
+the next one from the shared queue, so a big year (2021/2022) is spread over all
+cores instead of pinning one. Results are kept per task and grouped by year at
+the end; the caller merges each year.
+
+utilization_report() shows busy time per worker and compares the wall time with
+an estimate of the old one-process-per-year schedule.
+"""
+import os
+import time
+import heapq
+import concurrent.futures
+import pandas as pd
+import instrument
+from read_iqvia import list_parts
+
+
+def part_tasks(dataset, years):
+    """All (year, part path) tasks for a dataset, skipping years whose folder is missing."""
+    tasks = []
+    for year in years:
+        try:
+            tasks += [(year, file_path) for file_path in list_parts(dataset, year)]
+        except FileNotFoundError:
+            print(f"[{year}] No {dataset} parts found", flush=True)
+    return tasks
+
+
+# Data shipped once to each worker (see run_part_tasks shared=...)
+_shared = None
+
+
+def init_worker(shared, run_id):
+    global _shared
+    _shared = shared
+    # log the worker's parts under the run of the stage that started it
+    instrument.RUN_ID = run_id
+
+
+def timed_task(task_fn, year, file_path):
+    start_time = time.time()
+    if _shared is None:
+        result = task_fn(year, file_path)
+    else:
+        result = task_fn(year, file_path, _shared)
+    return result, os.getpid(), start_time, time.time()
+
+
+def run_part_tasks(tasks, task_fn, max_workers=None, shared=None):
+    """
+    Run task_fn(year, file_path) for every task across a process pool
+
+    Parameters:
+        tasks: List of (year, file_path)
+        task_fn: Picklable function (module-level or functools.partial) returning a per-part result
+        max_workers: Pool size (default: number of CPUs)
+        shared: Optional object sent once to each worker and passed as task_fn(year, file_path, shared),
+                for lookup data too big to pickle with every task
+
+    Returns:
+        results: {year: [per-part results in part order]}
+        errors: {year: [(file_path, exception)]}
+        timings: DataFrame with one row per finished task (year, part, pid, start, end, seconds)
+    """
+    # Largest parts first so the tail of the queue is made of small tasks
+    tasks = sorted(tasks, key=lambda task: os.path.getsize(task[1]), reverse=True)
+    part_order = {task: i for i, task in enumerate(sorted(tasks))}
+
+    results, errors, timing_rows = {}, {}, []
+    wall_start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                                initargs=(shared, instrument.RUN_ID)) as executor:
+        futures = {executor.submit(timed_task, task_fn, year, file_path): (year, file_path)
+                   for year, file_path in tasks}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            year, file_path = futures[future]
+            try:
+                result, pid, start_time, end_time = future.result()
+            except Exception as e:
+                print(f"[{year}] Error processing {os.path.basename(file_path)}: {e}", flush=True)
+                errors.setdefault(year, []).append((file_path, e))
+                continue
+            results.setdefault(year, []).append((part_order[(year, file_path)], result))
+            timing_rows.append({'year': year, 'part': os.path.basename(file_path), 'pid': pid,
+                                'start': start_time - wall_start, 'end': end_time - wall_start,
+                                'seconds': end_time - start_time})
+            if done % 50 == 0 or done == len(tasks):
+                print(f"Finished {done}/{len(tasks)} part tasks", flush=True)
+
+    results = {year: [result for _, result in sorted(parts, key=lambda part: part[0])]
+               for year, parts in results.items()}
+    return results, errors, pd.DataFrame(timing_rows)
+
+
+def estimate_year_schedule(year_seconds, n_workers):
+    """Wall time if each year were one task, greedily assigned largest-first (old behavior)."""
+    workers = [0.0] * n_workers
+    for seconds in sorted(year_seconds, reverse=True):
+        heapq.heappush(workers, heapq.heappop(workers) + seconds)
+    return max(workers) if workers else 0.0
+
+
+def utilization_report(timings):
+    """Print and return per-worker busy time/utilization for a run_part_tasks() timing table."""
+    if timings.empty:
+        print("No tasks finished", flush=True)
+        return pd.DataFrame()
+
+    wall_time = timings['end'].max()
+    report = timings.groupby('pid').agg(tasks=('part', 'count'), busy_seconds=('seconds', 'sum'),
+                                        last_finish=('end', 'max'))
+    report['utilization'] = report['busy_seconds'] / wall_time
+
+    year_seconds = timings.groupby('year')['seconds'].sum()
+    per_year_wall = estimate_year_schedule(year_seconds.tolist(), len(report))
+
+    print(report.to_string(float_format=lambda x: f"{x:.2f}"), flush=True)
+    print(f"Wall time: {wall_time:.1f}s, mean worker utilization: {report['utilization'].mean():.1%}", flush=True)
+    print(f"Estimated wall time with one task per year: {per_year_wall:.1f}s "
+          f"(mean utilization {year_seconds.sum() / (per_year_wall * len(report)):.1%})", flush=True)
+    return report
@@ -0,0 +1,135 @@
+"""
+Persistent pat_id <-> int64 dictionary shared by all stages.
+
+The dictionary is an append-only list of pat_id strings; a patient's integer code
+(pat_int) is its position in the list, so codes never change once assigned.
+Stages encode pat_id once and then join / dedupe / nunique on pat_int instead of
+object strings.
+
+pat_key ("<pat_id>_<n>") is split once into the structured pair (pat_int, pat_seq).
+
+    pat_dict = PatDict()
+    df['pat_int'] = pat_dict.encode(df['pat_id'])
+    ...
+    pat_dict.save()
+"""
+import os
+import fcntl
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+
+DATA_FOLDER = '/home/stofer@chapman.edu/federated_analysis/tableau/data'
+PAT_DICT_FILE = os.path.join(DATA_FOLDER, 'pat_id_dict.parquet')
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path + '.lock', held by one process (stage) at a time."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PatDict:
+    def __init__(self, path=PAT_DICT_FILE):
+        self.path = path
+        self.pat_ids, self.mtime = self.load()
+        self.saved = len(self.pat_ids)  # codes below this are on disk
+        self.added = 0
+
+    def __len__(self):
+        return len(self.pat_ids)
+
+    def load(self):
+        """(pat_ids on disk, file mtime); empty if there is no dictionary yet."""
+        if not os.path.exists(self.path):
+            return pd.Index([], dtype=object), None
+        mtime = os.path.getmtime(self.path)
+        return pd.Index(pd.read_parquet(self.path)['pat_id'].astype(str), dtype=object), mtime
+
+    def refresh(self):
+        """Pick up codes saved by other stages since this dictionary was loaded (only while nothing is unsaved)."""
+        if self.added or not os.path.exists(self.path) or os.path.getmtime(self.path) == self.mtime:
+            return
+        with file_lock(self.path):
+            self.pat_ids, self.mtime = self.load()
+        self.saved = len(self.pat_ids)
+
+    def encode(self, pat_ids, add_new=True):
+        """
+        pat_id strings -> int64 codes
+
+        Parameters:
+            pat_ids: Iterable/Series of pat_ids (stripped before lookup)
+            add_new: Assign new codes to unseen pat_ids; if False they are encoded as -1
+
+        Missing pat_ids are always encoded as -1.
+        """
+        pat_ids = pd.Series(pat_ids, copy=False)
+        missing = pat_ids.isna().to_numpy()
+        values = pat_ids.astype(str).str.strip().to_numpy(dtype=object)
+        codes = self.pat_ids.get_indexer(values)
+        unseen = (codes < 0) & ~missing
+        if add_new and unseen.any():
+            self.refresh()
+            codes = self.pat_ids.get_indexer(values)
+            unseen = (codes < 0) & ~missing
+        if add_new and unseen.any():
+            new_ids = pd.unique(values[unseen])
+            self.pat_ids = self.pat_ids.append(pd.Index(new_ids, dtype=object))
+            self.added += len(new_ids)
+            codes = self.pat_ids.get_indexer(values)
+        codes[missing] = -1
+        return codes.astype(np.int64)
+
+    def decode(self, pat_ints):
+        """int64 codes -> pat_id strings (codes must be >= 0)."""
+        return self.pat_ids.to_numpy()[np.asarray(pat_ints, dtype=np.int64)]
+
+    def save(self):
+        """
+        Append the new pat_ids to the dictionary file (under file_lock, atomic replace)
+
+        The file is reloaded first, so codes saved by another stage in the meantime are
+        kept. If that stage assigned the codes this one handed out to other pat_ids,
+        nothing is written and RuntimeError is raised (the stage has to be rerun).
+        """
+        if not self.added:
+            return
+        with file_lock(self.path):
+            on_disk, _ = self.load()
+            new_ids = self.pat_ids[self.saved:]
+            pat_ids = on_disk.append(new_ids[~new_ids.isin(on_disk)])
+            if not pat_ids[:len(self.pat_ids)].equals(self.pat_ids):
+                raise RuntimeError(f"{self.path} was extended by another stage after this one assigned "
+                                   f"{self.added} new codes; rerun the stage")
+
+            tmp_path = self.path + '.tmp'
+            pd.DataFrame({'pat_id': pat_ids.to_numpy()}).to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+        print(f"Saved pat_id dictionary: {len(pat_ids)} patients ({self.added} new)", flush=True)
+        self.pat_ids = pat_ids
+        self.saved = len(pat_ids)
+        self.added = 0
+
+
+def split_pat_key(pat_keys):
+    """Split "<pat_id>_<n>" keys into a DataFrame of pat_id (str) and pat_seq (Int64); both NaN without a numeric suffix."""
+    parts = pd.Series(pat_keys, copy=False).astype(str).str.extract(r'^(.*)_(\d+)$')
+    return pd.DataFrame({
+        'pat_id': parts[0],
+        'pat_seq': pd.to_numeric(parts[1]).astype('Int64'),
+    })
+
+
+def encode_pat_keys(pat_keys, pat_dict):
+    """pat_key strings -> DataFrame of (pat_int, pat_seq)."""
+    split = split_pat_key(pat_keys)
+    return pd.DataFrame({'pat_int': pat_dict.encode(split['pat_id']), 'pat_seq': split['pat_seq']},
+                        index=split.index)
@@ -0,0 +1,114 @@
+"""
+Byte-level prefilter for claims parts: keep only lines that contain a target code
+(NDC or diagnosis) as a whole |-delimited field, before pandas tokenizes anything.
+
+Uses Aho-Corasick (pyahocorasick) when it is installed, otherwise a single regex
+compiled from a trie of the codes. The prefilter never drops a line that has a
+code as a full field, but it can keep lines where the code sits in some other
+column, so callers must still apply their exact filter (e.g. ndc.isin(codes))
+to the parsed rows.
+
+    matcher = CodeMatcher(ndc_codes)
+    candidates = matcher.filter_file(file_path)   # bytes of the candidate lines
+"""
+import re
+import numpy as np
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+BLOCK_SIZE = 64 * 1024 * 1024
+LEFT_DELIMITERS = ('|', '\n')
+RIGHT_DELIMITERS = ('|', '\n', '\r')
+
+
+def trie_regex(codes):
+    """Regex source matching any of codes, factored by common prefix (faster than a flat alternation)."""
+    trie = {}
+    for code in codes:
+        node = trie
+        for char in code:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def to_regex(node):
+        branches = []
+        ends_here = '' in node
+        for char in sorted(key for key in node if key):
+            branches.append(re.escape(char) + to_regex(node[char]))
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if ends_here:
+            return '(?:' + body + ')?'
+        return body
+
+    return to_regex(trie)
+
+
+class CodeMatcher:
+    def __init__(self, codes):
+        self.codes = sorted(set(str(code).strip() for code in codes if str(code).strip()))
+        if not self.codes:
+            raise ValueError("No codes to match")
+        self.lines_scanned = 0
+        self.lines_kept = 0
+
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for code in self.codes:
+                for left in LEFT_DELIMITERS:
+                    for right in RIGHT_DELIMITERS:
+                        self.automaton.add_word(left + code + right, len(code))
+            self.automaton.make_automaton()
+            self.pattern = None
+        else:
+            self.automaton = None
+            source = '[|\n](?:' + trie_regex(self.codes) + ')(?=[|\r\n])'
+            self.pattern = re.compile(source.encode('latin-1'))
+
+    def match_offsets(self, text):
+        """Start offsets of every delimited code in text (bytes starting with '\\n')."""
+        if self.automaton is not None:
+            # latin-1 maps bytes 1:1 to characters, so offsets are byte offsets
+            offsets = [end - code_len for end, code_len in self.automaton.iter(text.decode('latin-1'))]
+            return np.array(offsets, dtype=np.int64)
+        return np.fromiter((match.start() + 1 for match in self.pattern.finditer(text)), dtype=np.int64)
+
+    def filter_block(self, block):
+        """Candidate lines of block (bytes of whole lines, ending with '\\n')."""
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        self.lines_scanned += len(newlines)
+
+        # Prefix a newline so a code in the first field of the first line is delimited too
+        offsets = self.match_offsets(b'\n' + block) - 1
+        if not len(offsets):
+            return b''
+        lines = np.unique(np.searchsorted(newlines, offsets))
+        self.lines_kept += len(lines)
+
+        starts = np.concatenate(([0], newlines[:-1] + 1))[lines]
+        ends = newlines[lines] + 1
+        return b''.join(block[start:end] for start, end in zip(starts, ends))
+
+    def iter_filter_file(self, file_path, block_size=BLOCK_SIZE):
+        """Read a raw part in blocks of about block_size bytes and yield the candidate lines of each (may be empty)."""
+        carry = b''
+        with open(file_path, 'rb') as file:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                block = carry + block
+                cut = block.rfind(b'\n') + 1
+                carry = block[cut:]
+                if cut:
+                    yield self.filter_block(block[:cut])
+        if carry:
+            yield self.filter_block(carry + b'\n')
+
+    def filter_file(self, file_path, block_size=BLOCK_SIZE):
+        """Read a raw part in blocks and return the bytes of its candidate lines."""
+        return b''.join(self.iter_filter_file(file_path, block_size))
@@ -0,0 +1,177 @@
+"""
+Precomputed GLP1-RA patient cube, built once from FINAL_DATA.csv (read in chunks).
+
+The finest grain is weighted_zip x county_fips x pat_state x year x pay_type x condition
+(county_fips comes from uszips.csv through zip_enrichment.py). Two Parquet tables
+under data/rate_cube/ hold it:
+
+    cells.parquet     cell, <the six dimensions>, patients   distinct patients per finest cell
+    members.parquet   cell, pat_int                          each distinct (cell, patient), pat_int
+                                                             being a cube-local integer code
+
+Roll-ups to any subset of the dimensions never read FINAL_DATA again. When every
+patient-year falls in exactly one cell (FINAL_DATA has one row per patient-year),
+any grouping that keeps year is a plain sum of the cell counts; other groupings
+(e.g. state over all years, where a patient is in several cells) count distinct
+(group, pat_int) pairs of members.parquet, which is integers only.
+
+The cube is exact only: it ignores hll.APPROX_DISTINCT and stores no HyperLogLog
+registers, so members.parquet (and memory while rolling up across years) grows
+with the number of distinct (cell, patient) pairs. Where that is too big, count
+with rate_engine.distinct_counter and hll.APPROX_DISTINCT = True instead.
+
+    cube = RateCube()
+    cube.counts(['pat_state', 'year'])                              # same as the calculate_* numerators
+    cube.counts(['county_fips'], where={'pay_type': 'Commercial'})  # distinct patients over all years
+    cube.rates(['pat_state', 'year'], state_pop.rename(columns={'state_abbrev': 'pat_state'}), 'population')
+"""
+import os
+import numpy as np
+import pandas as pd
+from schema import apply_schema
+from rate_engine import CHUNK_ROWS, DistinctCounter, read_chunks
+from zip_enrichment import TABLEAU_FOLDER, ZipEnrichment
+
+FINAL_DATA_FILE = os.path.join(TABLEAU_FOLDER, 'FINAL_DATA.csv')
+CUBE_FOLDER = os.path.join(TABLEAU_FOLDER, 'data', 'rate_cube')
+
+DIMENSIONS = ['weighted_zip', 'county_fips', 'pat_state', 'year', 'pay_type', 'condition']
+
+
+def table_paths(folder=CUBE_FOLDER):
+    return os.path.join(folder, 'cells.parquet'), os.path.join(folder, 'members.parquet')
+
+
+def write_table(df, path):
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def build_cube(final_data_file=FINAL_DATA_FILE, folder=CUBE_FOLDER, zips=None, chunksize=CHUNK_ROWS):
+    """
+    Read FINAL_DATA once, chunksize rows at a time, and write cells.parquet / members.parquet
+
+    Each chunk's dimension values are matched to the cells seen so far (new ones are
+    appended) and its (cell, patient) pairs go to a DistinctCounter; the cells are
+    renumbered in sorted dimension order at the end.
+    """
+    os.makedirs(folder, exist_ok=True)
+    cells_path, members_path = table_paths(folder)
+
+    columns = ['pat_id'] + [dim for dim in DIMENSIONS if dim != 'county_fips']
+    zips = ZipEnrichment() if zips is None else zips
+    keys = None                     # MultiIndex of the dimension values (as read) seen so far, cell = position
+    counter = DistinctCounter(['cell'])
+    rows = 0
+    for chunk in read_chunks(final_data_file, columns, chunksize, dtype={col: str for col in columns}):
+        county = zips.attributes(chunk['weighted_zip'], ['county_fips'])['county_fips']
+        chunk['county_fips'] = county.astype('Int64').astype(str).where(county.notna()).str.zfill(5)
+
+        chunk_keys = pd.MultiIndex.from_frame(chunk[DIMENSIONS])
+        if keys is None:
+            keys = chunk_keys.unique()
+        cell = keys.get_indexer(chunk_keys)
+        if (cell < 0).any():
+            keys = keys.append(chunk_keys[cell < 0].unique())
+            cell = keys.get_indexer(chunk_keys)
+        counter.add(pd.DataFrame({'cell': cell, 'pat_id': chunk['pat_id'].to_numpy()}))
+        rows += len(chunk)
+
+    # cell ids in sorted dimension order (missing values last), as a sorted groupby would number them
+    cells = apply_schema(keys.to_frame(index=False)) if keys is not None else pd.DataFrame(columns=DIMENSIONS)
+    order = cells.sort_values(DIMENSIONS, na_position='last').index.to_numpy()
+    renumber = np.empty(len(cells), dtype=np.int64)
+    renumber[order] = np.arange(len(cells))
+
+    members = counter.members()
+    members['cell'] = renumber[members['cell'].to_numpy(dtype=np.int64)]
+    members = members.sort_values(['cell', 'pat_int']).reset_index(drop=True)
+
+    cells = cells.iloc[order].reset_index(drop=True)
+    cells.insert(0, 'cell', np.arange(len(cells)))
+    cells['patients'] = np.bincount(members['cell'], minlength=len(cells))
+
+    write_table(members, members_path)
+    write_table(cells, cells_path)
+    print(f"Rate cube: {rows:,} rows -> {len(cells):,} cells, {len(members):,} cell patients -> {folder}", flush=True)
+
+
+def is_stale(final_data_file=FINAL_DATA_FILE, folder=CUBE_FOLDER):
+    paths = table_paths(folder)
+    if not all(os.path.exists(path) for path in paths):
+        return True
+    return os.path.getmtime(final_data_file) > min(os.path.getmtime(path) for path in paths)
+
+
+class RateCube:
+    def __init__(self, folder=CUBE_FOLDER, final_data_file=FINAL_DATA_FILE):
+        if is_stale(final_data_file, folder):
+            build_cube(final_data_file, folder)
+        cells_path, members_path = table_paths(folder)
+        self.cells = pd.read_parquet(cells_path)
+        self.members = pd.read_parquet(members_path)
+        # cell year of every member row; True when no patient is in two cells of the same year
+        member_years = self.cells['year'].to_numpy()[self.members['cell'].to_numpy()]
+        self.one_cell_per_patient_year = not pd.DataFrame(
+            {'pat_int': self.members['pat_int'].to_numpy(), 'year': member_years}).duplicated().any()
+
+    def select(self, where=None):
+        """Cells matching where ({dimension: value or list of values}); all cells if None."""
+        cells = self.cells
+        for dim, values in (where or {}).items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            cells = cells[cells[dim].isin(list(values))]
+        return cells
+
+    def counts(self, by=(), where=None, name='glp1ra_patients'):
+        """
+        Distinct patients per group
+
+        Parameters:
+            by: Subset of DIMENSIONS to group by (empty for one overall count)
+            where: Optional {dimension: value or list of values} filter on the cells
+            name: Name of the count column
+
+        Returns:
+            DataFrame of the by columns and name, sorted by the by columns
+        """
+        by = list(by)
+        cells = self.select(where)
+        if by and 'year' in by and self.one_cell_per_patient_year:
+            return (cells.groupby(by, observed=True, dropna=False, sort=True)['patients'].sum()
+                    .rename(name).reset_index())
+
+        # distinct (group, pat_int) pairs over the member rows of the selected cells
+        if by:
+            group = cells.groupby(by, observed=True, dropna=False, sort=True).ngroup().to_numpy()
+            keys = cells[by].assign(group=group).drop_duplicates('group').sort_values('group')
+        else:
+            group = np.zeros(len(cells), dtype=np.int64)
+            keys = pd.DataFrame(index=range(1))
+        cell_group = np.full(len(self.cells), -1, dtype=np.int64)
+        cell_group[cells['cell'].to_numpy()] = group
+
+        member_group = cell_group[self.members['cell'].to_numpy()]
+        keep = member_group >= 0
+        n_pats = int(self.members['pat_int'].max()) + 1 if len(self.members) else 1
+        pairs = np.unique(member_group[keep] * n_pats + self.members['pat_int'].to_numpy()[keep])
+        patients = np.bincount(pairs // n_pats, minlength=len(keys))
+
+        result = keys[by].reset_index(drop=True)
+        result[name] = patients
+        return result
+
+    def rates(self, by, denominator, denominator_col, where=None, name='glp1ra_patients', per=1000):
+        """
+        counts() joined (left) with a denominator table on the by columns, plus a rate per `per`
+
+        The rate column is named rate_per_{per}; it is NaN where the denominator is missing or 0.
+        """
+        result = self.counts(by, where, name).merge(denominator[list(by) + [denominator_col]], on=list(by), how='left')
+        result[f'rate_per_{per}'] = result[name] / result[denominator_col].where(result[denominator_col] != 0) * per
+        return result
+
+
+if __name__ == "__main__":
+    build_cube()
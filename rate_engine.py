@@ -0,0 +1,178 @@
+"""
+Shared rate engine for the calculate_glp1ra_rate_* scripts (and the chunked
+FINAL_DATA reader used by 11_lr_model.py).
+
+Instead of filtering FINAL_DATA once per year and grouping each slice, the
+numerator (unique GLP1-RA patients) is computed for every (year, state) cell in
+one grouped pass, the denominator (state population, diabetes patient counts,
+...) is joined once, and the per-year outputs are views over that one table:
+
+    counts, year_rows = patient_counts(read_chunks('FINAL_DATA.csv', ['pat_id', 'year', 'pat_state']), years)
+    result = join_denominator(counts, state_pop[['year', 'state_abbrev', 'population']], years)
+    result['prescribing_rate_per_1000'] = result['glp1ra_patients'] / result['population'] * 1000
+    for year, view in year_views(result, int_columns=['population']):
+        ...
+
+FINAL_DATA is read out of core: only the needed columns, CHUNK_ROWS rows at a
+time. DistinctCounter keeps the exact distinct (group, patient) pairs across
+chunks as one int64 each (patients coded by the counter itself, in order of first
+appearance), so memory grows with the number of distinct pairs and patients, not
+with the rows or columns of FINAL_DATA. The shared pat_codes.PatDict is never touched.
+With hll.APPROX_DISTINCT = True, distinct_counter() returns HyperLogLog sketches
+(hll.SketchCounter) instead, for approximate counts in fixed memory per group.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+import hll
+
+KEYS = ['year', 'state_abbrev']
+CHUNK_ROWS = 1_000_000
+# Buffered pairs/registers are merged into the sorted set once they outnumber it (at least this many),
+# so every element is re-sorted O(log) times in total instead of once per chunk
+MIN_MERGE = 1_000_000
+
+
+def read_chunks(path, columns, chunksize=CHUNK_ROWS, dtype=None):
+    """pd.read_csv of only the given columns, chunksize rows at a time (pat_id read as str unless dtype says otherwise)."""
+    dtype = {'pat_id': str, **(dtype or {})}
+    return pd.read_csv(path, usecols=columns, dtype={col: t for col, t in dtype.items() if col in columns},
+                       chunksize=chunksize)
+
+
+class DistinctCounter:
+    """
+    Exact distinct-patient counts per group, fed one chunk at a time
+
+    Same result as df.groupby(by)[pat_col].nunique() over all chunks together: rows
+    with a missing group key are not counted, groups whose patients are all missing count 0.
+    Integer patient columns (pat_int) are used as codes directly, others are coded
+    locally (stripped pat_id -> position in self.patients).
+    """
+    def __init__(self, by, pat_col='pat_id'):
+        self.by = list(by)
+        self.pat_col = pat_col
+        self.patients = pd.Index([], dtype=object)   # pat_ids seen so far, code = position
+        self.groups = None                           # MultiIndex of the group keys seen so far
+        self.pairs = np.empty(0, dtype=np.int64)     # sorted unique group code << 32 | pat_int
+        self.buffer = []                             # per-chunk unique pairs not merged into self.pairs yet
+        self.buffered = 0
+
+    def add(self, df):
+        df = df.dropna(subset=self.by)
+        keys = pd.MultiIndex.from_frame(df[self.by])
+        if self.groups is None:
+            self.groups = keys.unique()
+        else:
+            codes = self.groups.get_indexer(keys)
+            if (codes < 0).any():
+                self.groups = self.groups.append(keys[codes < 0].unique())
+        groups = self.groups.get_indexer(keys).astype(np.int64)
+
+        pat_ints = self.encode(df[self.pat_col])
+        found = pat_ints >= 0
+        self.buffer.append(np.unique((groups[found] << 32) | pat_ints[found]))
+        self.buffered += len(self.buffer[-1])
+        if self.buffered >= max(len(self.pairs), MIN_MERGE):
+            self.flush()
+
+    def flush(self):
+        """Merge the buffered pairs into the sorted unique pairs."""
+        if self.buffer:
+            self.pairs = np.unique(np.concatenate([self.pairs] + self.buffer))
+            self.buffer, self.buffered = [], 0
+
+    def encode(self, pat_ids):
+        if is_integer_dtype(pat_ids):
+            return pat_ids.to_numpy(dtype=np.int64)
+        missing = pat_ids.isna().to_numpy()
+        values = pd.Index(pat_ids.astype(str).str.strip().to_numpy(dtype=object))
+        codes = self.patients.get_indexer(values)
+        new = (codes < 0) & ~missing
+        if new.any():
+            self.patients = self.patients.append(values[new].unique())
+            codes = self.patients.get_indexer(values)
+        return np.where(missing, -1, codes).astype(np.int64)
+
+    def members(self, pat_name='pat_int'):
+        """The distinct (group, patient code) pairs: DataFrame of the by columns and pat_name."""
+        if self.groups is None:
+            return pd.DataFrame(columns=self.by + [pat_name])
+        self.flush()
+        result = self.groups[self.pairs >> 32].to_frame(index=False)
+        result[pat_name] = self.pairs & 0xFFFFFFFF
+        return result
+
+    def counts(self, name='patients'):
+        """DataFrame of the by columns and name, sorted by the by columns."""
+        if self.groups is None:
+            return pd.DataFrame(columns=self.by + [name])
+        self.flush()
+        result = self.groups.to_frame(index=False)
+        result[name] = np.bincount(self.pairs >> 32, minlength=len(result))
+        return result.sort_values(self.by).reset_index(drop=True)
+
+
+def distinct_counter(by, pat_col='pat_id'):
+    """Exact DistinctCounter, or a HyperLogLog hll.SketchCounter when hll.APPROX_DISTINCT is set."""
+    if hll.APPROX_DISTINCT:
+        return hll.SketchCounter(by, pat_col, hll.DEFAULT_PRECISION)
+    return DistinctCounter(by, pat_col)
+
+
+def patient_counts(chunks, years, state_col='pat_state', pat_col='pat_id', name='glp1ra_patients'):
+    """
+    Unique patients per (year, state) for all years at once
+
+    Parameters:
+        chunks: DataFrame with year, state_col and pat_col, or an iterable of such
+            DataFrames (read_chunks of FINAL_DATA.csv)
+        years: Years to count; rows of other years are ignored
+        state_col: State column of the data (renamed to state_abbrev)
+        pat_col: Patient id column
+        name: Name of the count column
+
+    Returns:
+        (DataFrame of year, state_abbrev, name, Series of the number of rows per year
+        over all years); rows with a missing state are not counted
+    """
+    if isinstance(chunks, pd.DataFrame):
+        chunks = [chunks]
+    counter = distinct_counter(['year', state_col], pat_col)
+    year_rows = []
+    for chunk in chunks:
+        year_rows.append(chunk['year'].value_counts(dropna=False))
+        counter.add(chunk[chunk['year'].isin(list(years))])
+
+    counts = counter.counts(name)
+    counts.columns = KEYS + [name]
+    year_rows = pd.concat(year_rows).groupby(level=0, dropna=False).sum() if year_rows else pd.Series(dtype=int)
+    return counts, year_rows
+
+
+def join_denominator(counts, denominator, years, count_col='glp1ra_patients'):
+    """
+    Outer join of the counts with a denominator table keyed by (year, state_abbrev)
+
+    Only denominator rows of the given years (normally the years with data) are kept.
+    Missing counts become 0; rows come out sorted by year and state.
+    """
+    denominator = denominator[denominator['year'].isin(list(years))]
+    result = counts.merge(denominator, on=KEYS, how='outer')
+    result[count_col] = result[count_col].fillna(0).astype(int)
+    return result
+
+
+def year_views(result, int_columns=()):
+    """
+    Yield (year, rows of that year) from one groupby over result, in year order
+
+    int_columns: Integer columns that became float in the outer join (because some
+    other year has gaps); they are integer again in every view without missing values.
+    """
+    for year, view in result.groupby('year', sort=True):
+        view = view.copy()
+        for col in int_columns:
+            if view[col].notna().all() and (view[col] % 1 == 0).all():
+                view[col] = view[col].astype('int64')
+        yield year, view
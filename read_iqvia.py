@@ -1,5 +1,19 @@
+import io
+import csv
+import numpy as np
 import pandas as pd
 import os
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from prefilter import CodeMatcher
+from instrument import PartLog
+
+IQVIA_FOLDER = '/sharefolder/IQVIA'
+PARQUET_FOLDER = os.path.join(IQVIA_FOLDER, 'parquet')
+
+# Enrollment file headers
+ENROLL_HEADER = ['der_sex', 'der_yob', 'pat_id', 'pat_region', 'pat_state', 'pat_zip3',
+                 'grp_indv_cd', 'mh_cd', 'enr_rel']
+ENROLL2_HEADER = ['pat_id', 'mstr_enroll_cd', 'prd_type', 'pay_type', 'pcob_type', 'mcob_type', 'month_id']
 
 def read_ndc_codes():
     file_path = '/home/stofer@chapman.edu/merck_proposal/ndc_codes.txt'
@@ -28,28 +42,267 @@ def read_iqvia_header():
             header_data[year] = header
     return header_data
 
-def read_iqvia_claims(year, header_data, ndc_codes):
-    claims_folder = '/sharefolder/IQVIA'  
-    year_folder = os.path.join(claims_folder, 'claims_{}'.format(year))
-    csv_in_parts_folder = os.path.join(year_folder, 'csv_in_parts')
-    csv_files = [file for file in os.listdir(csv_in_parts_folder) if file.endswith('.csv')]
+def source_folder(dataset, year=None, claims_folder=IQVIA_FOLDER):
+    """csv_in_parts folder for a dataset: claims_{year}, enroll2_{year} or enroll_synth."""
+    folder_name = dataset if year is None else '{}_{}'.format(dataset, year)
+    return os.path.join(claims_folder, folder_name, 'csv_in_parts')
+
+def parquet_folder(dataset, year=None):
+    """Parquet cache folder for a dataset, partitioned by year (see parquet_cache.py)."""
+    if year is None:
+        return os.path.join(PARQUET_FOLDER, dataset)
+    return os.path.join(PARQUET_FOLDER, dataset, 'year={}'.format(year))
+
+def list_parts(dataset, year=None, use_cache=True, claims_folder=IQVIA_FOLDER):
+    """
+    Part files for a dataset, preferring the Parquet cache
+
+    Each raw .csv part is replaced by its cached .parquet part only if that exists and
+    is at least as new as the raw part, so new or changed raw parts are always read
+    from the source. Without a raw folder, the cached parts are used as they are.
+    """
+    cache_folder = parquet_folder(dataset, year)
+    csv_in_parts_folder = source_folder(dataset, year, claims_folder=claims_folder)
+    if use_cache and os.path.isdir(cache_folder) and not os.path.isdir(csv_in_parts_folder):
+        parquet_files = sorted(file for file in os.listdir(cache_folder) if file.endswith('.parquet'))
+        return [os.path.join(cache_folder, file) for file in parquet_files]
+
+    csv_files = sorted(file for file in os.listdir(csv_in_parts_folder) if file.endswith('.csv'))
+    parts = []
+    for file in csv_files:
+        csv_path = os.path.join(csv_in_parts_folder, file)
+        cached_path = os.path.join(cache_folder, os.path.splitext(file)[0] + '.parquet')
+        if use_cache and os.path.exists(cached_path) and os.path.getmtime(cached_path) >= os.path.getmtime(csv_path):
+            parts.append(cached_path)
+        else:
+            parts.append(csv_path)
+    return parts
+
+def list_claim_parts(year, use_cache=True):
+    return list_parts('claims', year, use_cache=use_cache)
+
+def parquet_as_text(data_part):
+    """
+    Cast the typed columns of a cached Parquet part back to str (dates as YYYY-MM-DD),
+    so callers get the same types whether a part was read from the cache or the raw text
+    """
+    for col in data_part.columns:
+        values = data_part[col]
+        if is_datetime64_any_dtype(values):
+            data_part[col] = values.dt.strftime('%Y-%m-%d')
+        elif is_numeric_dtype(values):
+            data_part[col] = values.astype(str).where(values.notna())
+    return data_part
+
+def read_part(file_path, header, columns=None, matcher=None):
+    """
+    Read one part (raw |-delimited text or cached Parquet) with header as column names
+
+    Parameters:
+        file_path: Path to a .csv part or a .parquet part from the cache
+        header: Column names of the raw part, in file order
+        columns: Columns to load (None = all). Parquet reads only these columns.
+        matcher: Optional prefilter.CodeMatcher; only raw lines containing one of its codes
+                 are parsed. The caller must still apply its exact filter.
+
+    Returns:
+        DataFrame of str, for text and Parquet parts alike (see parquet_as_text)
+    """
+    if file_path.endswith('.parquet'):
+        return parquet_as_text(pd.read_parquet(file_path, columns=columns))
+
+    if columns is None:
+        names, usecols = header, None
+    else:
+        names = [col for col in header if col in set(columns)]
+        usecols = [header.index(col) for col in names]
+
+    source = file_path
+    if matcher is not None:
+        candidates = matcher.filter_file(file_path)
+        if not candidates:
+            return pd.DataFrame(columns=names, dtype=str)
+        source = io.BytesIO(candidates)
+
+    data_part = pd.read_csv(source, sep='|', header=None, dtype=str, usecols=usecols)
+    data_part.columns = names
+    return data_part
+
+def line_field_counts(data, sep=b'|'):
+    """
+    Number of sep-separated fields on each non-blank line of raw bytes
+
+    Blank (whitespace-only) lines are left out, as read_csv skips them. Fields are
+    counted by separators, so this assumes unquoted parts like the IQVIA exports.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if not len(buf):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(buf == ord('\n'))
+    if buf[-1] != ord('\n'):
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    # each segment runs up to the next line start, so it includes its own '\n' (whitespace, not sep)
+    n_sep = np.add.reduceat(buf == ord(sep), starts, dtype=np.int64)
+    n_text = np.add.reduceat(buf > ord(' '), starts, dtype=np.int64)  # non-whitespace bytes
+    return n_sep[n_text > 0] + 1
+
+def read_ragged_part(file_path, header):
+    """
+    Read a raw part whose lines may have more or fewer fields than header, with the C engine
+
+    Lines with extra fields are truncated to the header width; lines with fewer fields
+    are malformed and dropped. Use this instead of engine='python' for ragged parts.
+
+    Returns:
+        (DataFrame of str with header as columns, {'short': dropped lines, 'wide': truncated lines})
+    """
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    return parse_ragged(data, header, os.path.basename(file_path))
+
+def parse_ragged(data, header, label='part'):
+    """read_ragged_part on raw bytes (whole part, or lines fetched by offset as in enroll_index.py)."""
+    n_cols = len(header)
+    if not data.strip():
+        return pd.DataFrame(columns=header, dtype=str), {'short': 0, 'wide': 0}
+    data_part = pd.read_csv(io.BytesIO(data), sep='|', header=None, dtype=str, quoting=csv.QUOTE_NONE,
+                            names=range(n_cols), usecols=range(n_cols))
+    data_part.columns = header
+
+    field_counts = line_field_counts(data)
+    if len(field_counts) != len(data_part):
+        # line counting and the parser disagree (e.g. quoted newlines); keep every row
+        print(f"{label}: could not check line widths "
+              f"({len(field_counts)} lines, {len(data_part)} rows)", flush=True)
+        return data_part, {'short': 0, 'wide': 0}
+
+    short = field_counts < n_cols
+    if short.any():
+        data_part = data_part[~short].reset_index(drop=True)
+    return data_part, {'short': int(short.sum()), 'wide': int((field_counts > n_cols).sum())}
+
+def ndc_filter(ndc_codes):
+    """Return a consumer that keeps claim rows whose ndc is in ndc_codes."""
+    ndc_set = set(ndc_codes)
+
+    def consume(data_part):
+        return data_part[data_part['ndc'].isin(ndc_set)]
+    return consume
+
+def read_iqvia_claims(year, header_data, ndc_codes, prefilter=False):
+    keep_ndc = ndc_filter(ndc_codes)
+    # Only parse raw lines that contain one of the NDC codes (exact filter still applied below)
+    matcher = CodeMatcher(ndc_codes) if prefilter else None
+
+    metrics = PartLog('read_iqvia_claims', year)
 
     filtered_data_list =[]
     i = 0
-    for csv_file in csv_files:
+    for file_path in list_claim_parts(year):
         i += 1
-        file_path = os.path.join(csv_in_parts_folder, csv_file)
-        data_part = pd.read_csv(file_path, sep='|', header=None, dtype=str)
-        data_part.columns = header_data[year]
+        with metrics.part(file_path) as record:
+            with record.timer('parse'):
+                data_part = read_part(file_path, header_data[year], matcher=matcher)
 
-        # Filter observations where ndc code is in ndc_codes list
-        filtered_data = data_part[data_part['ndc'].isin(ndc_codes)]
+            # Filter observations where ndc code is in ndc_codes list
+            with record.timer('filter'):
+                filtered_data = keep_ndc(data_part)
+            record.rows(parsed=len(data_part), kept=len(filtered_data))
         filtered_data_list.append(filtered_data)
         print(f"Appended part {i} out of 200!", flush = True)
     combined_df = pd.concat(filtered_data_list, ignore_index = True)
     return combined_df
 
 
+# Rough in-memory cost of one parsed str field (Python object + pointer), used to size chunks
+BYTES_PER_FIELD = 64
+
+def rows_per_chunk(file_path, n_cols, max_memory_mb):
+    """Rows to parse at a time so one parsed chunk stays under max_memory_mb."""
+    with open(file_path, 'rb') as file:
+        sample = file.read(1024 * 1024)
+    line_bytes = len(sample) / max(sample.count(b'\n'), 1)
+    return max(1000, int(max_memory_mb * 1024 * 1024 / (line_bytes + n_cols * BYTES_PER_FIELD)))
+
+def iter_part_chunks(file_path, header, max_memory_mb=256, columns=None, matcher=None):
+    """
+    Yield one part (raw text or cached Parquet) in chunks of bounded memory, optionally prefiltered
+
+    With a matcher, the raw part is prefiltered in blocks of a quarter of max_memory_mb,
+    and the candidate lines of each block are parsed in chunks before the next block is read.
+    """
+    n_cols = len(columns or header)
+    if file_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        batch_size = max(1000, int(max_memory_mb * 1024 * 1024 / (n_cols * BYTES_PER_FIELD)))
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns):
+            yield parquet_as_text(batch.to_pandas())
+        return
+
+    chunksize = rows_per_chunk(file_path, n_cols, max_memory_mb)
+    if columns is None:
+        usecols, names = None, header
+    else:
+        names = [col for col in header if col in set(columns)]
+        usecols = [header.index(col) for col in names]
+
+    if matcher is None:
+        sources = [file_path]
+    else:
+        # prefilter one raw block at a time, so the candidate bytes never hold the whole part
+        block_size = max(1024 * 1024, max_memory_mb * 1024 * 1024 // 4)
+        sources = (io.BytesIO(candidates) for candidates in matcher.iter_filter_file(file_path, block_size)
+                   if candidates)
+    for source in sources:
+        for chunk in pd.read_csv(source, sep='|', header=None, dtype=str, usecols=usecols, chunksize=chunksize):
+            chunk.columns = names
+            yield chunk
+
+def stream_iqvia_claims(year, header_data, ndc_codes, max_memory_mb=256, prefilter=False):
+    """
+    Streaming read_iqvia_claims: yield NDC-filtered chunks of one claims year
+
+    Parameters:
+        year: Claims year (str)
+        header_data: Output of read_iqvia_header()
+        ndc_codes: NDC codes to keep
+        max_memory_mb: Memory ceiling for one parsed chunk
+        prefilter: Only parse raw lines containing an NDC code (see prefilter.py)
+
+    Yields:
+        Non-empty filtered DataFrames, in part order
+    """
+    keep_ndc = ndc_filter(ndc_codes)
+    matcher = CodeMatcher(ndc_codes) if prefilter else None
+    csv_files = list_claim_parts(year)
+    for i, file_path in enumerate(csv_files, start=1):
+        for chunk in iter_part_chunks(file_path, header_data[year], max_memory_mb, matcher=matcher):
+            filtered_data = keep_ndc(chunk)
+            if not filtered_data.empty:
+                yield filtered_data
+        print(f"Streamed part {i} out of {len(csv_files)}!", flush = True)
+
+def extract_iqvia_claims(year, header_data, ndc_codes, sink, max_memory_mb=256, buffer_mb=32, prefilter=False):
+    """
+    Write the NDC-filtered claims of one year to sink (sinks.CsvSink / sinks.ParquetSink)
+
+    Filtered rows are buffered up to buffer_mb before each write, so memory stays
+    around one parsed chunk (max_memory_mb) plus the buffer. Returns rows written.
+    """
+    buffer, buffered_bytes = [], 0
+    for filtered_data in stream_iqvia_claims(year, header_data, ndc_codes, max_memory_mb, prefilter=prefilter):
+        buffer.append(filtered_data)
+        buffered_bytes += filtered_data.memory_usage(deep=True).sum()
+        if buffered_bytes >= buffer_mb * 1024 * 1024:
+            sink.write(pd.concat(buffer, ignore_index=True))
+            buffer, buffered_bytes = [], 0
+    if buffer:
+        sink.write(pd.concat(buffer, ignore_index=True))
+    return sink.rows
+
+
 def read_header():
     header_folder = '/sharefolder/IQVIA/header'
     header_files = [file_name for file_name in os.listdir(header_folder) if file_name.startswith('header_claims_')]
@@ -0,0 +1,368 @@
+"""
+Dependency-aware runner for the numbered stages and the calculate_* scripts.
+
+Each stage declares the files it reads and writes (paths relative to WORK_DIR,
+globs allowed). A stage depends on every stage that writes one of its inputs,
+and runs as soon as those are done, so independent stages (e.g. 12_ and the two
+calculate_* scripts) run at the same time.
+
+A stage is skipped when its script and the content hashes of its inputs are the
+same as at its last successful run and its outputs are still the files it
+wrote. Raw IQVIA parts (under IQVIA_FOLDER) are fingerprinted by name, size
+and mtime instead of content. Stages write their CSVs with sinks.write_csv(),
+so a killed run never leaves a half-written output.
+
+Outputs that used to be renamed by hand before the next stage (tableau_data_prep.csv
+-> tableau_data.csv, final_patient_year.csv -> patient_year.csv, MERGED_DATA.csv ->
+MERGED_DATA_FOR_LR.csv) are copied by CopyStages (copy_to_tableau_data, ...), so
+3_ -> 4_, 5_ -> 6_ and 11_ -> 12_ are real edges of the DAG and a changed upstream
+output reaches the later stages.
+
+    python run_pipeline.py                  # run everything that is stale
+    python run_pipeline.py 11_lr_model      # one stage (plus stale upstream stages)
+    python run_pipeline.py --dry-run
+"""
+import os
+import sys
+import glob
+import json
+import time
+import hashlib
+import argparse
+import shutil
+import subprocess
+import concurrent.futures
+from read_iqvia import IQVIA_FOLDER
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = '/home/stofer@chapman.edu/federated_analysis/tableau'
+CACHE_FILE = os.path.join(WORK_DIR, '.pipeline_cache.json')
+MAX_PARALLEL = 3
+
+CODES_FOLDER = '/home/stofer@chapman.edu/merck_proposal'
+NDC_FOLDER = '/sharefolder/wanglab/merck_proposal'
+GLP1_PAT_FILE = '/home/stofer@chapman.edu/federated_analysis/GLP1_pat_states.csv'
+
+
+class Stage:
+    """
+    Parameters:
+        name: Stage name (script file name without .py)
+        inputs: Files/globs the script reads
+        outputs: Files/globs the script writes
+        exclusive: Runs alone (the IQVIA readers already use every core, and stages that add
+            codes to the shared pat_id dictionary must not save it at the same time)
+    """
+
+    def __init__(self, name, inputs, outputs, exclusive=False):
+        self.name = name
+        self.script = os.path.join(REPO_DIR, name + '.py')
+        self.inputs = inputs
+        self.outputs = outputs
+        self.exclusive = exclusive
+
+
+class CopyStage(Stage):
+    """Copies one stage's output to the file name the next stage reads (the renames once done by hand)."""
+
+    def __init__(self, source, target):
+        super().__init__('copy_to_' + os.path.splitext(target)[0], [source], [target])
+        self.script = None
+
+
+STAGES = [
+    Stage('0_pull_all_T2Dobese_pats',
+          [f'{CODES_FOLDER}/glp_pats/obesity_codes.csv', f'{CODES_FOLDER}/glp_pats/t2d_codes.csv',
+           f'{CODES_FOLDER}/ndc_codes.txt', f'{IQVIA_FOLDER}/header/header_claims_*',
+           f'{IQVIA_FOLDER}/claims_*/csv_in_parts/*.csv'],
+          ['data/iqvia_pat_*.csv', 'data/pat_condition_by_year.parquet', f'{NDC_FOLDER}/iqvia_ndc_*.csv'],
+          exclusive=True),
+    Stage('1_count_pat_across_state_year',
+          ['data/iqvia_pat_*.csv', f'{IQVIA_FOLDER}/enroll_synth/csv_in_parts/*.csv'],
+          ['data/updated_state_counts.csv'], exclusive=True),
+    Stage('2_pull_payment_info_GLP_pats',
+          [GLP1_PAT_FILE, f'{IQVIA_FOLDER}/enroll2_*/csv_in_parts/*.csv'],
+          ['payment_type.csv'], exclusive=True),
+    Stage('3_compile_demo_info_GLP',
+          ['payment_type.csv', GLP1_PAT_FILE, 'data/pat_condition_by_year.parquet'],
+          ['tableau_data_prep.csv']),
+    CopyStage('tableau_data_prep.csv', 'tableau_data.csv'),
+    Stage('zip_enrichment',
+          ['uszips.csv', 'weighted_zip_by_zip3.csv'],
+          ['data/zip_enrichment/*.parquet']),
+    Stage('4_add_zip_info',
+          ['tableau_data.csv', 'data/zip_enrichment/*.parquet'],
+          ['tableau_data_final.csv']),
+    Stage('5_adjust_dataframe',
+          [f'{NDC_FOLDER}/iqvia_ndc_*.csv', 'tableau_data_final.csv'],
+          ['final_patient_year.csv'], exclusive=True),
+    CopyStage('final_patient_year.csv', 'patient_year.csv'),
+    Stage('rx_coverage',
+          [f'{NDC_FOLDER}/iqvia_ndc_*.csv'],
+          ['data/rx_coverage_by_month.parquet']),
+    Stage('6_fill_in_enroll_data',
+          ['patient_year.csv', f'{IQVIA_FOLDER}/enroll_synth/csv_in_parts/*.csv'],
+          ['patient_year_filled.csv'], exclusive=True),
+    Stage('7_fill_in_payment',
+          ['patient_year_filled.csv', f'{IQVIA_FOLDER}/enroll2_*/csv_in_parts/*.csv'],
+          ['payment_type_filled.csv'], exclusive=True),
+    Stage('8_fill_in_condition',
+          ['payment_type_filled.csv', 'data/pat_condition_by_year.parquet'],
+          ['payment_type_filled_with_condition.csv']),
+    Stage('9_fill_in_zip_data',
+          ['payment_type_filled_with_condition.csv', 'data/zip_enrichment/*.parquet'],
+          ['payment_almost_all_filled.csv']),
+    Stage('10_finalize_data',
+          ['payment_almost_all_filled.csv'],
+          ['FINAL_DATA.csv']),
+    Stage('rate_cube',
+          ['FINAL_DATA.csv', 'data/zip_enrichment/*.parquet'],
+          ['data/rate_cube/*.parquet']),
+    Stage('11_lr_model',
+          ['FINAL_DATA.csv', 'data/zip_enrichment/*.parquet', 'state_pop_estimates.csv'],
+          ['MERGED_DATA.csv']),
+    CopyStage('MERGED_DATA.csv', 'MERGED_DATA_FOR_LR.csv'),
+    Stage('12_add_rural_urban',
+          ['MERGED_DATA_FOR_LR.csv', 'RUCA-codes-2020-tract.csv'],
+          ['MERGED_DATA_FOR_LR_NEW.csv']),
+    # Updates MERGED_DATA_FOR_LR_NEW.csv in place
+    Stage('13_add_diabetes_rate_to_merged_data',
+          ['MERGED_DATA_FOR_LR_NEW.csv', 'data/updated_state_counts.csv'],
+          ['MERGED_DATA_FOR_LR_NEW.csv']),
+    Stage('14_final_modeling',
+          ['MERGED_DATA_example.csv'],
+          []),
+    Stage('calculate_glp1ra_rate_by_state_yearly',
+          ['FINAL_DATA.csv', 'state_pop_estimates.csv'],
+          ['glp1ra_rate_by_state_yearly/*.csv']),
+    Stage('calculate_glp1ra_rate_by_diabetes_patients',
+          ['FINAL_DATA.csv', 'data/updated_state_counts.csv'],
+          ['glp1ra_rate_by_diabetes_patients_yearly/*.csv']),
+]
+
+
+def dependencies(stages):
+    """{stage name: names of the stages that write one of its inputs}."""
+    writers = {}
+    for stage in stages:
+        for pattern in stage.outputs:
+            writers.setdefault(pattern, []).append(stage.name)
+    order = {stage.name: i for i, stage in enumerate(stages)}
+    deps = {}
+    for stage in stages:
+        # a stage that updates its own input (13_) only depends on earlier writers of it
+        deps[stage.name] = set(name for pattern in stage.inputs for name in writers.get(pattern, [])
+                               if order[name] < order[stage.name])
+    return deps
+
+
+class HashCache:
+    """Content hashes of files, memoized by (size, mtime) so unchanged files are not re-read."""
+
+    def __init__(self, memo=None):
+        self.memo = memo or {}
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        stat_key = [st.st_size, int(st.st_mtime)]
+        if path.startswith(IQVIA_FOLDER):
+            # raw deliveries are too big to read just to hash them
+            return 'stat:{}:{}'.format(*stat_key)
+        cached = self.memo.get(path)
+        if cached and cached[:2] == stat_key:
+            return cached[2]
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(16 * 1024 * 1024), b''):
+                digest.update(block)
+        self.memo[path] = stat_key + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def pattern_hash(self, pattern):
+        """Hash of every file matching pattern (None if nothing matches)."""
+        path = pattern if os.path.isabs(pattern) else os.path.join(WORK_DIR, pattern)
+        paths = sorted(glob.glob(path))
+        if not paths:
+            return None
+        digest = hashlib.sha1()
+        for file_path in paths:
+            digest.update(f'{file_path}|{self.file_hash(file_path)}\n'.encode())
+        return digest.hexdigest()
+
+
+def stage_signature(stage, hashes):
+    return {
+        'script': hashes.file_hash(stage.script) if stage.script else None,
+        'inputs': {pattern: hashes.pattern_hash(pattern) for pattern in stage.inputs},
+    }
+
+
+def rewritten_outputs(stages):
+    """{stage name: its outputs that a later stage updates in place (12_'s output, updated by 13_)}."""
+    rewritten = {}
+    for i, stage in enumerate(stages):
+        later = set(pattern for other in stages[i + 1:] for pattern in other.outputs)
+        rewritten[stage.name] = set(stage.outputs) & later
+    return rewritten
+
+
+def is_fresh(stage, record, hashes, rewritten=()):
+    """True if the last successful run used the same script/inputs and its outputs are untouched."""
+    if record is None:
+        return False
+    for pattern in stage.outputs:
+        if pattern not in rewritten and hashes.pattern_hash(pattern) != record['outputs'].get(pattern):
+            return False
+    signature = stage_signature(stage, hashes)
+    if signature['script'] != record['script']:
+        return False
+    for pattern, input_hash in signature['inputs'].items():
+        # an in-place output is expected to look like what the stage wrote
+        expected = record['outputs'][pattern] if pattern in stage.outputs else record['inputs'].get(pattern)
+        if input_hash != expected:
+            return False
+    return True
+
+
+def copy_file(stage, log):
+    """Run a CopyStage: atomic copy of its input to its output. Returns the exit code."""
+    (source,), (target,) = stage.inputs, stage.outputs
+    source, target = os.path.join(WORK_DIR, source), os.path.join(WORK_DIR, target)
+    try:
+        shutil.copyfile(source, target + '.tmp')
+        os.replace(target + '.tmp', target)
+    except OSError as e:
+        print(f"Copying {source} to {target} failed: {e}", file=log)
+        return 1
+    print(f"Copied {source} to {target}", file=log)
+    return 0
+
+
+def run_stage(stage):
+    start_time = time.time()
+    with open(os.path.join(WORK_DIR, 'logs', stage.name + '.log'), 'w') as log:
+        if isinstance(stage, CopyStage):
+            returncode = copy_file(stage, log)
+        else:
+            returncode = subprocess.run([sys.executable, stage.script], cwd=WORK_DIR, stdout=log,
+                                        stderr=subprocess.STDOUT).returncode
+    return returncode, time.time() - start_time
+
+
+def select_stages(stages, targets):
+    """targets and everything upstream of them (all stages if targets is empty)."""
+    if not targets:
+        return stages
+    deps = dependencies(stages)
+    unknown = set(targets) - set(deps)
+    if unknown:
+        raise ValueError(f"Unknown stages: {sorted(unknown)}")
+    selected, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in selected:
+            selected.add(name)
+            todo += deps[name]
+    return [stage for stage in stages if stage.name in selected]
+
+
+def run_pipeline(targets=(), force=False, dry_run=False, max_parallel=MAX_PARALLEL):
+    """
+    Run the stale stages of the DAG, independent stages concurrently
+
+    Parameters:
+        targets: Stage names to bring up to date (default: all)
+        force: Run the selected stages even if they are fresh
+        dry_run: Only print what would run
+        max_parallel: Max stages running at once
+
+    Returns:
+        {stage name: 'skipped' | 'done' | 'failed' | 'blocked'}
+    """
+    stages = select_stages(STAGES, targets)
+    deps = dependencies(stages)
+    rewritten = rewritten_outputs(stages)
+    by_name = {stage.name: stage for stage in stages}
+
+    cache = {}
+    if os.path.exists(CACHE_FILE):
+        with open(CACHE_FILE) as file:
+            cache = json.load(file)
+    hashes = HashCache(cache.get('file_hashes'))
+    records = cache.get('stages', {})
+    os.makedirs(os.path.join(WORK_DIR, 'logs'), exist_ok=True)
+
+    def save_cache():
+        tmp_path = CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({'stages': records, 'file_hashes': hashes.memo}, file, indent=1)
+        os.replace(tmp_path, CACHE_FILE)
+
+    status, running, signatures = {}, {}, {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        while len(status) < len(stages):
+            # start every stage whose upstream stages are finished
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                upstream = [status.get(name) for name in deps[stage.name]]
+                if any(state in ('failed', 'blocked') for state in upstream):
+                    status[stage.name] = 'blocked'
+                    print(f"[{stage.name}] blocked by a failed upstream stage", flush=True)
+                    continue
+                if any(state is None for state in upstream):
+                    continue
+                # an upstream stage that ran changes this stage's inputs, so only check freshness now
+                upstream_ran = dry_run and 'done' in upstream
+                if not force and not upstream_ran and is_fresh(stage, records.get(stage.name), hashes, rewritten[stage.name]):
+                    status[stage.name] = 'skipped'
+                    print(f"[{stage.name}] up to date, skipped", flush=True)
+                    continue
+                if dry_run:
+                    status[stage.name] = 'done'
+                    print(f"[{stage.name}] would run", flush=True)
+                    continue
+                exclusive_running = any(by_name[name].exclusive for name in running.values())
+                if running and (stage.exclusive or exclusive_running):
+                    continue
+                if len(running) >= max_parallel:
+                    break
+                signatures[stage.name] = stage_signature(stage, hashes)
+                print(f"[{stage.name}] running (log: logs/{stage.name}.log)", flush=True)
+                running[executor.submit(run_stage, stage)] = stage.name
+
+            if not running:
+                continue
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, seconds = future.result()
+                if returncode == 0:
+                    status[name] = 'done'
+                    records[name] = dict(signatures[name], outputs={
+                        pattern: hashes.pattern_hash(pattern) for pattern in by_name[name].outputs})
+                    save_cache()
+                    print(f"[{name}] finished in {seconds:.1f}s", flush=True)
+                else:
+                    status[name] = 'failed'
+                    records.pop(name, None)
+                    save_cache()
+                    print(f"[{name}] FAILED with exit code {returncode} after {seconds:.1f}s", flush=True)
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('targets', nargs='*', help='Stages to bring up to date (default: all)')
+    parser.add_argument('--force', action='store_true', help='Run the selected stages even if up to date')
+    parser.add_argument('--dry-run', action='store_true', help='Only show what would run')
+    parser.add_argument('--max-parallel', type=int, default=MAX_PARALLEL)
+    args = parser.parse_args()
+
+    status = run_pipeline(args.targets, force=args.force, dry_run=args.dry_run, max_parallel=args.max_parallel)
+    if any(state in ('failed', 'blocked') for state in status.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Patient x month GLP1-RA coverage from prescription fills (pat_id, to_dt, dayssup).
+
+A fill covers dayssup days starting at to_dt (at least its fill day; dayssup is
+parsed like rx_intervals.parse_dayssup). Each patient's fills are sorted and
+overlapping fills are merged into disjoint covered intervals with array ops
+(groupby cummax + reduceat, no Python loop over fills). The intervals are then
+split at month boundaries into one row per covered patient-month:
+
+    pat_id, month_id (YYYYMM), days_covered, pdc (days_covered / days in month)
+
+A month is "active" if it has a row. build_coverage() does this for all
+iqvia_ndc_{year}.csv files in bounded memory: fills are streamed in chunks,
+hash-partitioned by pat_id into bucket files, and each bucket (all fills of
+its patients) is processed on its own.
+"""
+import os
+import glob
+import shutil
+import numpy as np
+import pandas as pd
+from rx_intervals import parse_dayssup
+from sinks import ParquetSink
+
+NDC_FOLDER = '/sharefolder/wanglab/merck_proposal'
+COVERAGE_FILE = '/home/stofer@chapman.edu/federated_analysis/tableau/data/rx_coverage_by_month.parquet'
+N_BUCKETS = 64
+CHUNKSIZE = 5_000_000
+
+
+def fill_days(df):
+    """(start day, covered days) of each fill; start is days since 1970-01-01, NaT fills dropped."""
+    to_dt = pd.to_datetime(df['to_dt'], errors='coerce')
+    valid = to_dt.notna().to_numpy()
+    start = to_dt[valid].to_numpy().astype('datetime64[D]').astype(np.int64)
+    days = np.maximum(parse_dayssup(df['dayssup'])[valid], 1)
+    return valid, start, days
+
+
+def merge_intervals(pat_codes, start, end):
+    """
+    Union of [start, end) day intervals per patient
+
+    Returns:
+        (pat_codes, start, end) of the disjoint covered intervals, sorted by patient and start
+    """
+    order = np.lexsort((start, pat_codes))
+    pat_codes, start, end = pat_codes[order], start[order], end[order]
+    if not len(start):
+        return pat_codes, start, end
+
+    # a fill opens a new interval if it starts after everything the patient's earlier fills covered
+    covered_until = pd.Series(end).groupby(pat_codes).cummax().to_numpy()
+    new_interval = np.ones(len(start), dtype=bool)
+    new_interval[1:] = (pat_codes[1:] != pat_codes[:-1]) | (start[1:] > covered_until[:-1])
+
+    first = np.flatnonzero(new_interval)
+    return pat_codes[first], start[first], np.maximum.reduceat(end, first)
+
+
+def split_by_month(pat_codes, start, end):
+    """Covered days per (patient, month) for disjoint sorted intervals. Returns (pat_codes, months, days)."""
+    first_month = start.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    last_month = (end - 1).astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    n_months = last_month - first_month + 1
+
+    interval = np.repeat(np.arange(len(start)), n_months)
+    first_row = np.cumsum(n_months) - n_months
+    months = first_month[interval] + (np.arange(int(n_months.sum())) - first_row[interval])
+
+    month_begin = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    month_end = (months + 1).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    days = np.minimum(end[interval], month_end) - np.maximum(start[interval], month_begin)
+
+    # two intervals of a patient can share a month; rows are sorted, so merge neighbours
+    pats = pat_codes[interval]
+    new_key = np.ones(len(months), dtype=bool)
+    new_key[1:] = (pats[1:] != pats[:-1]) | (months[1:] != months[:-1])
+    first = np.flatnonzero(new_key)
+    return pats[first], months[first], np.add.reduceat(days, first) if len(first) else days
+
+
+def coverage_by_month(df):
+    """
+    Patient x month coverage table for fills in memory
+
+    Parameters:
+        df: DataFrame with pat_id, to_dt and dayssup (or pat_id, start, days as written by partition_fills)
+
+    Returns:
+        DataFrame of pat_id (categorical), month_id (int32 YYYYMM), days_covered (int16), pdc (float32)
+    """
+    if 'start' in df.columns:
+        start, days = df['start'].to_numpy(np.int64), df['days'].to_numpy(np.int64)
+        pat_ids = df['pat_id']
+    else:
+        valid, start, days = fill_days(df)
+        pat_ids = df['pat_id'][valid]
+    pat_codes, uniques = pd.factorize(pat_ids.to_numpy())
+
+    pats, start, end = merge_intervals(pat_codes.astype(np.int64), start, start + days)
+    pats, months, covered = split_by_month(pats, start, end)
+
+    month_dates = months.astype('datetime64[M]')
+    days_in_month = ((month_dates + 1).astype('datetime64[D]') - month_dates.astype('datetime64[D]')).astype(np.int64)
+    return pd.DataFrame({
+        'pat_id': pd.Categorical.from_codes(pats, categories=uniques),
+        'month_id': ((months // 12 + 1970) * 100 + months % 12 + 1).astype(np.int32),
+        'days_covered': covered.astype(np.int16),
+        'pdc': (covered / days_in_month).astype(np.float32),
+    })
+
+
+def patient_summary(coverage):
+    """Per patient: active months, covered days, and PDC over the months from first to last active month."""
+    month_index = (coverage['month_id'] // 100) * 12 + coverage['month_id'] % 100
+    grouped = coverage.assign(month_index=month_index).groupby('pat_id', observed=True)
+    summary = grouped.agg(active_months=('month_id', 'size'), days_covered=('days_covered', 'sum'),
+                          first_month=('month_id', 'min'), last_month=('month_id', 'max'),
+                          first_index=('month_index', 'min'), last_index=('month_index', 'max'))
+    span_months = summary.pop('last_index') - summary.pop('first_index') + 1
+    summary['pdc_active_span'] = (summary['active_months'] / span_months).astype(np.float32)
+    return summary.reset_index()
+
+
+def partition_fills(files, bucket_folder, n_buckets=N_BUCKETS, chunksize=CHUNKSIZE):
+    """Stream fills into n_buckets Parquet files by hash(pat_id), as (pat_id, start, days)."""
+    os.makedirs(bucket_folder, exist_ok=True)
+    sinks = [ParquetSink(os.path.join(bucket_folder, f'bucket_{b:03d}.parquet')) for b in range(n_buckets)]
+    n_fills = 0
+    for path in files:
+        for chunk in pd.read_csv(path, usecols=['pat_id', 'to_dt', 'dayssup'], dtype={'pat_id': str},
+                                 chunksize=chunksize):
+            valid, start, days = fill_days(chunk)
+            fills = pd.DataFrame({'pat_id': chunk['pat_id'].to_numpy()[valid],
+                                  'start': start.astype(np.int32), 'days': days.astype(np.int32)})
+            buckets = pd.util.hash_array(fills['pat_id'].to_numpy(dtype=object)) % n_buckets
+            for b, part in fills.groupby(buckets):
+                sinks[b].write(part)
+            n_fills += len(fills)
+        print(f"Partitioned {os.path.basename(path)} ({n_fills:,} fills so far)", flush=True)
+    for sink in sinks:
+        sink.close()
+    return sorted(glob.glob(os.path.join(bucket_folder, 'bucket_*.parquet')))
+
+
+def build_coverage(files, output_path=COVERAGE_FILE, n_buckets=N_BUCKETS, chunksize=CHUNKSIZE):
+    """
+    Patient x month coverage of all fills in files, written to output_path (Parquet)
+
+    Peak memory is about one input chunk or one bucket (total fills / n_buckets).
+    Returns the number of patient-month rows written.
+    """
+    bucket_folder = output_path + '.buckets'
+    shutil.rmtree(bucket_folder, ignore_errors=True)
+    try:
+        bucket_files = partition_fills(files, bucket_folder, n_buckets, chunksize)
+        with ParquetSink(output_path) as sink:
+            for i, bucket_file in enumerate(bucket_files, start=1):
+                coverage = coverage_by_month(pd.read_parquet(bucket_file))
+                coverage['pat_id'] = coverage['pat_id'].astype(str)
+                sink.write(coverage)
+                print(f"Bucket {i}/{len(bucket_files)}: {len(coverage):,} patient-months", flush=True)
+        return sink.rows
+    finally:
+        shutil.rmtree(bucket_folder, ignore_errors=True)
+
+
+def main():
+    files = sorted(glob.glob(os.path.join(NDC_FOLDER, 'iqvia_ndc_*.csv')))
+    rows = build_coverage(files)
+    print(f"Saved {rows:,} patient-month rows to {COVERAGE_FILE}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Prescription fill intervals (to_dt + dayssup) as arrays.
+
+expand_to_years() is the vectorized version of the original row loop in
+5_adjust_dataframe.py (kept as expand_to_years_rowwise() for comparison): it
+computes each fill's first/last calendar year, repeats pat_id once per covered
+year and drops duplicate (pat_id, year) pairs through a packed int64 key.
+
+dayssup is parsed like int(dayssup) in the loop: whole-number strings and
+numbers (truncated) are used, missing or anything int() rejects counts as 0.
+"""
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+INT_RE = r'\s*[+-]?\d+\s*'
+
+
+def parse_dayssup(dayssup):
+    """dayssup -> int64 days, with the loop's fallback to 0 for missing/invalid values."""
+    dayssup = pd.Series(dayssup, copy=False)
+    if is_numeric_dtype(dayssup):
+        days = dayssup.astype('float64')
+    else:
+        is_str = dayssup.map(type).eq(str).to_numpy()
+        days = pd.to_numeric(dayssup.where(~is_str), errors='coerce').astype('float64')
+        if is_str.any():
+            text = dayssup[is_str].astype(str)
+            valid = text.str.fullmatch(INT_RE)
+            days[is_str] = pd.to_numeric(text.where(valid).str.strip(), errors='coerce').to_numpy()
+    days = np.trunc(days.to_numpy(dtype='float64'))
+    days[~np.isfinite(days)] = 0
+    return days.astype(np.int64)
+
+
+def year_span(df):
+    """First/last calendar year covered by each fill (to_dt .. to_dt + dayssup)."""
+    end = df["to_dt"] + pd.to_timedelta(parse_dayssup(df["dayssup"]), unit="D")
+    return df["to_dt"].dt.year, end.dt.year
+
+
+def expand_to_years(df):
+    """
+    One (pat_id, year) row per calendar year touched by each fill, duplicates dropped
+
+    Rows come out in the same order and with the same index as expand_to_years_rowwise().
+    Fills with a missing to_dt cover no year.
+    """
+    start_year, end_year = year_span(df)
+    start_year = start_year.to_numpy(dtype='float64')
+    n_years = end_year.to_numpy(dtype='float64') - start_year + 1
+    n_years = np.where(np.isnan(n_years), 0, np.clip(n_years, 0, None)).astype(np.int64)
+
+    # fill i contributes rows first_row[i] .. first_row[i] + n_years[i] - 1
+    total = int(n_years.sum())
+    first_row = np.cumsum(n_years) - n_years
+    fill = np.repeat(np.arange(len(df)), n_years)
+    years = np.nan_to_num(start_year).astype(np.int64)[fill] + (np.arange(total) - first_row[fill])
+
+    # dedupe on a packed (pat code, year offset) key instead of hashing object tuples
+    pat_codes, _ = pd.factorize(df["pat_id"].to_numpy())
+    year_offset = years - (years.min() if total else 0)
+    keys = (pat_codes[fill].astype(np.int64) + 1) * (int(year_offset.max()) + 1 if total else 1) + year_offset
+    first = ~pd.Index(keys).duplicated(keep='first')
+
+    rows = np.flatnonzero(first)
+    return pd.DataFrame({"pat_id": df["pat_id"].to_numpy()[fill[rows]], "year": years[rows]}, index=rows)
+
+
+def expand_to_years_rowwise(df):
+    """Original row-by-row expansion (reference for expand_to_years)."""
+    rows = []
+    for _, row in df.iterrows():
+        start = row["to_dt"]
+        try:
+            days = int(row["dayssup"]) if pd.notna(row["dayssup"]) else 0
+        except ValueError:
+            days = 0  # fallback if invalid value
+        end = start + timedelta(days=days)
+        for yr in range(start.year, end.year + 1):
+            rows.append({"pat_id": row["pat_id"], "year": yr})
+    return pd.DataFrame(rows).drop_duplicates()
@@ -0,0 +1,146 @@
+"""
+Single-pass scan of the claims_{year}/csv_in_parts partitions.
+
+Each part is read from disk once and handed to every registered consumer
+(diagnosis classifier, NDC extractor, ...). Each consumer gets its own output
+DataFrame, and the scanner keeps per-consumer byte/row counts.
+"""
+import os
+import time
+import pandas as pd
+from tqdm import tqdm
+from read_iqvia import list_claim_parts, read_part
+from prefilter import CodeMatcher
+from instrument import PartLog
+
+
+class ClaimsScanner:
+    """
+    Parameters:
+        year: Claims year
+        header_data: Output of read_iqvia_header()
+        prefilter_codes: Optional union of every consumer's target codes. Raw lines without
+                         any of them are dropped before parsing (see prefilter.py), so each
+                         consumer must apply its own exact filter.
+    """
+
+    def __init__(self, year, header_data, prefilter_codes=None):
+        self.year = str(year)
+        self.header = header_data[self.year]
+        self.matcher = CodeMatcher(prefilter_codes) if prefilter_codes else None
+        self.consumers = {}
+        self.columns = {}
+        self.stats = {}
+        self.bytes_read = 0
+        self.metrics = PartLog('scan_claims', self.year)
+
+    def register(self, name, consumer, columns=None):
+        """
+        Register a consumer for this year's claims
+
+        Parameters:
+            name: Key for the consumer's output and stats
+            consumer: Function taking a data_part DataFrame and returning the rows to keep
+            columns: Header columns the consumer needs (None = all columns)
+        """
+        self.consumers[name] = consumer
+        self.columns[name] = columns
+        self.stats[name] = {'parts': 0, 'bytes_read': 0, 'rows_in': 0, 'rows_kept': 0, 'seconds': 0.0}
+
+    def usecols(self):
+        """Union of the registered consumers' columns, or None if any consumer needs all of them."""
+        if any(cols is None for cols in self.columns.values()):
+            return None
+        needed = set(col for cols in self.columns.values() for col in cols)
+        return [col for col in self.header if col in needed]
+
+    def read_part(self, file_path):
+        return read_part(file_path, self.header, columns=self.usecols(), matcher=self.matcher)
+
+    def scan_part(self, file_path):
+        """Read one part and feed it to every consumer. Returns {name: filtered DataFrame}."""
+        with self.metrics.part(file_path) as record:
+            with record.timer('parse'):
+                data_part = self.read_part(file_path)
+            part_bytes = os.path.getsize(file_path)
+            self.bytes_read += part_bytes
+
+            outputs = {}
+            for name, consumer in self.consumers.items():
+                start_time = time.time()
+                cols = self.columns[name]
+                with record.timer('filter'):
+                    kept = consumer(data_part if cols is None else data_part[cols])
+
+                stats = self.stats[name]
+                stats['parts'] += 1
+                stats['bytes_read'] += part_bytes
+                stats['rows_in'] += len(data_part)
+                stats['rows_kept'] += len(kept)
+                stats['seconds'] += time.time() - start_time
+                outputs[name] = kept
+            record.rows(parsed=len(data_part), kept=sum(len(kept) for kept in outputs.values()))
+        return outputs
+
+    def run(self, csv_files=None):
+        """Scan all parts for the year. Returns {name: combined DataFrame}."""
+        if not self.consumers:
+            raise ValueError("No consumers registered")
+        if csv_files is None:
+            csv_files = list_claim_parts(self.year)
+
+        results = {name: [] for name in self.consumers}
+        for file_path in tqdm(csv_files, desc=f"Year {self.year}"):
+            for name, kept in self.scan_part(file_path).items():
+                if not kept.empty:
+                    results[name].append(kept)
+        return combine_outputs(results)
+
+    def merge(self, part_results):
+        """
+        Combine per-part results from other scanners (e.g. part_scheduler tasks)
+
+        Parameters:
+            part_results: List of (outputs, stats, bytes_read) as returned by scan_part_task()
+
+        Returns:
+            {name: combined DataFrame}; stats and bytes_read are accumulated into this scanner
+        """
+        results = {name: [] for name in self.consumers}
+        for outputs in self.stream(part_results):
+            for name, kept in outputs.items():
+                if not kept.empty:
+                    results[name].append(kept)
+        return combine_outputs(results)
+
+    def stream(self, part_results):
+        """
+        merge() one part at a time: yields each part's {name: filtered DataFrame} (in the
+        order of part_results, which may be a generator) and accumulates its stats
+        """
+        for outputs, stats, bytes_read in part_results:
+            self.bytes_read += bytes_read
+            for name in outputs:
+                for key, value in stats[name].items():
+                    self.stats[name][key] += value
+            yield outputs
+
+    def scan_part_task(self, file_path):
+        """scan_part() plus this scanner's stats, for merging in the parent process."""
+        outputs = self.scan_part(file_path)
+        return outputs, self.stats, self.bytes_read
+
+    def report(self):
+        """Print and return per-consumer stats, including bytes saved by sharing the scan."""
+        report = pd.DataFrame.from_dict(self.stats, orient='index')
+        report.index.name = 'consumer'
+        saved = report['bytes_read'].sum() - self.bytes_read
+        print(f"[{self.year}] Read {self.bytes_read / 1e9:.2f} GB once for {len(report)} consumers "
+              f"(saved {saved / 1e9:.2f} GB)", flush=True)
+        print(report.to_string(), flush=True)
+        return report
+
+
+def combine_outputs(results):
+    return {name: pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+            for name, parts in results.items()}
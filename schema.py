@@ -0,0 +1,110 @@
+"""
+Column types for the patient-year tables passed between stages 6_-10_
+(patient_year.csv -> patient_year_filled.csv -> payment_type_filled.csv ->
+payment_type_filled_with_condition.csv -> payment_almost_all_filled.csv -> FINAL_DATA.csv).
+
+Stages load and save these tables through read_table() / write_table() instead of
+holding every column as Python strings:
+
+    pat_state, der_sex, pay_type, condition   category (categories taken from the data)
+    age                                       Int8
+    year                                      Int16
+    ZIP attributes (income, education, ...)   float32
+    everything else (pat_id, pat_zip3, ...)   str, so leading zeros are kept
+
+Categoricals cannot take values outside their categories, so code that fills a
+categorical column first calls extend_categories(). The pay_type code -> name
+decoding (INSURANCE_MAP) is relabel() of the categories, not a per-row map.
+"""
+import numpy as np
+import pandas as pd
+from sinks import write_csv
+
+INSURANCE_MAP = {
+    "A": "Medicare Part C",
+    "C": "Commercial",
+    "K": "State Children's Health Insurance Program (SCHIP)",
+    "M": "Medicaid",
+    "R": "Medicare Risk",
+    "S": "Self-Insured",
+    "T": "Medicare Cost",
+    "U": "Unknown/Missing",
+    "X": "RX Only"
+}
+
+CATEGORY_COLUMNS = ['pat_state', 'der_sex', 'pay_type', 'condition']
+INT_COLUMNS = {'age': 'Int8', 'year': 'Int16'}
+FLOAT32_COLUMNS = [
+    'population', 'age_median', 'age_over_65', 'male', 'female',
+    'income_household_median', 'income_individual_median', 'poverty',
+    'education_less_highschool', 'education_highschool', 'education_some_college',
+    'education_bachelors', 'education_graduate',
+    'home_ownership', 'home_value', 'rent_median', 'rent_burden',
+    'labor_force_participation', 'unemployment_rate', 'health_uninsured', 'disabled',
+    'race_white', 'race_black', 'race_asian', 'hispanic',
+]
+
+
+def small_int(values, dtype):
+    """Numbers as a nullable small int dtype; left as float64 if any value is fractional or out of range."""
+    numbers = pd.to_numeric(values, errors='coerce')
+    finite = numbers.dropna()
+    info = np.iinfo(pd.api.types.pandas_dtype(dtype).numpy_dtype)
+    if (finite == np.trunc(finite)).all() and finite.between(info.min, info.max).all():
+        return numbers.astype(dtype)
+    return numbers.astype('float64')
+
+
+def apply_schema(df):
+    """Convert the schema columns present in df (in place) and return it."""
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col, dtype in INT_COLUMNS.items():
+        if col in df.columns:
+            df[col] = small_int(df[col], dtype)
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+    return df
+
+
+def read_table(path, **kwargs):
+    """pd.read_csv of a patient-year table with the schema applied (other columns stay str)."""
+    return apply_schema(pd.read_csv(path, dtype=str, **kwargs))
+
+
+def write_table(df, path):
+    """Write a patient-year table (atomic CSV, see sinks.write_csv) after applying the schema."""
+    write_csv(apply_schema(df.copy()), path)
+
+
+def extend_categories(values, new_values):
+    """For a categorical Series, add the values of new_values it has no category for; other Series are returned as is."""
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    new_values = pd.Series(new_values, copy=False).dropna().unique()
+    missing = pd.Index(new_values).difference(values.cat.categories)
+    return values.cat.add_categories(missing) if len(missing) else values
+
+
+def relabel(values, mapping, keep_unknown=True):
+    """
+    Rename the categories of values through mapping (one lookup per category, not per row)
+
+    Categories mapped to the same label are merged. Values with no entry in mapping
+    are kept (keep_unknown) or become NaN.
+    """
+    values = pd.Series(values, copy=False)
+    categorical = values.astype('category')
+    labels = pd.Series([mapping.get(category, category if keep_unknown else None)
+                        for category in categorical.cat.categories], dtype=object)
+    categories = pd.Index(labels.dropna().unique())
+    recode = np.append(categories.get_indexer(labels), -1)  # code -1 (NaN) stays -1
+    codes = recode[categorical.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index, name=values.name)
+
+
+def decode_pay_type(values, keep_unknown=True):
+    """pay_type codes ("C") -> names ("Commercial"); names already decoded are kept."""
+    return relabel(values, INSURANCE_MAP, keep_unknown=keep_unknown)
@@ -0,0 +1,100 @@
+"""
+Appending output sinks for streamed DataFrame chunks.
+
+Both sinks write to "<path>.tmp" and rename to <path> on close(), so an
+interrupted run never leaves a half-written output behind.
+
+    with ParquetSink('iqvia_ndc_2015.parquet') as sink:
+        for chunk in chunks:
+            sink.write(chunk)
+
+write_csv() does the same for a DataFrame written in one go.
+"""
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class Sink:
+    """Base of the appending sinks: write(df) chunks to tmp_path, close() renames it to path, abort() drops it."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.rows = 0
+
+    def write(self, df):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def abort(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class CsvSink(Sink):
+    def __init__(self, path):
+        super().__init__(path)
+        self.file = open(self.tmp_path, 'w', newline='')
+        self.header_written = False
+
+    def write(self, df):
+        df.to_csv(self.file, index=False, header=not self.header_written)
+        self.header_written = True
+        self.rows += len(df)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.tmp_path)
+
+
+def write_csv(df, path):
+    """df.to_csv(path, index=False), but atomic: a killed run leaves the old file (or none), never half of one."""
+    with CsvSink(path) as sink:
+        sink.write(df)
+
+
+class ParquetSink(Sink):
+    """Appends each chunk as a row group; the schema is fixed by the first chunk (no file if nothing is written)."""
+
+    def __init__(self, path, compression='zstd'):
+        super().__init__(path)
+        self.compression = compression
+        self.writer = None
+        self.schema = None
+
+    def write(self, df):
+        if self.writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+        else:
+            table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+        self.writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        os.remove(self.tmp_path)
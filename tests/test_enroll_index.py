@@ -0,0 +1,20 @@
+import json
+from enroll_index import index_part, iter_enroll
+from instrument import PartLog
+from read_iqvia import ENROLL_HEADER
+
+
+def test_indexed_lookup_drops_and_counts_short_lines(tmp_path):
+    part = tmp_path / 'part_0.csv'
+    part.write_text('F|1970|p1|S|CA|900|G|M|E\n'
+                    'M|1980|p2|S\n'                       # short: dropped and counted
+                    'F|1990|p3|S|NY|100|G|M|E|extra\n')   # wide: truncated to the header
+    metrics = PartLog('test_lookup', path=str(tmp_path / 'metrics.jsonl'))
+
+    index = index_part(str(part))
+    rows = list(iter_enroll(['p1', 'p2', 'p3'], ENROLL_HEADER, index=index, metrics=metrics))[0]
+
+    assert rows['pat_id'].tolist() == ['p1', 'p3']
+    assert rows['enr_rel'].tolist() == ['E', 'E']
+    record = json.loads((tmp_path / 'metrics.jsonl').read_text())
+    assert record['rows_malformed'] == 1
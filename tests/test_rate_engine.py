@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+import hll
+import rate_engine
+from rate_engine import DistinctCounter
+from hll import SketchCounter
+
+
+def synthetic_rows(n=20000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'pat_id': rng.integers(0, 3000, n).astype(str),
+                       'year': rng.choice([2015, 2016, 2017], n),
+                       'state': rng.choice(['CA', 'NY', 'MA', None], n)})
+    df.loc[::37, 'pat_id'] = None
+    return df
+
+
+def test_buffered_counts_match_one_pass(monkeypatch):
+    monkeypatch.setattr(rate_engine, 'MIN_MERGE', 500)   # merge the buffered pairs many times
+    monkeypatch.setattr(hll, 'MERGE_ROWS', 500)
+    df = synthetic_rows()
+    expected = df.dropna(subset=['year', 'state']).groupby(['year', 'state'])['pat_id'].nunique()
+
+    counter = DistinctCounter(['year', 'state'])
+    sketch, one_pass = SketchCounter(['year', 'state']), SketchCounter(['year', 'state'])
+    for start in range(0, len(df), 1000):
+        counter.add(df.iloc[start:start + 1000])
+        sketch.add(df.iloc[start:start + 1000])
+    one_pass.add(df)
+
+    assert counter.counts()['patients'].tolist() == expected.tolist()
+    assert sketch.counts().equals(one_pass.counts())
@@ -0,0 +1,47 @@
+import os
+import pandas as pd
+import read_iqvia
+from read_iqvia import ENROLL2_HEADER, list_parts, read_part, iter_part_chunks
+from parquet_cache import convert_types
+
+CLAIMS_HEADER = ['pat_id', 'to_dt', 'ndc']
+
+
+def write_parts(tmp_path, monkeypatch, dataset, header, parts):
+    """Raw csv_in_parts for dataset_2015 under tmp_path; the first part is also cached as Parquet."""
+    monkeypatch.setattr(read_iqvia, 'PARQUET_FOLDER', str(tmp_path / 'parquet'))
+    raw_folder = read_iqvia.source_folder(dataset, '2015', claims_folder=str(tmp_path))
+    cache_folder = read_iqvia.parquet_folder(dataset, '2015')
+    os.makedirs(raw_folder)
+    os.makedirs(cache_folder)
+    for i, lines in enumerate(parts):
+        with open(os.path.join(raw_folder, f'part_{i}.csv'), 'w') as file:
+            file.write(''.join('|'.join(line) + '\n' for line in lines))
+    cached = convert_types(read_part(os.path.join(raw_folder, 'part_0.csv'), header))
+    cached.to_parquet(os.path.join(cache_folder, 'part_0.parquet'), index=False)
+    return list_parts(dataset, '2015', claims_folder=str(tmp_path))
+
+
+def test_cached_and_raw_parts_of_one_year_read_as_str(tmp_path, monkeypatch):
+    parts = write_parts(tmp_path, monkeypatch, 'enroll2', ENROLL2_HEADER, [
+        [['p1', 'A', 'B', 'C', 'D', 'E', '201503'], ['p2', 'A', 'B', 'C', 'D', 'E', '']],
+        [['p3', 'A', 'B', 'M', 'D', 'E', '201501']],
+    ])
+    assert [os.path.splitext(part)[1] for part in parts] == ['.parquet', '.csv']
+
+    result = pd.concat([read_part(part, ENROLL2_HEADER) for part in parts], ignore_index=True)
+    assert result['month_id'].tolist()[:1] + result['month_id'].tolist()[2:] == ['201503', '201501']
+    assert result['month_id'].isna().tolist() == [False, True, False]
+    # what 7_fill_in_payment.merge_enroll_year does with the combined parts
+    assert result.sort_values('month_id')['pat_id'].tolist() == ['p3', 'p1', 'p2']
+
+
+def test_chunks_of_cached_and_raw_claims_parts_read_as_str(tmp_path, monkeypatch):
+    parts = write_parts(tmp_path, monkeypatch, 'claims', CLAIMS_HEADER, [
+        [['p1', '2015-03-02', '111']],
+        [['p2', '2015-04-05', '222']],
+    ])
+    chunks = [chunk for part in parts for chunk in iter_part_chunks(part, CLAIMS_HEADER)]
+    result = pd.concat(chunks, ignore_index=True)
+    assert result['to_dt'].tolist() == ['2015-03-02', '2015-04-05']
+    assert all(isinstance(value, str) for value in result['to_dt'])
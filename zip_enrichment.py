@@ -0,0 +1,117 @@
+"""
+Prebuilt ZIP enrichment tables shared by 4_add_zip_info.py, 9_fill_in_zip_data.py and 11_lr_model.py.
+
+uszips.csv and weighted_zip_by_zip3.csv are parsed once into Parquet
+(data/zip_enrichment/zip5.parquet and zip3.parquet, rebuilt when a CSV is newer).
+On load each table gets a dense integer index: an array over all 1,000 ZIP3 /
+100,000 ZIP5 codes holding the table row of that code (-1 if none). Attaching
+neighborhood attributes is then an array lookup plus DataFrame.take instead of
+zero-padding keys and running string merges.
+
+    zips = ZipEnrichment()
+    weighted = zips.zip3_columns(df['pat_zip3'])['weighted_zip']
+    attrs = zips.attributes(weighted, ['income_household_median', 'poverty'])
+
+Rows without a match get NaN, as in a left merge.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+TABLEAU_FOLDER = '/home/stofer@chapman.edu/federated_analysis/tableau'
+USZIPS_FILE = os.path.join(TABLEAU_FOLDER, 'uszips.csv')
+ZIP_MAP_FILE = os.path.join(TABLEAU_FOLDER, 'weighted_zip_by_zip3.csv')
+ENRICHMENT_FOLDER = os.path.join(TABLEAU_FOLDER, 'data', 'zip_enrichment')
+
+
+def zip_ints(values, digits):
+    """ZIP codes (str or numeric) -> int64; -1 where missing, not a whole number, or longer than digits."""
+    numbers = pd.to_numeric(pd.Series(values, copy=False), errors='coerce').to_numpy(dtype='float64')
+    valid = np.isfinite(numbers) & (numbers >= 0) & (numbers < 10 ** digits) & (numbers == np.trunc(numbers))
+    return np.where(valid, numbers, -1).astype(np.int64)
+
+
+def position_index(zips, digits):
+    """Dense array over all ZIP codes of the given length: code -> row position in zips (-1 if absent)."""
+    positions = np.full(10 ** digits, -1, dtype=np.int64)
+    codes = zip_ints(zips, digits)
+    valid = codes >= 0
+    # first row wins, like keep='first'
+    positions[codes[valid][::-1]] = np.flatnonzero(valid)[::-1]
+    return positions
+
+
+def table_paths(folder=ENRICHMENT_FOLDER):
+    return os.path.join(folder, 'zip3.parquet'), os.path.join(folder, 'zip5.parquet')
+
+
+def write_table(df, path):
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def build_tables(uszips_file=USZIPS_FILE, zip_map_file=ZIP_MAP_FILE, folder=ENRICHMENT_FOLDER):
+    """Parse the two CSVs once and write the Parquet tables (keys zero-padded as the stages did)."""
+    os.makedirs(folder, exist_ok=True)
+    zip3_path, zip5_path = table_paths(folder)
+
+    zip_map = pd.read_csv(zip_map_file, dtype={'zip3': str, 'weighted_zip': str})
+    zip_map['weighted_zip'] = zip_map['weighted_zip'].astype(str).str.zfill(5)
+    zip3_codes = zip_ints(zip_map['zip3'], 3)
+    duplicates = pd.Series(zip3_codes[zip3_codes >= 0]).duplicated().sum()
+    if duplicates:
+        print(f"{zip_map_file}: {duplicates} duplicate zip3 rows, using the first of each", flush=True)
+    write_table(zip_map, zip3_path)
+
+    us_zips = pd.read_csv(uszips_file, dtype={'zip': str})
+    us_zips['zip'] = us_zips['zip'].astype(str).str.zfill(5)
+    write_table(us_zips, zip5_path)
+    print(f"ZIP enrichment: {len(zip_map)} zip3 rows, {len(us_zips)} zip5 rows -> {folder}", flush=True)
+
+
+def is_stale(uszips_file=USZIPS_FILE, zip_map_file=ZIP_MAP_FILE, folder=ENRICHMENT_FOLDER):
+    paths = table_paths(folder)
+    if not all(os.path.exists(path) for path in paths):
+        return True
+    built = min(os.path.getmtime(path) for path in paths)
+    return any(os.path.getmtime(source) > built for source in (uszips_file, zip_map_file))
+
+
+class ZipEnrichment:
+    def __init__(self, uszips_file=USZIPS_FILE, zip_map_file=ZIP_MAP_FILE, folder=ENRICHMENT_FOLDER):
+        if is_stale(uszips_file, zip_map_file, folder):
+            build_tables(uszips_file, zip_map_file, folder)
+        zip3_path, zip5_path = table_paths(folder)
+        self.zip3 = pd.read_parquet(zip3_path)
+        self.zip5 = pd.read_parquet(zip5_path)
+        self.zip3_positions = position_index(self.zip3['zip3'], 3)
+        self.zip5_positions = position_index(self.zip5['zip'], 5)
+
+    @staticmethod
+    def take(table, positions, codes, columns, index):
+        """Rows of table for each code, aligned with index (NaN rows where there is no match)."""
+        rows = np.where(codes >= 0, positions[np.maximum(codes, 0)], -1)
+        found = rows >= 0
+        result = table[columns].take(rows[found])
+        result.index = np.flatnonzero(found)
+        if not found.all():
+            result = result.reindex(np.arange(len(rows)))
+        result.index = index
+        return result
+
+    def zip3_columns(self, zip3_values, columns=None):
+        """weighted_zip_by_zip3.csv columns (zip3, weighted_zip, ...) for each ZIP3 value."""
+        zip3_values = pd.Series(zip3_values, copy=False)
+        columns = list(self.zip3.columns) if columns is None else columns
+        return self.take(self.zip3, self.zip3_positions, zip_ints(zip3_values, 3), columns, zip3_values.index)
+
+    def attributes(self, zip_values, columns=None):
+        """uszips.csv columns (zip as a zero-padded string, population, income, ...) for each ZIP5 value."""
+        zip_values = pd.Series(zip_values, copy=False)
+        columns = list(self.zip5.columns) if columns is None else columns
+        return self.take(self.zip5, self.zip5_positions, zip_ints(zip_values, 5), columns, zip_values.index)
+
+
+if __name__ == "__main__":
+    build_tables()